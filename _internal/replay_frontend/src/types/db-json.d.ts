@@ -2,14 +2,14 @@ export interface Player {
   name: string
   score: number
   team: number
-  steam_id: number
+  steam_id: string
 }
 
 export interface ReplayMeta {
   protocol_version: number
   host_name: string
   game_mode: string
-  map_steam_id: number
+  map_steam_id: string
   map_title: string
   marker_count: number
   started_at: Date
@@ -29,10 +29,25 @@ export interface ChunkHeader {
   count: number
 }
 
+// v1: chunk index = replay index // max_chunk_size
+// v2: chunks are contiguous time ranges of up to max_chunk_size replays
+// both layouts are read the same way: `chunk_headers` in order, oldest first
 export interface DBHeader {
-  version: number
+  version: 1 | 2
   updated_at: Date
   total_count: number
   max_chunk_size: number
   chunk_headers: ChunkHeader[]
 }
+
+// index/players/<last 2 chars of steam_id>.json, index/maps/<last 2 chars of map_steam_id>.json
+// steam id -> replay count
+export type IndexShard = Record<string, number>
+
+// index/players/<steam_id>/<page>.json, same for index/maps
+// replay filenames, oldest first, in pages of 200: page = replay number // 200
+export type IndexPage = string[]
+
+// index/player_names/<hex code point of the first char>.json, same for index/map_titles
+// casefolded 1-2 char prefixes and trigrams -> name -> steam ids
+export type NgramIndexShard = Record<string, Record<string, string[]>>
@@ -0,0 +1,64 @@
+"""Throughput of compressing a large replay: zipfile (as ingestion did before)
+vs the block-parallel compressor with a growing number of threads.
+
+Run from the backend folder: `python -m benchmarks.bench_compress`
+"""
+
+import os
+import random
+import tempfile
+import time
+import zipfile
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from src.compression import compress_replay
+
+SIZE_MiB = 64
+THREADS = (1, 2, 4, 8)
+REPEATS = 3
+
+
+def make_replay(tmp: Path) -> Path:
+    replay = tmp / "large.rep"
+    # compresses about as well as real replays, unlike random or zeroed data
+    rng = random.Random(0)
+    alphabet = bytes(range(16))
+    chunk = bytes(rng.choices(alphabet, k=1024 * 1024))
+    with replay.open("wb") as f:
+        for _ in range(SIZE_MiB):
+            f.write(chunk[rng.randrange(1024) :] + chunk[: rng.randrange(1024)])
+    return replay
+
+
+def compress_zipfile(source: Path, target: Path):
+    with zipfile.ZipFile(target, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.write(source, source.name)
+
+
+def bench(compress: Callable[[Path, Path], None], source: Path) -> tuple[float, int]:
+    target = source.with_suffix(".rep.zip")
+    started = time.perf_counter()
+    for _ in range(REPEATS):
+        compress(source, target)
+    elapsed = (time.perf_counter() - started) / REPEATS
+    return elapsed, target.stat().st_size
+
+
+def report(label: str, source: Path, elapsed: float, size: int):
+    mib = source.stat().st_size / 1024 / 1024
+    print(f"{label:>12}: {mib / elapsed:7.1f} MiB/s, {size / 1024 / 1024:6.2f} MiB zip")
+
+
+if __name__ == "__main__":
+    print(f"{os.process_cpu_count()} CPUs, {SIZE_MiB} MiB replay")
+    with tempfile.TemporaryDirectory() as tmp:
+        source = make_replay(Path(tmp))
+        report("zipfile", source, *bench(compress_zipfile, source))
+        for threads in THREADS:
+            with ThreadPoolExecutor(threads) as executor:
+                elapsed, size = bench(
+                    lambda s, t: compress_replay(s, t, s.name, executor), source
+                )
+            report(f"{threads} threads", source, elapsed, size)
@@ -0,0 +1,52 @@
+"""Time until a finished match is visible: publishing metadata only,
+vs publishing after compression, as ingestion did before.
+
+Run from the backend folder: `python -m benchmarks.bench_ingest`
+"""
+
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from src.db import ReplayDB
+
+ASSETS = Path(__file__).parent.parent / "tests/assets"
+REPLAY = "Pocket_Infinity_Vigur_Ivan_O__05Jan2026_161301_0markers.rep"
+SIZES_MiB = (1, 10, 50)
+
+
+def make_db(tmp: Path) -> ReplayDB:
+    (tmp / "replays").mkdir()
+    return ReplayDB(tmp / "db", tmp / "replays")
+
+
+def bench(size_mib: int) -> tuple[float, float]:
+    with tempfile.TemporaryDirectory() as tmp:
+        db = make_db(Path(tmp))
+        replay_path = db.replay_folder / REPLAY
+        # frames compress about 2:1, as in real replays
+        frames = os.urandom(size_mib * 512 * 1024) * 2
+        replay_path.write_bytes((ASSETS / "replays" / REPLAY).read_bytes() + frames)
+
+        started = time.perf_counter()
+        replay = db.ingest_replay(REPLAY)
+        db.save_to_fs()
+        visible = time.perf_counter() - started
+
+        db.compress(replay.filename)
+        db.save_to_fs()
+        downloadable = time.perf_counter() - started
+        assert replay.downloadable
+        return visible, downloadable
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    for size_mib in SIZES_MiB:
+        visible, downloadable = bench(size_mib)
+        print(
+            f"{size_mib:>3} MiB: visible in {visible * 1000:7.2f} ms, "
+            f"compressing first took {downloadable * 1000:8.2f} ms"
+        )
@@ -0,0 +1,85 @@
+"""Cost of parsing a replay header: reading whole files vs the header only,
+and headers parsed per second by the struct fast path vs construct.
+
+Run from the backend folder: `python -m benchmarks.bench_parse`
+"""
+
+import os
+import tempfile
+import time
+import zipfile
+from collections.abc import Callable
+from pathlib import Path
+
+from src.model import ReplayMetadata
+from src.parser import (
+    parse_header,
+    parse_raw,
+    parse_zip_compressed,
+    replay_header_struct,
+)
+
+ASSET = (
+    Path(__file__).parent.parent
+    / "tests/assets/replays/Pocket_Infinity_Vigur_Ivan_O__05Jan2026_161301_0markers.rep"
+)
+SIZES_MiB = (1, 10, 50)
+REPEATS = 5
+HEADER_PARSES = 20_000
+
+
+def parse_raw_whole(replay: Path):
+    with open(replay, "rb") as f:
+        return replay_header_struct().parse(f.read())
+
+
+def parse_zip_whole(replay: Path):
+    with zipfile.ZipFile(replay, "r") as zf:
+        with zf.open(zf.namelist()[0], "r") as replay_stream:
+            return replay_header_struct().parse_stream(replay_stream)
+
+
+def parse_header_construct(header: bytes):
+    return ReplayMetadata.from_construct(replay_header_struct().parse(header))
+
+
+def headers_per_second(parse: Callable[[bytes], object], header: bytes) -> float:
+    started = time.perf_counter()
+    for _ in range(HEADER_PARSES):
+        parse(header)
+    return HEADER_PARSES / (time.perf_counter() - started)
+
+
+def make_replays(tmp: Path, size_mib: int) -> tuple[Path, Path]:
+    raw = tmp / f"{size_mib}MiB.rep"
+    # random frames, so the zip is as large as the real one would be
+    raw.write_bytes(ASSET.read_bytes() + os.urandom(size_mib * 1024 * 1024))
+    compressed = raw.with_suffix(".rep.zip")
+    with zipfile.ZipFile(compressed, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.write(raw, arcname=raw.name)
+    return raw, compressed
+
+
+def bench(parse: Callable[[Path], object], replay: Path) -> float:
+    started = time.perf_counter()
+    for _ in range(REPEATS):
+        parse(replay)
+    return (time.perf_counter() - started) / REPEATS
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp:
+        for size_mib in SIZES_MiB:
+            raw, compressed = make_replays(Path(tmp), size_mib)
+            print(
+                f"{size_mib:>3} MiB: "
+                f"raw whole {bench(parse_raw_whole, raw) * 1000:8.2f} ms, "
+                f"header {bench(parse_raw, raw) * 1000:6.2f} ms; "
+                f"zip stream {bench(parse_zip_whole, compressed) * 1000:6.2f} ms, "
+                f"header {bench(parse_zip_compressed, compressed) * 1000:6.2f} ms"
+            )
+
+    header = ASSET.read_bytes()
+    construct_rate = headers_per_second(parse_header_construct, header)
+    struct_rate = headers_per_second(parse_header, header)
+    print(f"headers/s: construct {construct_rate:,.0f}, struct {struct_rate:,.0f}")
@@ -0,0 +1,67 @@
+"""Cold start of the DB as the replay folder grows: a full reconciliation
+(stat of every file, as on every start before the manifest), one diffing
+a changed folder with the manifest, and an unchanged folder.
+
+The page cache is warm, on a cold one each saved stat is a disk seek.
+Run from the backend folder: `python -m benchmarks.bench_reconcile`
+"""
+
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.bench_save import make_replay
+from src.db import ReplayDB
+
+SIZES = (1_000, 10_000, 50_000)
+REPEATS = 3
+
+
+def make_folder(tmp: Path, size: int) -> tuple[Path, Path]:
+    db_path, replay_folder = tmp / "db", tmp / "replays"
+    replay_folder.mkdir()
+    db = ReplayDB(db_path, replay_folder, reconcile_on_init=False)
+    replays = [make_replay(idx) for idx in range(size)]
+    db._store.add(replays)
+    db._store.commit()
+    db.by_id.update((replay.id, replay) for replay in replays)
+    db.by_time.update(replays)
+    db.republish()
+    for replay in replays:
+        (replay_folder / replay.filename).write_bytes(b"replay")
+    return db_path, replay_folder
+
+
+def start(db_path: Path, replay_folder: Path, **kwargs) -> float:
+    """Best of a few starts, each one leaves the folder as it was."""
+    timings = []
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+        ReplayDB(db_path, replay_folder, **kwargs)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    for size in SIZES:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path, replay_folder = make_folder(Path(tmp), size)
+            start(db_path, replay_folder)  # marks all downloadable, once
+
+            load = start(db_path, replay_folder, reconcile_on_init=False)
+            full = start(db_path, replay_folder, full_reconcile_interval_seconds=0)
+            next(replay_folder.iterdir()).unlink()  # the folder has changed
+            changed = start(db_path, replay_folder)
+            os.utime(replay_folder, ns=(time.time_ns() - 60 * 10**9,) * 2)
+            start(db_path, replay_folder)  # records the aged folder's state
+            unchanged = start(db_path, replay_folder)
+
+            print(
+                f"{size:>7} files: load {load * 1000:7.1f} ms, + reconcile: "
+                f"full {(full - load) * 1000:7.1f} ms, "
+                f"changed {(changed - load) * 1000:7.1f} ms, "
+                f"unchanged {(unchanged - load) * 1000:7.1f} ms"
+            )
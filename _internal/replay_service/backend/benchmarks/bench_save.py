@@ -0,0 +1,60 @@
+"""Cost of saving a single appended replay, for a growing DB.
+
+All replays are of the same two players on the same map, the worst case
+for the indexes and stats.
+
+Run from the backend folder: `python -m benchmarks.bench_save`
+"""
+
+import logging
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from src.db import ReplayDB
+from src.model import Replay
+from tests import factories
+
+SIZES = (1_000, 10_000, 100_000, 500_000)
+APPENDS = 20
+
+START = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+
+def make_replay(idx: int) -> Replay:
+    return factories.make_replay(START + timedelta(minutes=idx))
+
+
+def make_db(tmp: Path, size: int) -> ReplayDB:
+    replay_folder = tmp / "replays"
+    replay_folder.mkdir()
+    db = ReplayDB(tmp / "db", replay_folder, reconcile_on_init=False)
+
+    replays = [make_replay(idx) for idx in range(size)]
+    db._store.add(replays)
+    db._store.commit()
+    db.by_id.update((replay.id, replay) for replay in replays)
+    db.by_time.update(replays)
+    for index in db._indexes:
+        index.update(replays)
+    db._stats.rebuild(replays)
+    db.republish()
+    return db
+
+
+def bench(size: int) -> float:
+    with tempfile.TemporaryDirectory() as tmp:
+        db = make_db(Path(tmp), size)
+
+        started = time.perf_counter()
+        for idx in range(size, size + APPENDS):
+            db._add_if_missing(make_replay(idx))
+            db.save_to_fs()
+        return (time.perf_counter() - started) / APPENDS
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    for size in SIZES:
+        print(f"{size:>8} replays: {bench(size) * 1000:8.2f} ms per append+save")
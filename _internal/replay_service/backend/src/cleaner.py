@@ -1,35 +1,71 @@
 import logging
 import shutil
+import threading
 import time
 from dataclasses import dataclass
-from datetime import datetime, timezone
 from pathlib import Path
 
-from src.parser import parse_finished_at_with_fallback
+from src.db import ReplayDB
+from src.metrics import REGISTRY
+from src.retention import OldestFirst, RetentionPolicy
+from src.scheduler import Priority, Scheduler
+from src.tiering import Recompressor
 
 logger = logging.getLogger(__name__)
 
 KiB = 1024
 MiB = 1024 * KiB
 GiB = 1024 * MiB
+# replays deleted per hold of the DB lock
+EVICTION_BATCH_SIZE = 10
+
+FREED_BYTES = REGISTRY.counter(
+    "replay_cleaner_freed_bytes_total", "Bytes of replays deleted by the cleaner."
+)
+DISK_FREE_RATIO = REGISTRY.gauge(
+    "replay_disk_free_ratio", "Free space of the replay folder's disk, last checked."
+)
 
 
 @dataclass(frozen=True)
 class CleanerConfig:
     replay_folder: Path
+    # high watermark: cleanup starts when free space drops below it...
     min_free_space_ratio: float
+    # ...low watermark: and goes on until free space is back to this
+    target_free_space_ratio: float
     min_replay_retention_bytes: int
     min_expected_disk_size_bytes: int
+    # fallback pass, when no replay events come
     clean_interval_seconds: int
+    # rate limit for event-triggered passes
+    min_clean_interval_seconds: float
 
     def __post_init__(self):
-        assert 0 < self.min_free_space_ratio < 1
+        assert 0 < self.min_free_space_ratio <= self.target_free_space_ratio < 1
         assert self.clean_interval_seconds > 0
+        assert 0 <= self.min_clean_interval_seconds <= self.clean_interval_seconds
 
 
 class Cleaner:
-    def __init__(self, config: CleanerConfig):
+    def __init__(
+        self,
+        config: CleanerConfig,
+        db: ReplayDB,
+        wake_up: threading.Event | None = None,
+        policy: RetentionPolicy | None = None,
+        recompressor: Recompressor | None = None,
+        scheduler: Scheduler | None = None,
+    ):
         self.config = config
+        self.db = db
+        self.scheduler = scheduler or Scheduler(cpu_budget=1)
+        self.policy = policy or OldestFirst()
+        self.recompressor = recompressor
+        # set by the replay worker after ingesting, to react before the periodic pass
+        self.wake_up = wake_up or threading.Event()
+        # how close the disk came to the limit since the start
+        self.lowest_free_ratio: float | None = None
 
     def _get_disk_usage_safe(self) -> shutil._ntuple_diskusage | None:
         usage = shutil.disk_usage(self.config.replay_folder)
@@ -58,52 +94,71 @@ class Cleaner:
             logger.warning("Unable to determine disk usage!")
             return 0
 
-        logger.info(
+        current_ratio = usage.free / usage.total
+        DISK_FREE_RATIO.set(current_ratio)
+        # at INFO on the first pass too, so the setup can be checked in the logs
+        first_pass = self.lowest_free_ratio is None
+        if first_pass or current_ratio < self.lowest_free_ratio:
+            self.lowest_free_ratio = current_ratio
+            logger.info("Lowest disk free so far: %.1f%%", current_ratio * 100)
+
+        below_watermark = current_ratio < self.config.min_free_space_ratio
+        logger.log(
+            logging.INFO if first_pass or below_watermark else logging.DEBUG,
             "Disk free: %.1f%% (%d MiB)",
-            usage.free / usage.total * 100,
+            current_ratio * 100,
             usage.free // MiB,
         )
+        if not below_watermark:
+            return 0
 
-        current_ratio = usage.free / usage.total
-        overusage_ratio = self.config.min_free_space_ratio - current_ratio
-        need_to_clean_bytes = int(overusage_ratio * usage.total)
-        return need_to_clean_bytes if overusage_ratio > 0 else 0
+        # hysteresis: free up to the low watermark, not just below the high one
+        return int((self.config.target_free_space_ratio - current_ratio) * usage.total)
 
     def clean_up_once(self):
+        # shrinking old replays may be enough to stay within limits
+        if self.recompressor:
+            self.recompressor.recompress_once()
+        # every pass, so the policy's input (e.g. a log) is read in small parts
+        with self.scheduler.budgeted(Priority.CLEANUP):
+            self.policy.prepare()
+
         bytes_to_clean = self._calculate_space_size_to_clean_up()
-        if bytes_to_clean == 0:
-            logger.info("Disk usage is acceptable, skipping cleanup.")
+        if bytes_to_clean <= 0:
+            logger.debug("Disk usage is acceptable, skipping cleanup.")
             return
 
-        replays = sorted(
-            (
-                (path, path.stat().st_size)
-                for path in self.config.replay_folder.glob("*.rep.zip")
-                if path.is_file()
-            ),
-            key=lambda replay: parse_finished_at_with_fallback(
-                replay[0].name, datetime.max.replace(tzinfo=timezone.utc)
-            ),
-        )
-        total_replay_bytes = sum(size for _, size in replays)
-
+        # the DB knows the downloadable replays with their sizes,
+        # so there is no need to list and stat the whole folder
         freed_bytes = 0
-        for replay_path, replay_size in replays:
-            if (
-                    total_replay_bytes - freed_bytes
-                    < self.config.min_replay_retention_bytes
-            ):
-                logger.info("Reached minimum replay retention size, stopping cleanup")
-                return
-
-            replay_path.unlink(missing_ok=True)
-            freed_bytes += replay_size
-            logger.info(
-                "Removed replay %s (%d MiB)", replay_path.name, replay_size // MiB
-            )
-
-            if freed_bytes >= bytes_to_clean:
-                return
+        while freed_bytes < bytes_to_clean:
+            # a slot and the lock per batch, publishing gets in between
+            with self.scheduler.slot(Priority.CLEANUP), self.db.lock:
+                if self._retention_reached():
+                    logger.info(
+                        "Reached minimum replay retention size, stopping cleanup"
+                    )
+                    break
+                batch = self.policy.eviction_candidates(self.db, EVICTION_BATCH_SIZE)
+                if not batch:
+                    break
+                for replay in batch:
+                    replay_size = self.db.delete_replay(replay)
+                    freed_bytes += replay_size
+                    FREED_BYTES.inc(replay_size)
+                    logger.info(
+                        "Removed replay %s (%d MiB)",
+                        replay.filename,
+                        replay_size // MiB,
+                    )
+                    if freed_bytes >= bytes_to_clean or self._retention_reached():
+                        break
+
+        with self.scheduler.slot(Priority.PUBLISH):
+            self.db.save_to_fs()
+
+    def _retention_reached(self) -> bool:
+        return self.db.downloadable_bytes < self.config.min_replay_retention_bytes
 
     def clean_up_forever(self):
         while True:
@@ -113,5 +168,10 @@ class Cleaner:
                 logger.exception(
                     "Cleaner encountered an error, but will continue after sleep"
                 )
-            logger.info("Cleaner finished, sleeping...")
-            time.sleep(self.config.clean_interval_seconds)
+            # requests during the cooldown aren't lost, the event stays set
+            time.sleep(self.config.min_clean_interval_seconds)
+            self.wake_up.wait(
+                self.config.clean_interval_seconds
+                - self.config.min_clean_interval_seconds
+            )
+            self.wake_up.clear()
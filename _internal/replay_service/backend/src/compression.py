@@ -0,0 +1,218 @@
+import os
+import struct
+import threading
+import time
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import BinaryIO
+
+from src.scheduler import lower_thread_priority
+
+# pigz-like: blocks are deflated independently in threads (zlib releases the GIL),
+# each primed with the previous 32 KiB, and stitched into a single deflate stream
+BLOCK_SIZE = 128 * 1024
+DICT_SIZE = 32 * 1024  # deflate's window
+LEVEL = 6  # zlib's default, as zipfile uses
+
+# the hand-written zip has no ZIP64 records, larger replays go through zipfile
+MAX_FAST_ZIP_SIZE = 0xFFFFFFFF - 64 * 1024 * 1024  # margin for deflate's overhead
+
+LOCAL_HEADER = struct.Struct("<4sHHHHHIIIHH")
+LOCAL_HEADER_CRC_OFFSET = 14
+CRC_AND_SIZES = struct.Struct("<III")
+CENTRAL_HEADER = struct.Struct("<4sHHHHHHIIIHHHHHII")
+END_OF_CENTRAL_DIR = struct.Struct("<4sHHHHIIH")
+VERSION = 20  # 2.0, deflate
+VERSION_MADE_BY = 3 << 8 | VERSION  # unix
+FLAG_UTF8 = 1 << 11
+
+_pool: ThreadPoolExecutor | None = None
+_pool_threads = 1
+_pool_niceness: int | None = None
+_pool_lock = threading.Lock()
+# CPU time of deflating in threads, the caller's thread time doesn't include it
+_deflate_cpu_seconds = 0.0
+_deflate_cpu_lock = threading.Lock()
+
+
+def configure_pool(threads: int, niceness: int | None = None):
+    """Sizes the shared deflate pool and renices its threads, before its first use."""
+    global _pool_threads, _pool_niceness
+    assert threads > 0
+    with _pool_lock:
+        assert _pool is None, "the deflate pool has started already"
+        _pool_threads, _pool_niceness = threads, niceness
+
+
+def deflate_cpu_seconds() -> float:
+    """CPU seconds spent deflating blocks in threads, since the start."""
+    with _deflate_cpu_lock:
+        return _deflate_cpu_seconds
+
+
+def compress_replay(
+    source: Path, target: Path, arcname: str, executor: Executor | None = None
+):
+    """Zips a single file, deflating its blocks in parallel.
+
+    The result is a standard zip with one deflated member, streamed from
+    the source without reading it whole; CRC and sizes are filled
+    into the local header afterwards, as zipfile does.
+    """
+    stat = source.stat()
+    if stat.st_size > MAX_FAST_ZIP_SIZE:
+        with zipfile.ZipFile(target, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+            zf.write(source, arcname)
+        return
+
+    name = arcname.encode()
+    flags = 0 if name.isascii() else FLAG_UTF8
+    dos_time, dos_date = _dos_datetime(stat.st_mtime)
+
+    with source.open("rb") as src, target.open("wb") as dst:
+        dst.write(
+            LOCAL_HEADER.pack(
+                b"PK\x03\x04",
+                VERSION,
+                flags,
+                zipfile.ZIP_DEFLATED,
+                dos_time,
+                dos_date,
+                0,  # CRC and sizes, known once compressed
+                0,
+                0,
+                len(name),
+                0,
+            )
+        )
+        dst.write(name)
+
+        if executor is None:
+            executor, max_pending = _get_pool(), 2 * _pool_threads
+        else:
+            max_pending = 2 * (os.process_cpu_count() or 1)
+        crc, compressed_size, size = _deflate_blocks(src, dst, executor, max_pending)
+        central_dir_offset = dst.tell()
+        dst.seek(LOCAL_HEADER_CRC_OFFSET)
+        dst.write(CRC_AND_SIZES.pack(crc, compressed_size, size))
+        dst.seek(central_dir_offset)
+
+        dst.write(
+            CENTRAL_HEADER.pack(
+                b"PK\x01\x02",
+                VERSION_MADE_BY,
+                VERSION,
+                flags,
+                zipfile.ZIP_DEFLATED,
+                dos_time,
+                dos_date,
+                crc,
+                compressed_size,
+                size,
+                len(name),
+                0,  # extra
+                0,  # comment
+                0,  # disk
+                0,  # internal attributes
+                (stat.st_mode & 0xFFFF) << 16,
+                0,  # local header offset
+            )
+        )
+        dst.write(name)
+        central_dir_size = dst.tell() - central_dir_offset
+        dst.write(
+            END_OF_CENTRAL_DIR.pack(
+                b"PK\x05\x06",
+                0,
+                0,
+                1,
+                1,
+                central_dir_size,
+                central_dir_offset,
+                0,
+            )
+        )
+
+
+def _deflate_blocks(
+    src: BinaryIO, dst: BinaryIO, executor: Executor, max_pending: int
+) -> tuple[int, int, int]:
+    """Writes the deflate stream, returns CRC, compressed and uncompressed sizes."""
+    crc = compressed_size = size = 0
+    # in-order results, bounded so memory stays a few blocks per thread
+    pending: deque[Future[bytes]] = deque()
+
+    def write_oldest():
+        nonlocal compressed_size
+        data = pending.popleft().result()
+        dst.write(data)
+        compressed_size += len(data)
+
+    block = src.read(BLOCK_SIZE)
+    zdict = b""
+    while True:
+        next_block = src.read(BLOCK_SIZE)
+        crc = zlib.crc32(block, crc)
+        size += len(block)
+        pending.append(executor.submit(_deflate_block, block, zdict, not next_block))
+        if not next_block:
+            break
+        zdict = block[-DICT_SIZE:]  # full blocks are larger than the window
+        block = next_block
+        while len(pending) >= max_pending:
+            write_oldest()
+
+    while pending:
+        write_oldest()
+    return crc, compressed_size, size
+
+
+def _deflate_block(block: bytes, zdict: bytes, last: bool) -> bytes:
+    global _deflate_cpu_seconds
+    started = time.thread_time()
+    try:
+        return _deflate(block, zdict, last)
+    finally:
+        used = time.thread_time() - started
+        with _deflate_cpu_lock:
+            _deflate_cpu_seconds += used
+
+
+def _deflate(block: bytes, zdict: bytes, last: bool) -> bytes:
+    if zdict:
+        compressor = zlib.compressobj(LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=zdict)
+    else:
+        compressor = zlib.compressobj(LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+    # a sync flush ends on a byte boundary without closing the stream,
+    # so the next block's data continues it
+    return compressor.compress(block) + compressor.flush(
+        zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH
+    )
+
+
+def _dos_datetime(timestamp: float) -> tuple[int, int]:
+    # as zipfile does, local time and no earlier than 1980
+    year, month, day, hour, minute, second = time.localtime(timestamp)[:6]
+    if year < 1980:
+        year, month, day, hour, minute, second = 1980, 1, 1, 0, 0, 0
+    return (
+        hour << 11 | minute << 5 | second // 2,
+        (year - 1980) << 9 | month << 5 | day,
+    )
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    # shared, so parallel ingestion doesn't multiply threads
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(
+                _pool_threads,
+                thread_name_prefix="deflate",
+                initializer=lower_thread_priority if _pool_niceness else None,
+                initargs=(_pool_niceness,),
+            )
+        return _pool
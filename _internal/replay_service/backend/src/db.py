@@ -1,21 +1,103 @@
+import functools
+import gc
+import gzip
 import hashlib
 import json
 import logging
-import zipfile
+import math
+import os
+import threading
+import time
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from dataclasses import dataclass
 from datetime import datetime, timezone
-from itertools import batched
+from itertools import islice
 from pathlib import Path
 from struct import error
 from typing import Callable
 
-from construct import ConstructError
 from sortedcontainers import SortedListWithKey
 
-from src.model import ChunkHeader, Header, ParsedReplay, Replay, ReplayMetadata
-from src.parser import parse_finished_at, parse_raw, parse_zip_compressed
+from src.compression import compress_replay
+from src.index import (
+    NgramIndex,
+    ShardedIndex,
+    map_steam_ids,
+    map_titles,
+    player_names,
+    player_steam_ids,
+)
+from src.metrics import COUNT_BUCKETS, REGISTRY
+from src.model import ChunkHeader, Header, ParsedReplay, Replay, replay_id
+from src.parser import (
+    HeaderParseError,
+    parse_finished_at,
+    parse_raw,
+    parse_zip_compressed,
+)
+from src.scheduler import Priority, Scheduler, available_cpus
+from src.stats import Stats
+from src.store import STORE_FILENAME, FileEntry, FolderState, ReplayStore
 
 logger = logging.getLogger(__name__)
 
+# a folder changed within this long before being listed may change again
+# with the same mtime, so its state isn't relied on
+RACY_MTIME_NS = 2 * 10**9
+
+PARSE_SECONDS = REGISTRY.histogram(
+    "replay_parse_seconds", "Time to parse a replay's header, in seconds."
+)
+COMPRESS_SECONDS = REGISTRY.histogram(
+    "replay_compress_seconds", "Time to compress a raw replay, in seconds."
+)
+COMPRESS_READ_BYTES = REGISTRY.counter(
+    "replay_compress_read_bytes_total", "Bytes of raw replays compressed."
+)
+COMPRESS_WRITTEN_BYTES = REGISTRY.counter(
+    "replay_compress_written_bytes_total", "Bytes of zips written by compression."
+)
+SAVE_SECONDS = REGISTRY.histogram(
+    "replay_db_save_seconds", "Time to publish the DB's changes, in seconds."
+)
+SAVE_CHUNKS_REWRITTEN = REGISTRY.histogram(
+    "replay_db_save_chunks_rewritten",
+    "Chunk files rewritten per DB save.",
+    buckets=COUNT_BUCKETS,
+)
+
+
+@dataclass(eq=False)
+class _Chunk:
+    count: int
+    header: ChunkHeader | None = None  # as last written to FS
+    header_json: str | None = None  # serialized header, reused on every save
+
+
+def _locked(method):
+    @functools.wraps(method)
+    def wrapper(self: "ReplayDB", *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+@contextmanager
+def _gc_paused() -> Iterator[None]:
+    # loaded replays live as long as the process, collections while building
+    # them, or after, would only rescan them; so they're moved out of GC's sight
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        gc.freeze()
+        if was_enabled:
+            gc.enable()
+
 
 class ReplayDB:
     def __init__(
@@ -23,176 +105,462 @@ class ReplayDB:
         path: Path,
         replay_folder: Path,
         reconcile_on_init=True,
-        _chunk_at_count=250,  # changing will require dropping DB
+        reconcile_jobs: int | None = None,
+        scheduler: Scheduler | None = None,
+        full_reconcile_interval_seconds: float = 7 * 24 * 3600,
+        _chunk_at_count=250,  # changing requires dropping DB, chunks split beyond it
     ):
         self._db_path = path
         self._db_header_path = path / "replays_header.json"
+        self._db_path.mkdir(parents=True, exist_ok=True)
+        self._store = ReplayStore(path / STORE_FILENAME)
         self.replay_folder = replay_folder
+        # the backlog of reconciliation is charged to the budget, once started
+        self._scheduler: Scheduler | None = None
+        # the worker ingests, while the cleaner deletes
+        self.lock = threading.RLock()
 
         self.reconcile_on_init = reconcile_on_init
+        # parsing of new replays fans out, reading headers mostly waits for IO,
+        # so a couple of jobs overlap it even within a fraction of a CPU
+        self.reconcile_jobs = reconcile_jobs or max(math.ceil(available_cpus()), 2)
+        self.full_reconcile_interval_seconds = full_reconcile_interval_seconds
         self._chunk_max_size = _chunk_at_count
 
-        self.by_filename: dict[str, Replay] = {}
+        # by `Replay.id`, as the filename changes once a replay is compressed
+        self.by_id: dict[str, Replay] = {}
 
         self._sort_key: Callable[[Replay], datetime] = lambda replay: replay.finished_at
         self.by_time: SortedListWithKey[Replay, datetime] = SortedListWithKey(
             key=self._sort_key
         )
 
+        # replays on disk with their sizes, for the cleaner to pick the oldest
+        self._downloadable_by_time: SortedListWithKey[Replay, datetime] = (
+            SortedListWithKey(key=self._sort_key)
+        )
+        self._downloadable_sizes: dict[Replay, int] = {}
+        self.downloadable_bytes = 0
+        # compression tier of recompressed replays, by filename
+        self._tiers = self._store.load_tiers()
+        # published, but with a raw file still to compress, taken by the compressor
+        self._awaiting_compression: SortedListWithKey[Replay, datetime] = (
+            SortedListWithKey(key=self._sort_key)
+        )
+
+        # set while reconciling, changes are committed together, not one by one
+        self._commit_deferred = False
+        # mirrors the store's pending log, cleared once published
         self._unsaved_mutated: set[Replay] = set()
         self._unsaved_added: set[Replay] = set()
 
-        self._load_or_init_on_fs()
+        # contiguous ranges of by_time, each published as a chunk file
+        self._chunks: list[_Chunk] = []
+        self._dirty_chunks: set[_Chunk] = set()
+
+        # published next to the chunks, for lookups without loading every chunk
+        self._index_path = path / "index"
+        self._indexes = [
+            ShardedIndex("players", player_steam_ids),
+            ShardedIndex("maps", map_steam_ids),
+            NgramIndex("player_names", player_names),
+            NgramIndex("map_titles", map_titles),
+        ]
+        self._stats = Stats()
+
+        # seconds spent in each phase of the start, up to being ready
+        self.startup_seconds: dict[str, float] = {}
+        started = time.perf_counter()
+        with _gc_paused():
+            self._load_or_init_on_fs()
 
         if self.reconcile_on_init:
-            self.reconcile()
+            # the service isn't ready until it's done, so it's not budgeted
+            with self._startup_phase("reconcile"):
+                self.reconcile()
+        self._scheduler = scheduler
+        logger.info(
+            "DB ready in %.3f s (%s)",
+            time.perf_counter() - started,
+            ", ".join(
+                f"{phase} {seconds:.3f} s"
+                for phase, seconds in self.startup_seconds.items()
+            ),
+        )
 
+    @_locked
     def ingest_replay(self, filename: str) -> Replay | None:
+        """Adds a new replay right after parsing its header, or updates a known one.
+
+        A raw replay is published as not downloadable, its compression is left
+        for `compress`, see `pop_awaiting_compression`.
+        """
         replay_path = self.replay_folder / filename
-        if replay := self.by_filename.get(replay_path.name):
+        replay = self.by_id.get(replay_id(replay_path.name))
+        if replay is None:
             if not replay_path.exists():
-                self._mark_fs_missing(replay)
-            else:
-                self._mark_fs_present(replay)
-            return replay
+                return None
+            if not (built := self._build_replay(replay_path)):
+                return None
+            replay = self._add_if_missing(built)
 
-        if not replay_path.exists():
-            return None
+        try:
+            size = (self.replay_folder / (replay.id + ".zip")).stat().st_size
+        except FileNotFoundError:
+            size = None
+        self._sync_with_fs(replay, size, (self.replay_folder / replay.id).exists())
+        return replay
 
-        logger.info(f"Ingesting new replay {replay_path.name}")
+    def compress(self, filename: str) -> Replay | None:
+        """Compresses a raw replay, then makes it downloadable as `.rep.zip`.
 
-        parsing_result = self._parse(replay_path)
-        compressed_path = self._ensure_compressed(replay_path)
-        replay = Replay(
-            filename=compressed_path.name,
-            downloadable=True,
-            finished_at=parsing_result.finished_at,
-            metadata=parsing_result.metadata,
+        The slow part doesn't hold the lock, so new replays are published meanwhile.
+        """
+        raw_path = self.replay_folder / replay_id(filename)
+        try:
+            self._ensure_compressed(raw_path)
+        except FileNotFoundError:
+            pass  # compressed already, or deleted, either is seen by the ingestion
+        return self.ingest_replay(raw_path.name + ".zip")
+
+    @_locked
+    def pop_awaiting_compression(self, max_count: int | None = None) -> list[Replay]:
+        """Takes the replays with a raw file to compress, oldest first."""
+        replays = list(self._awaiting_compression.islice(0, max_count))
+        del self._awaiting_compression[: len(replays)]
+        return replays
+
+    @property
+    def awaiting_compression_count(self) -> int:
+        return len(self._awaiting_compression)
+
+    def oldest_downloadable(self) -> Replay | None:
+        return self._downloadable_by_time[0] if self._downloadable_by_time else None
+
+    def downloadable_replays(
+        self,
+        finished_before: datetime | None = None,
+        finished_since: datetime | None = None,
+        max_count: int | None = None,
+    ) -> list[Replay]:
+        """Returns replays present on disk, oldest first."""
+        return list(
+            islice(
+                self._downloadable_by_time.irange_key(
+                    min_key=finished_since,
+                    max_key=finished_before,
+                    inclusive=(True, False),
+                ),
+                max_count,
+            )
         )
 
-        return self._add_if_missing(replay)
-
+    def tier_of(self, replay: Replay) -> str | None:
+        return self._tiers.get(replay.filename)
+
+    @_locked
+    def set_tier(self, replay: Replay, tier: str, size: int):
+        """Records a recompressed replay, with its new file size."""
+        self._tiers[replay.filename] = tier
+        self._store.set_tier(replay.filename, tier)
+        self._store.commit()
+        if replay in self._downloadable_sizes:
+            self._track_downloadable(replay, size)
+
+    @_locked
+    def delete_replay(self, replay: Replay) -> int:
+        """Deletes the replay's file and marks it as not downloadable.
+
+        Returns the freed bytes.
+        """
+        size = self._downloadable_sizes.get(replay, 0)
+        (self.replay_folder / replay.filename).unlink(missing_ok=True)
+        self._mark_fs_missing(replay)
+        return size
+
+    @_locked
     def save_to_fs(self):
-        # TODO: add debouncing, maybe
-        if not self._unsaved_added and not self._unsaved_mutated:
+        if (
+                not self._unsaved_added
+                and not self._unsaved_mutated
+                and not self._dirty_chunks
+                and not any(index.is_dirty for index in self._indexes)
+                and not self._stats.is_dirty
+        ):
             return
 
+        started = time.perf_counter()
         logger.info(
             f"Saving DB to FS with {len(self._unsaved_added)} added and {len(self._unsaved_mutated)} mutated replays..."
         )
 
-        header = Header.from_dict(
-            json.loads(self._db_header_path.read_text()), self._chunk_max_size
-        )
-
-        affected_chunk_idxs = set()
-        if self._unsaved_added:
-            earliest_unsaved_added_idx = min(
-                self.by_time.index(rpl) for rpl in self._unsaved_added
-            )
-            for chunk_idx in range(
-                    earliest_unsaved_added_idx // self._chunk_max_size,
-                    len(self.by_time) // self._chunk_max_size + 1,
-            ):
-                affected_chunk_idxs.add(chunk_idx)
         for replay in self._unsaved_mutated:
-            affected_chunk_idxs.add(self.by_time.index(replay) // self._chunk_max_size)
+            self._dirty_chunks.add(
+                self._chunk_at(self.by_time.index(replay), len(self.by_time))[0]
+            )
 
         self._unsaved_added.clear()
         self._unsaved_mutated.clear()
 
-        old_chunk_paths = {
-            header.chunk_headers[idx].filename
-            for idx in filter(
-                lambda idx: idx < len(header.chunk_headers), affected_chunk_idxs
-            )
-        }
+        # only chunk counts are walked, replays are sliced for dirty chunks only
+        old_chunk_paths = set()
+        new_chunk_paths = set()
+        rewritten_count = 0
+        chunk_start = 0
+        for chunk in self._chunks:
+            chunk_end = chunk_start + chunk.count
+            if chunk in self._dirty_chunks:
+                rewritten_count += 1
+                db_chunk = tuple(self.by_time.islice(chunk_start, chunk_end))
+                if chunk.header:
+                    old_chunk_paths.add(chunk.header.filename)
+                chunk.header = self._write_chunk(db_chunk)
+                chunk.header_json = json.dumps(chunk.header.to_dict())
+                new_chunk_paths.add(chunk.header.filename)
+            chunk_start = chunk_end
+        self._dirty_chunks.clear()
+
+        stats_rows = self._stats.dirty_rows()
+        shards = [
+            (self._index_path, index.pop_dirty_shards()) for index in self._indexes
+        ]
+        shards.append((self._db_path, self._stats.pop_dirty_shards()))
+        for root_path, shard_jsons in shards:
+            for shard_path, shard_json in shard_jsons.items():
+                shard_path = root_path / shard_path
+                shard_path.parent.mkdir(parents=True, exist_ok=True)
+                self._publish(shard_path, shard_json)
+
+        header = Header(
+            updated_at=datetime.now(timezone.utc),
+            total_count=len(self.by_time),
+            chunk_headers=[],
+            max_chunk_size=self._chunk_max_size,
+        )
+        self._publish(
+            self._db_header_path,
+            header.to_json([chunk.header_json for chunk in self._chunks]).encode(),
+        )
 
-        for chunk_idx, db_chunk in enumerate(
-                batched(self.by_time, self._chunk_max_size)
-        ):
-            if chunk_idx not in affected_chunk_idxs:
-                continue
+        # stats go in the same transaction, so pending replays are counted once
+        self._store.save_stats(stats_rows)
+        self._store.clear_pending()
+        self._store.commit()
 
-            db_chunk = tuple(db_chunk)
+        # clean up, an unchanged chunk gets the same name
+        for chunk_path in old_chunk_paths - new_chunk_paths:
+            self._unpublish(self._db_path / chunk_path)
 
-            chunk_json = {replay.filename: replay.to_jsonable() for replay in db_chunk}
-            chunk_json = json.dumps(chunk_json).encode()
+        SAVE_SECONDS.observe(time.perf_counter() - started)
+        SAVE_CHUNKS_REWRITTEN.observe(rewritten_count)
+        logger.info("DB save completed.")
+
+    @_locked
+    def republish(self):
+        """Regenerates all published JSON from the store's state."""
+        logger.info("Republishing all DB chunks...")
+        self._chunks = [
+            _Chunk(count=min(self._chunk_max_size, len(self.by_time) - chunk_start))
+            for chunk_start in range(0, len(self.by_time), self._chunk_max_size)
+        ]
+        self._dirty_chunks = set(self._chunks)
+        for index in self._indexes:
+            index.mark_all_dirty()
+        self._stats.mark_all_dirty()
+        self.save_to_fs()
+        if not self._chunks:  # nothing to save, but the header must be there
+            self._init_header_fs()
 
-            # TODO: there is no need for hashing! Just use incremental numbers,
-            #  and store it in the header. Or just plain timestamp
-            chunk_hash = hashlib.blake2s(
-                chunk_json, digest_size=6, usedforsecurity=False
-            ).hexdigest()
-            chunk_name = f"chunk_{chunk_idx}_{chunk_hash}.json"
+        published = {chunk.header.filename for chunk in self._chunks}
+        for chunk_path in self._db_path.glob("chunk_*.json"):
+            if chunk_path.name not in published:
+                self._unpublish(chunk_path)
+        for sidecar_path in self._db_path.glob("chunk_*.json.gz"):
+            if sidecar_path.name.removesuffix(".gz") not in published:
+                sidecar_path.unlink()
+
+    @_locked
+    def reconcile(self, full: bool = False):
+        """Syncs the DB with the replay folder.
+
+        Files are compared with the manifest of the last reconciliation: only new
+        or replaced ones (by inode, which the listing has) are stat'ed, and an
+        unchanged folder isn't even listed. A full reconciliation stats every file,
+        it's done when asked, when there's no manifest and periodically.
+        Replay files are expected to be replaced, not rewritten in place.
+        """
+        folder_state = self._store.load_folder_state()
+        full = (
+            full
+            or folder_state is None
+            or time.time() - folder_state.full_reconciled_at
+            > self.full_reconcile_interval_seconds
+        )
+        logger.info(f"Reconciling DB with FS{' (full)' if full else ''}...")
+
+        # before listing, so a change during it leaves a different mtime
+        listed_at_ns = time.time_ns()
+        folder_stat = self.replay_folder.stat()
+        manifest = {} if full else self._store.load_manifest()
+        if (
+            not full
+            and folder_state.mtime_ns is not None
+            and (folder_state.inode, folder_state.mtime_ns)
+            == (folder_stat.st_ino, folder_stat.st_mtime_ns)
+        ):
+            # nothing was added, removed or renamed since
+            inodes = {name: entry.inode for name, entry in manifest.items()}
+        else:
+            with os.scandir(self.replay_folder) as entries:
+                inodes = {
+                    entry.name: entry.inode()
+                    for entry in entries
+                    if entry.name.endswith(".rep") or entry.name.endswith(".rep.zip")
+                }
+
+        files: dict[str, FileEntry] = {}
+        changed: dict[str, FileEntry] = {}
+        for name, inode in inodes.items():
+            if (entry := manifest.get(name)) and entry.inode == inode:
+                files[name] = entry
+                continue
+            try:
+                stat = (self.replay_folder / name).stat()
+            except FileNotFoundError:
+                continue
+            files[name] = changed[name] = FileEntry.from_stat(stat)
 
-            self._write_atomic(self._db_path / chunk_name, chunk_json)
+        compressed_sizes = {
+            replay_id(name): entry.size
+            for name, entry in files.items()
+            if name.endswith(".rep.zip")
+        }
+        raw_ids = {name for name in files if name.endswith(".rep")}
+
+        # a crash in the middle of compression leaves both files,
+        # the raw one wins, as it will overwrite the compressed one
+        new_paths = [
+            self.replay_folder / (new_id if new_id in raw_ids else new_id + ".zip")
+            for new_id in (raw_ids | compressed_sizes.keys()) - self.by_id.keys()
+        ]
+        with self._deferred_commit():
+            self._ingest_many(new_paths)
+            for replay in self.by_time:
+                self._sync_with_fs(
+                    replay, compressed_sizes.get(replay.id), replay.id in raw_ids
+                )
 
-            chunk_meta = ChunkHeader(
-                filename=chunk_name,
-                oldest_replay_ts=min(db_chunk, key=self._sort_key).finished_at,
-                latest_replay_ts=max(db_chunk, key=self._sort_key).finished_at,
-                count=len(db_chunk),
+        if full:
+            self._store.replace_manifest(files)
+        else:
+            self._store.update_manifest(changed, list(manifest.keys() - files.keys()))
+        racy = listed_at_ns - folder_stat.st_mtime_ns < RACY_MTIME_NS
+        self._store.save_folder_state(
+            FolderState(
+                inode=folder_stat.st_ino,
+                mtime_ns=None if racy else folder_stat.st_mtime_ns,
+                full_reconciled_at=(
+                    listed_at_ns / 10**9 if full else folder_state.full_reconciled_at
+                ),
             )
+        )
+        self._store.commit()
 
-            if chunk_idx < len(header.chunk_headers):
-                header.chunk_headers[chunk_idx] = chunk_meta
-            else:
-                header.chunk_headers.append(chunk_meta)
-
-        header.total_count = sum(chunk.count for chunk in header.chunk_headers)
-        header.updated_at = datetime.now(timezone.utc)
+        self.save_to_fs()
+        logger.info(
+            f"Reconciliation complete, stat'ed {len(changed)} of {len(files)} files."
+        )
 
-        self._write_atomic(self._db_header_path, json.dumps(header.to_dict()))
+    def _ingest_many(self, replay_paths: list[Path]):
+        if not replay_paths:
+            return
 
-        # clean up
-        for chunk_path in old_chunk_paths:
-            (self._db_path / chunk_path).unlink()
+        logger.info(
+            f"Ingesting {len(replay_paths)} new replays with {self.reconcile_jobs} jobs..."
+        )
+        progress_step = max(len(replay_paths) // 10, 1)
+
+        with ThreadPoolExecutor(max_workers=self.reconcile_jobs) as pool:
+            futures = [
+                pool.submit(self._build_replay_scheduled, path) for path in replay_paths
+            ]
+            for done_count, future in enumerate(as_completed(futures), start=1):
+                # DB structures are only touched here, by a single writer
+                if built := future.result():
+                    self._add_if_missing(built)
+
+                if done_count % progress_step == 0 or done_count == len(futures):
+                    # a crash in the middle keeps the replays ingested so far
+                    self._store.commit()
+                    logger.info(f"Ingested {done_count}/{len(futures)} new replays")
+
+    @contextmanager
+    def _deferred_commit(self) -> Iterator[None]:
+        """Commits the store once at the end, rather than after every change.
+
+        Each commit fsyncs, which adds up over thousands of replays.
+        """
+        self._commit_deferred = True
+        try:
+            yield
+        finally:
+            self._commit_deferred = False
+            self._store.commit()
+
+    def _commit(self):
+        # a single live change is committed right away
+        if not self._commit_deferred:
+            self._store.commit()
+
+    @contextmanager
+    def _startup_phase(self, phase: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.startup_seconds[phase] = time.perf_counter() - started
 
+    def _load_or_init_on_fs(self):
+        # leftovers of a crash mid-write, done once, as it lists the whole folder
         for tmp in self._db_path.glob("*.tmp"):
             tmp.unlink()
 
-        logger.info("DB save completed.")
-
-    def reconcile(self):
-        logger.info("Reconciling DB with FS...")
-        present_replays = set()
-        for replay_path in self.replay_folder.iterdir():
-            if not (
-                    replay_path.name.endswith(".rep")
-                    or replay_path.name.endswith(".rep.zip")
-            ):
-                continue
-
-            if replay := self.by_filename.get(replay_path.name):
-                self._mark_fs_present(replay)
-            else:
-                replay = self.ingest_replay(replay_path.name)
-
-            if not replay:
-                continue
-
-            present_replays.add(replay)
-
-        for replay in self.by_time:
-            if replay not in present_replays:
-                self._mark_fs_missing(replay)
-
-        self.save_to_fs()
-        logger.info("Reconciliation complete.")
-
-    def _load_or_init_on_fs(self):
-        if self._db_header_path.exists():
+        if self._store.count():
             logger.info("Found existing DB, loading...")
+            self._load_from_store()
+        elif self._db_header_path.exists():
+            logger.info("Found existing JSON DB, importing into the store...")
             self._load_from_fs()
+            self._store.add(list(self.by_time))
+            self._store.commit()
+            for index in self._indexes:
+                index.update(self.by_time)
+            self._stats.rebuild(self.by_time)
         else:
             logger.info("No DB found, initializing...")
             self._init_header_fs()
+        with self._startup_phase("sidecars"):
+            self._ensure_sidecars()
+        if not self._index_path.exists():  # published before indexes existed
+            for index in self._indexes:
+                index.mark_all_dirty()
+            self._stats.mark_all_dirty()
         logger.info(f"Initialized DB with {len(self.by_time)} replays.")
 
+    def _ensure_sidecars(self):
+        # chunks published before sidecars existed
+        published_paths = [self._db_header_path] + [
+            self._db_path / chunk.header.filename
+            for chunk in self._chunks
+            if chunk.header
+        ]
+        for path in published_paths:
+            sidecar_path = path.with_name(path.name + ".gz")
+            if path.exists() and not sidecar_path.exists():
+                self._publish(path, path.read_bytes())
+
     def _init_header_fs(self):
-        self._db_path.mkdir(parents=True, exist_ok=True)
-        self._write_atomic(
+        self._publish(
             self._db_header_path,
             json.dumps(
                 Header(
@@ -201,9 +569,83 @@ class ReplayDB:
                     chunk_headers=[],
                     max_chunk_size=self._chunk_max_size,
                 ).to_dict()
-            ),
+            ).encode(),
         )
 
+    def _load_from_store(self):
+        with self._startup_phase("store"):
+            replays = self._store.load()  # already sorted
+            pending = self._store.load_pending()
+            self.by_id = {replay.id: replay for replay in replays}
+        # indexes are cheap to rebuild in memory, only changes get published
+        with self._startup_phase("indexes"):
+            for index in self._indexes:
+                index.update(replays)
+
+        # stats are saved together with clearing the pending log
+        with self._startup_phase("stats"):
+            if stats_rows := self._store.load_stats():
+                self._stats.load(stats_rows)
+                for pending_id, added in pending.items():
+                    if added:
+                        self._stats.add(self.by_id[pending_id])
+            else:
+                self._stats.rebuild(replays)
+
+        with self._startup_phase("chunks"):
+            self._load_published(replays, pending)
+
+    def _load_published(self, replays: list[Replay], pending: dict[str, bool]):
+        header = None
+        if self._db_header_path.exists():
+            header = Header.from_dict(
+                json.loads(self._db_header_path.read_text()), self._chunk_max_size
+            )
+
+        unpublished_count = sum(pending.values())
+        if header and header.total_count == len(replays) - unpublished_count:
+            # the pending log is replayed, and published on the next save
+            self.by_time.update(
+                replay for replay in replays if not pending.get(replay.id)
+            )
+            self._load_chunks(header)
+            for replay in replays:
+                if replay.id not in pending:
+                    continue
+                if pending[replay.id]:
+                    self._add_to_chunks(replay)
+                else:
+                    self._unsaved_mutated.add(replay)
+            # a mutated replay may have been renamed once compressed
+            for index in self._indexes:
+                index.mark_dirty(self._unsaved_added | self._unsaved_mutated)
+            if pending:
+                logger.info(f"Replayed {len(pending)} unpublished DB changes")
+        elif header and header.total_count == len(replays):
+            # crashed after publishing, but before clearing the pending log
+            self.by_time.update(replays)
+            self._load_chunks(header)
+            self._unsaved_mutated.update(
+                self.by_id[pending_id]
+                for pending_id, added in pending.items()
+                if not added
+            )
+        else:
+            logger.warning("Published DB is out of sync with the store")
+            self.by_time.update(replays)
+            self.republish()
+
+    def _load_chunks(self, header: Header):
+        self._chunks = [
+            _Chunk(
+                count=chunk_header.count,
+                header=chunk_header,
+                header_json=json.dumps(chunk_header.to_dict()),
+            )
+            for chunk_header in header.chunk_headers
+        ]
+        assert sum(chunk.count for chunk in self._chunks) == len(self.by_time)
+
     def _load_from_fs(self):
         with open(self._db_header_path, "r") as header_f:
             header = json.load(header_f)
@@ -216,11 +658,18 @@ class ReplayDB:
 
             chunk_replay_count = 0
             for filename, replay_data in chunk.items():
-                self._add_if_missing(Replay.from_jsonable(replay_data, filename))
+                self._index(Replay.from_jsonable(replay_data, filename))
                 chunk_replay_count += 1
 
             assert chunk_replay_count == chunk_header.count
             total_replay_count += chunk_replay_count
+            self._chunks.append(
+                _Chunk(
+                    count=chunk_replay_count,
+                    header=chunk_header,
+                    header_json=json.dumps(chunk_header.to_dict()),
+                )
+            )
 
         assert total_replay_count == header.total_count
 
@@ -228,46 +677,192 @@ class ReplayDB:
         self._unsaved_mutated.clear()
 
     def _add_if_missing(self, replay: Replay) -> Replay:
-        if replay.filename in self.by_filename:
-            return replay
+        if db_replay := self.by_id.get(replay.id):
+            return db_replay
+
+        self._store.add([replay])
+        self._store.log_pending([replay], added=True)
+        self._commit()
+
+        self.by_id[replay.id] = replay
+        self._add_to_chunks(replay)
+        for index in self._indexes:
+            index.add(replay)
+        self._stats.add(replay)
+        return replay
 
-        self.by_filename[replay.filename] = replay
+    def _add_to_chunks(self, replay: Replay):
         self.by_time.add(replay)
-
+        self._place_in_chunk(self.by_time.index(replay))
         self._unsaved_added.add(replay)
-        return replay
 
-    def _mark_fs_present(self, db_replay: Replay):
+    def _index(self, replay: Replay):
+        self.by_id[replay.id] = replay
+        self.by_time.add(replay)
+
+    def _place_in_chunk(self, replay_idx: int):
+        """Grows the chunk the replay landed in, splitting it when it overflows.
+
+        Appends to the last chunk start a new one, so chunks stay full
+        in the common case, while a late replay touches at most two chunks.
+        """
+        is_append = replay_idx == len(self.by_time) - 1
+        if not self._chunks or (
+                is_append and self._chunks[-1].count >= self._chunk_max_size
+        ):
+            self._chunks.append(chunk := _Chunk(count=1))
+            self._dirty_chunks.add(chunk)
+            return
+
+        chunk, chunk_idx = self._chunk_at(replay_idx, len(self.by_time) - 1)
+        chunk.count += 1
+        self._dirty_chunks.add(chunk)
+        if chunk.count > self._chunk_max_size:
+            split_count = chunk.count // 2
+            new_chunk = _Chunk(count=chunk.count - split_count)
+            self._chunks.insert(chunk_idx + 1, new_chunk)
+            self._dirty_chunks.add(new_chunk)
+            chunk.count = split_count
+
+    def _chunk_at(self, replay_idx: int, chunked_count: int) -> tuple[_Chunk, int]:
+        """Returns the chunk holding the replay index and the chunk's index.
+
+        `chunked_count` is the number of replays the chunks hold.
+        An index right past the last chunk belongs to the last chunk.
+        """
+        # new replays are mostly at the end
+        if replay_idx >= chunked_count - self._chunks[-1].count:
+            return self._chunks[-1], len(self._chunks) - 1
+
+        chunk_end = 0
+        for chunk_idx, chunk in enumerate(self._chunks):
+            chunk_end += chunk.count
+            if replay_idx < chunk_end:
+                return chunk, chunk_idx
+        return self._chunks[-1], len(self._chunks) - 1
+
+    def _write_chunk(self, db_chunk: tuple[Replay, ...]) -> ChunkHeader:
+        # same as json.dumps of {filename: jsonable}, but from cached entries
+        chunk_json = b"{%b}" % b", ".join(
+            replay.to_chunk_entry() for replay in db_chunk
+        )
+
+        chunk_hash = hashlib.blake2s(
+            chunk_json, digest_size=6, usedforsecurity=False
+        ).hexdigest()
+        chunk_name = f"chunk_{chunk_hash}.json"
+
+        self._publish(self._db_path / chunk_name, chunk_json)
+
+        return ChunkHeader(
+            filename=chunk_name,
+            oldest_replay_ts=db_chunk[0].finished_at,
+            latest_replay_ts=db_chunk[-1].finished_at,
+            count=len(db_chunk),
+        )
+
+    def _sync_with_fs(self, db_replay: Replay, size: int | None, has_raw: bool):
+        """Updates the replay from its files: the compressed one's size, if any,
+        and whether there is a raw one."""
+        if size is None:
+            self._mark_fs_missing(db_replay)
+        else:
+            self._mark_fs_present(db_replay, size)
+        if db_replay in self._awaiting_compression:
+            if not has_raw:
+                self._awaiting_compression.remove(db_replay)
+        elif has_raw:
+            self._awaiting_compression.add(db_replay)
+
+    def _mark_fs_present(self, db_replay: Replay, size: int):
+        self._track_downloadable(db_replay, size)
         if db_replay.downloadable:
             return
+        if not db_replay.is_compressed:
+            self._rename(db_replay, db_replay.filename + ".zip")
         logger.info(f"Marking replay {db_replay.filename} as available for download.")
-        db_replay.downloadable = True
+        db_replay.set_downloadable(True)
 
-        self._unsaved_mutated.add(db_replay)
+        self._log_mutated(db_replay)
+
+    def _rename(self, db_replay: Replay, new_filename: str):
+        # committed together with `downloadable`, by `_log_mutated`
+        self._store.rename(db_replay.filename, new_filename)
+        db_replay.rename(new_filename)
+        for index in self._indexes:
+            # their shards list filenames, n-gram shards only list steam ids
+            if isinstance(index, ShardedIndex):
+                index.mark_dirty([db_replay])
 
     def _mark_fs_missing(self, db_replay: Replay):
+        self._untrack_downloadable(db_replay)
         if not db_replay.downloadable:
             return
         logger.info(
             f"Marking replay {db_replay.filename} as not available for download."
         )
-        db_replay.downloadable = False
+        db_replay.set_downloadable(False)
+
+        self._log_mutated(db_replay)
+
+    def _track_downloadable(self, db_replay: Replay, size: int):
+        if (old_size := self._downloadable_sizes.get(db_replay)) is None:
+            self._downloadable_by_time.add(db_replay)
+            old_size = 0
+        self._downloadable_sizes[db_replay] = size
+        self.downloadable_bytes += size - old_size
+
+    def _untrack_downloadable(self, db_replay: Replay):
+        if (size := self._downloadable_sizes.pop(db_replay, None)) is not None:
+            self._downloadable_by_time.remove(db_replay)
+            self.downloadable_bytes -= size
+
+    def _log_mutated(self, db_replay: Replay):
+        self._store.update_downloadable([db_replay])
+        self._store.log_pending([db_replay], added=False)
+        self._commit()
 
         self._unsaved_mutated.add(db_replay)
 
+    def _build_replay_scheduled(self, replay_path: Path) -> Replay | None:
+        if not self._scheduler:
+            return self._build_replay(replay_path)
+        # the reconciling thread holds the lock, so it's charged, but never waits
+        with self._scheduler.charged(Priority.COMPRESS):
+            return self._build_replay(replay_path)
+
+    @classmethod
+    def _build_replay(cls, replay_path: Path) -> Replay | None:
+        """Parses a new replay, a raw one isn't downloadable until compressed."""
+        logger.info(f"Ingesting new replay {replay_path.name}")
+
+        try:
+            parsing_result = cls._parse(replay_path)
+        except FileNotFoundError:
+            logger.warning(f"Replay {replay_path.name} disappeared while ingesting")
+            return None
+
+        return Replay(
+            filename=replay_path.name,
+            downloadable=replay_path.suffix == ".zip",
+            finished_at=parsing_result.finished_at,
+            metadata=parsing_result.metadata,
+        )
+
     @classmethod
     def _parse(cls, replay_path: Path) -> ParsedReplay:
         # TODO: replay count can be parsed from replay header
         try:
-            if replay_path.suffix == ".zip":
-                metadata = ReplayMetadata.from_construct(
-                    parse_zip_compressed(replay_path)
-                )
-            elif replay_path.suffix == ".rep":
-                metadata = ReplayMetadata.from_construct(parse_raw(replay_path))
-            else:
-                raise ValueError(f"Unsupported replay file type: {replay_path.suffix}")
-        except (ConstructError, error) as exc:
+            with PARSE_SECONDS.time():
+                if replay_path.suffix == ".zip":
+                    metadata = parse_zip_compressed(replay_path)
+                elif replay_path.suffix == ".rep":
+                    metadata = parse_raw(replay_path)
+                else:
+                    raise ValueError(
+                        f"Unsupported replay file type: {replay_path.suffix}"
+                    )
+        except (HeaderParseError, error) as exc:
             metadata = None
             logger.warning(f"Failed to parse replay {replay_path}", exc_info=exc)
 
@@ -280,18 +875,16 @@ class ReplayDB:
         if replay_path.suffix == ".zip":
             return replay_path
 
-        with zipfile.ZipFile(
-                replay_path.with_suffix(".rep.zip.tmp"), "w",
-                compression=zipfile.ZIP_DEFLATED,
-        ) as replay_zip:
-            replay_zip.write(replay_path)
+        tmp_path = replay_path.with_suffix(".rep.zip.tmp")
+        with COMPRESS_SECONDS.time():
+            compress_replay(replay_path, tmp_path, replay_path.name)
+        COMPRESS_READ_BYTES.inc(replay_path.stat().st_size)
+        COMPRESS_WRITTEN_BYTES.inc(tmp_path.stat().st_size)
 
         # if we crash here, we will have dangling .tmp
         # but since the original replay is still here, it will be just rewritten
 
-        replay_path.with_suffix(".rep.zip.tmp").replace(
-            replay_path.with_suffix(".rep.zip")
-        )
+        tmp_path.replace(replay_path.with_suffix(".rep.zip"))
 
         # if we crash here, we will have dangling .rep,
         # but it will be processed again and removed on next reconciliation
@@ -300,6 +893,21 @@ class ReplayDB:
 
         return replay_path.with_suffix(".rep.zip")
 
+    @classmethod
+    def _publish(cls, path: Path, data: bytes):
+        """Writes a JSON for nginx, with a precompressed sidecar for `gzip_static`."""
+        # the sidecar goes first, so it's never older than what it stands for
+        cls._write_atomic(
+            path.with_name(path.name + ".gz"),
+            gzip.compress(data, compresslevel=9, mtime=0),
+        )
+        cls._write_atomic(path, data)
+
+    @staticmethod
+    def _unpublish(path: Path):
+        path.unlink()
+        path.with_name(path.name + ".gz").unlink(missing_ok=True)  # may predate
+
     @staticmethod
     def _write_atomic(path: Path, obj: str | bytes):
         tmp = path.with_suffix(path.suffix + ".tmp")
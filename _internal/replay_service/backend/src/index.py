@@ -0,0 +1,213 @@
+import json
+from bisect import bisect_left, insort
+from collections import defaultdict
+from collections.abc import Callable, Iterable
+from datetime import datetime
+
+from src.model import Replay
+
+
+def player_steam_ids(replay: Replay) -> Iterable[str]:
+    if not replay.metadata:
+        return ()
+    return (player.steam_id for player in replay.metadata.players)
+
+
+def map_steam_ids(replay: Replay) -> Iterable[str]:
+    if not replay.metadata:
+        return ()
+    return (replay.metadata.map_steam_id,)
+
+
+class ShardedIndex:
+    """Inverted index from a key to replays, published as static JSON files.
+
+    A key's replays, oldest first, are split into pages of `PAGE_SIZE`, so
+    a page stays small however many replays the key has, and a new replay
+    mostly changes the key's last page only.
+    The frontend fetches `<name>/<last two characters of key>.json` to look up
+    a key, a shard of all keys ending with the same two characters,
+    `{key: replay count}`, and then the pages it shows,
+    `<name>/<key>/<page number>.json`, `[replay filename, ...]`.
+    Only shards and pages of changed keys are republished.
+    """
+
+    SHARD_SUFFIX_LEN = 2
+    PAGE_SIZE = 200
+
+    def __init__(self, name: str, keys_of: Callable[[Replay], Iterable[str]]):
+        self.name = name
+        self._keys_of = keys_of
+        # kept sorted on insert, in order of addition for equal times like the store
+        self._replays_by_key: dict[str, list[Replay]] = defaultdict(list)
+        self._keys_by_shard: dict[str, set[str]] = defaultdict(set)
+        self._dirty_shards: set[str] = set()
+        self._dirty_pages: set[tuple[str, int]] = set()
+
+    @classmethod
+    def shard_of(cls, key: str) -> str:
+        return key[-cls.SHARD_SUFFIX_LEN :].rjust(cls.SHARD_SUFFIX_LEN, "0")
+
+    @property
+    def is_dirty(self) -> bool:
+        return bool(self._dirty_shards or self._dirty_pages)
+
+    def add(self, replay: Replay):
+        self.update([replay])
+        self.mark_dirty([replay])
+
+    def update(self, replays: Iterable[Replay]):
+        """Indexes replays without marking them for publishing, e.g. on load."""
+        for replay in replays:
+            for key in set(self._keys_of(replay)):
+                key_replays = self._replays_by_key[key]
+                if not key_replays:
+                    self._keys_by_shard[self.shard_of(key)].add(key)
+                if not key_replays or key_replays[-1].finished_at <= replay.finished_at:
+                    key_replays.append(replay)  # the usual case, and all of a load
+                else:
+                    insort(key_replays, replay, key=_finished_at)
+
+    def mark_dirty(self, replays: Iterable[Replay]):
+        """Marks pages of replays and all later ones, which an added replay shifts."""
+        for replay in replays:
+            for key in set(self._keys_of(replay)):
+                key_replays = self._replays_by_key[key]
+                first_page = (
+                    bisect_left(key_replays, replay.finished_at, key=_finished_at)
+                    // self.PAGE_SIZE
+                )
+                self._dirty_pages.update(
+                    (key, page)
+                    for page in range(first_page, self._page_count(key_replays))
+                )
+                self._dirty_shards.add(self.shard_of(key))
+
+    def mark_all_dirty(self):
+        self._dirty_shards.update(self._keys_by_shard)
+        for key, key_replays in self._replays_by_key.items():
+            self._dirty_pages.update(
+                (key, page) for page in range(self._page_count(key_replays))
+            )
+
+    def pop_dirty_shards(self) -> dict[str, bytes]:
+        """Returns serialized dirty shards and pages by path relative to the index."""
+        shards = {}
+        for shard in self._dirty_shards:
+            shard_json = {
+                key: len(self._replays_by_key[key])
+                for key in sorted(self._keys_by_shard[shard])
+            }
+            shards[f"{self.name}/{shard}.json"] = json.dumps(shard_json).encode()
+        for key, page in self._dirty_pages:
+            start = page * self.PAGE_SIZE
+            page_json = [
+                replay.filename
+                for replay in self._replays_by_key[key][start : start + self.PAGE_SIZE]
+            ]
+            shards[f"{self.name}/{key}/{page}.json"] = json.dumps(page_json).encode()
+        self._dirty_shards.clear()
+        self._dirty_pages.clear()
+        return shards
+
+    @classmethod
+    def _page_count(cls, key_replays: list[Replay]) -> int:
+        return -(-len(key_replays) // cls.PAGE_SIZE)
+
+
+def _finished_at(replay: Replay) -> datetime:
+    return replay.finished_at
+
+
+def player_names(replay: Replay) -> Iterable[tuple[str, str]]:
+    if not replay.metadata:
+        return ()
+    return ((player.name, player.steam_id) for player in replay.metadata.players)
+
+
+def map_titles(replay: Replay) -> Iterable[tuple[str, str]]:
+    if not replay.metadata:
+        return ()
+    return ((replay.metadata.map_title, replay.metadata.map_steam_id),)
+
+
+class NgramIndex:
+    """Substring search over names, published as static JSON shards.
+
+    A name is indexed under its casefolded 1 and 2 character prefixes and
+    all of its trigrams. Names map to every steam id seen with them, so
+    renamed players are found by any of their names.
+    A shard holds n-grams starting with the same character, so the frontend
+    fetches `<name>/<hex code point of the first character>.json`.
+    A shard is `{ngram: {name: [steam id, ...]}}`; the frontend intersects
+    the names of the query's trigrams (or looks up a shorter query as a
+    prefix) and checks the substring match itself.
+    Only shards of changed n-grams are republished.
+    """
+
+    def __init__(
+        self, name: str, names_of: Callable[[Replay], Iterable[tuple[str, str]]]
+    ):
+        self.name = name
+        self._names_of = names_of
+        self._ids_by_name: dict[str, set[str]] = defaultdict(set)
+        self._names_by_ngram: dict[str, set[str]] = defaultdict(set)
+        self._ngrams_by_shard: dict[str, set[str]] = defaultdict(set)
+        self._dirty_shards: set[str] = set()
+
+    @staticmethod
+    def ngrams_of(name: str) -> set[str]:
+        name = name.casefold()
+        ngrams = {name[:1], name[:2]}
+        ngrams.update(name[idx : idx + 3] for idx in range(len(name) - 2))
+        ngrams.discard("")
+        return ngrams
+
+    @staticmethod
+    def shard_of(ngram: str) -> str:
+        return f"{ord(ngram[0]):x}"
+
+    @property
+    def is_dirty(self) -> bool:
+        return bool(self._dirty_shards)
+
+    def add(self, replay: Replay):
+        for name, key in self._names_of(replay):
+            if key not in self._ids_by_name.get(name, ()):
+                self._dirty_shards.update(map(self.shard_of, self.ngrams_of(name)))
+        self.update([replay])
+
+    def update(self, replays: Iterable[Replay]):
+        """Indexes replays without marking them for publishing, e.g. on load."""
+        for replay in replays:
+            for name, key in self._names_of(replay):
+                if not name:
+                    continue
+                if name not in self._ids_by_name:
+                    for ngram in self.ngrams_of(name):
+                        self._names_by_ngram[ngram].add(name)
+                        self._ngrams_by_shard[self.shard_of(ngram)].add(ngram)
+                self._ids_by_name[name].add(key)
+
+    def mark_dirty(self, replays: Iterable[Replay]):
+        for replay in replays:
+            for name, _ in self._names_of(replay):
+                self._dirty_shards.update(map(self.shard_of, self.ngrams_of(name)))
+
+    def mark_all_dirty(self):
+        self._dirty_shards.update(self._ngrams_by_shard)
+
+    def pop_dirty_shards(self) -> dict[str, bytes]:
+        """Returns serialized dirty shards by their path relative to the index."""
+        shards = {}
+        for shard in self._dirty_shards:
+            shard_json = {
+                ngram: {
+                    name: sorted(self._ids_by_name[name])
+                    for name in sorted(self._names_by_ngram[ngram])
+                }
+                for ngram in sorted(self._ngrams_by_shard[shard])
+            }
+            shards[f"{self.name}/{shard}.json"] = json.dumps(shard_json).encode()
+        self._dirty_shards.clear()
+        return shards
@@ -1,14 +1,20 @@
 import logging
 import threading
+import time
+from concurrent.futures import Future
 from dataclasses import dataclass
 from os import environ
 from pathlib import Path
-from queue import SimpleQueue
-
-from inotify_simple import INotify, flags
 
 from src.cleaner import Cleaner, CleanerConfig, GiB, MiB
 from src.db import ReplayDB
+from src.metrics import REGISTRY, serve
+from src.retention import DownloadCounter, OldestFirst, PopularityAware, RetentionPolicy
+from src.compression import configure_pool, deflate_cpu_seconds
+from src.scheduler import Priority, Scheduler, lower_thread_priority
+from src.store import STORE_FILENAME, DownloadStore
+from src.tiering import Recompressor, Tier
+from src.watcher import EventQueue, ReconcileEvent, ReplayEvent, ReplayWatcher
 
 logging.basicConfig(
     level=logging.INFO,
@@ -20,72 +26,252 @@ logger = logging.getLogger(__name__)
 REPLAY_FOLDER = Path(environ["REPLAY_FOLDER"])
 DB_PATH = Path(environ["DB_PATH"])
 MIN_FREE_SPACE_RATIO = float(environ["MIN_FREE_SPACE_RATIO"])
+# cleanup frees space up to this ratio once started, defaults to a bit above the minimum
+TARGET_FREE_SPACE_RATIO = float(
+    environ.get("TARGET_FREE_SPACE_RATIO", min(MIN_FREE_SPACE_RATIO + 0.02, 0.99))
+)
 MIN_REPLAY_RETENTION_MiB = int(environ["MIN_REPLAY_RETENTION_MiB"])
 MIN_EXPECTED_DISK_GiB = int(environ["MIN_EXPECTED_DISK_GiB"])
 CLEAN_INTERVAL_SECONDS = 1800  # there is no reason to put it in envs
+MIN_CLEAN_INTERVAL_SECONDS = 10
+# after the first event, wait this long for more before saving the DB
+BATCH_MAX_DELAY_SECONDS = float(environ.get("BATCH_MAX_DELAY_SECONDS", 0.25))
+BATCH_MAX_SIZE = int(environ.get("BATCH_MAX_SIZE", 100))
+# pending work items, the inotify reader blocks when there are more
+EVENT_QUEUE_SIZE = int(environ.get("EVENT_QUEUE_SIZE", 1000))
+INOTIFY_READ_DELAY_MS = 50
+# "oldest" deletes by age only, "popularity" also keeps recently downloaded replays
+RETENTION_POLICY = environ.get("RETENTION_POLICY", OldestFirst.name)
+if RETENTION_POLICY not in (OldestFirst.name, PopularityAware.name):
+    raise ValueError(f"Unknown RETENTION_POLICY {RETENTION_POLICY!r}")
+# nginx log of replay downloads, in the `downloads` format, for the popularity policy
+ACCESS_LOG_PATH = Path(environ.get("ACCESS_LOG_PATH", "/nginx_logs/downloads.log"))
+DOWNLOAD_HALF_LIFE_DAYS = float(environ.get("DOWNLOAD_HALF_LIFE_DAYS", 7))
+# the log is truncated once read past this, nothing else rotates it
+ACCESS_LOG_MAX_MiB = 16
+# recompress replays older than N days with a stronger method, e.g. "7:deflate,30:lzma"
+RECOMPRESS_TIERS = Tier.parse_all(environ.get("RECOMPRESS_TIERS", ""))
+RECOMPRESS_MAX_SECONDS_PER_PASS = 60
+# CPU seconds per second for background work, publishing may go over it
+CPU_BUDGET = float(environ.get("CPU_BUDGET", 0.05))
+# niceness of the compressor's and cleaner's threads, which compress and delete replays
+BACKGROUND_NICENESS = int(environ.get("BACKGROUND_NICENESS", 10))
+# threads deflating a replay, each takes a CPU; the pool is reniced to BACKGROUND_NICENESS
+COMPRESS_THREADS = int(environ.get("COMPRESS_THREADS", 1))
+# parallel jobs for ingesting a backlog on start, defaults to the container's CPU quota
+RECONCILE_JOBS = int(environ.get("RECONCILE_JOBS", 0)) or None
+# on start, the folder is diffed with a manifest, but stat'ed in full this often
+FULL_RECONCILE_INTERVAL_DAYS = float(environ.get("FULL_RECONCILE_INTERVAL_DAYS", 7))
+# Prometheus text format on http://METRICS_HOST:METRICS_PORT/metrics, 0 disables it
+METRICS_HOST = environ.get("METRICS_HOST", "0.0.0.0")
+METRICS_PORT = int(environ.get("METRICS_PORT", 0))
 
+INGEST_LATENCY_SECONDS = REGISTRY.histogram(
+    "replay_ingest_latency_seconds",
+    "From a replay's inotify event to the DB save publishing it, in seconds.",
+)
 
-@dataclass(frozen=True)
-class ReplayEvent:
-    filename: str
 
+@dataclass
+class FlushStats:
+    flushes: int = 0
+    events: int = 0
+    last_batch_size: int = 0
+    max_batch_size: int = 0
 
-def replay_worker(queue: SimpleQueue[ReplayEvent], db_ready: threading.Event):
-    db = ReplayDB(DB_PATH, REPLAY_FOLDER)
-    db_ready.set()  # db reconciliation is finished
+    def record(self, batch_size: int):
+        self.flushes += 1
+        self.events += batch_size
+        self.last_batch_size = batch_size
+        self.max_batch_size = max(self.max_batch_size, batch_size)
 
-    while True:
-        event = queue.get()
-        db.ingest_replay(event.filename)
-        db.save_to_fs()
 
+def replay_worker(
+    queue: EventQueue,
+    db_ready: Future[ReplayDB],
+    compress_requested: threading.Event,
+    clean_up_requested: threading.Event,
+    scheduler: Scheduler,
+):
+    db = ReplayDB(
+        DB_PATH,
+        REPLAY_FOLDER,
+        reconcile_jobs=RECONCILE_JOBS,
+        scheduler=scheduler,
+        full_reconcile_interval_seconds=FULL_RECONCILE_INTERVAL_DAYS * 24 * 3600,
+    )
+    db_ready.set_result(db)  # db reconciliation is finished
+    compress_requested.set()  # raw replays found on reconciliation
 
-def inotify_producer(queue: SimpleQueue, db_ready: threading.Event):
-    inotify = INotify()
-    watch_flags = flags.CLOSE_WRITE | flags.MOVED_TO | flags.MOVED_FROM | flags.DELETE
+    stats = FlushStats()
+    while True:
+        batch = queue.get_batch(BATCH_MAX_SIZE, BATCH_MAX_DELAY_SECONDS)
+        for event in batch:
+            match event:
+                case ReplayEvent(filename):
+                    # only the header is read, compression is left for the compressor
+                    with scheduler.slot(Priority.PUBLISH):
+                        db.ingest_replay(filename)
+                case ReconcileEvent():
+                    # holds db.lock throughout, which other work waits for anyway
+                    db.reconcile()
+        with scheduler.slot(Priority.PUBLISH):
+            db.save_to_fs()
+        saved_at = time.monotonic()
+        for event in batch:
+            if isinstance(event, ReplayEvent):
+                INGEST_LATENCY_SECONDS.observe(saved_at - event.queued_at)
+        # never blocks, the compressor takes published raw replays from the DB
+        compress_requested.set()
+        clean_up_requested.set()  # new replays take space, let the cleaner check
 
-    inotify.add_watch(REPLAY_FOLDER.resolve(), watch_flags)
+        stats.record(len(batch))
+        logger.info(
+            "Flushed a batch of %d events (flushes: %d, events: %d, max batch: %d, "
+            "coalesced: %d, max queue depth: %d)",
+            stats.last_batch_size,
+            stats.flushes,
+            stats.events,
+            stats.max_batch_size,
+            queue.coalesced,
+            queue.max_depth,
+        )
 
-    db_ready.wait()
 
+def compressor(
+    db_ready: Future[ReplayDB],
+    compress_requested: threading.Event,
+    clean_up_requested: threading.Event,
+    scheduler: Scheduler,
+):
+    db = db_ready.result()
+    lower_thread_priority(BACKGROUND_NICENESS)
     while True:
-        for event in inotify.read(read_delay=10_000):
-            name = event.name
-            mask = flags.from_mask(event.mask)
+        compress_requested.wait()
+        compress_requested.clear()
+        while batch := db.pop_awaiting_compression(BATCH_MAX_SIZE):
+            for replay in batch:
+                try:
+                    # not a slot, publishing of new replays mustn't wait for compression
+                    with scheduler.budgeted(Priority.COMPRESS):
+                        deflated_before = deflate_cpu_seconds()
+                        db.compress(replay.filename)
+                        # the pool's threads deflate, so their CPU time is charged here
+                        scheduler.charge(
+                            Priority.COMPRESS, deflate_cpu_seconds() - deflated_before
+                        )
+                except Exception:
+                    # the raw replay stays published, it's compressed after a restart
+                    logger.exception(
+                        "Compressor failed on %s, but will continue", replay.filename
+                    )
+            try:
+                # once per batch, a save rewrites the chunks of all compressed replays
+                with scheduler.slot(Priority.PUBLISH):
+                    db.save_to_fs()
+            except Exception:
+                logger.exception("Compressor failed to save the DB, but will continue")
+            clean_up_requested.set()
 
-            if flags.IGNORED in mask:
-                raise RuntimeError("inotify watcher is deleted!")
 
-            if not name or flags.ISDIR in mask:
-                continue
+def inotify_producer(queue: EventQueue, db_ready: Future[ReplayDB]):
+    watcher = ReplayWatcher(REPLAY_FOLDER, queue, read_delay_ms=INOTIFY_READ_DELAY_MS)
+    db_ready.result()
+    watcher.watch_forever()
 
-            if flags.CLOSE_WRITE in mask or flags.MOVED_TO in mask:
-                if name.endswith(".rep") or name.endswith(".rep.zip"):
-                    queue.put(ReplayEvent(name))
 
-            elif flags.DELETE in mask or flags.MOVED_FROM in mask:
-                if name.endswith(".rep.zip"):
-                    queue.put(ReplayEvent(name))
+def make_retention_policy() -> RetentionPolicy:
+    if RETENTION_POLICY == OldestFirst.name:
+        return OldestFirst()
 
+    downloads = DownloadCounter(
+        ACCESS_LOG_PATH,
+        DownloadStore(DB_PATH / STORE_FILENAME),
+        half_life_seconds=DOWNLOAD_HALF_LIFE_DAYS * 24 * 3600,
+        max_log_bytes=ACCESS_LOG_MAX_MiB * MiB,
+    )
+    return PopularityAware(downloads)
 
-def cleaner(db_ready: threading.Event):
-    db_ready.wait()
+
+def cleaner(
+    db_ready: Future[ReplayDB],
+    clean_up_requested: threading.Event,
+    scheduler: Scheduler,
+):
+    db = db_ready.result()
+    lower_thread_priority(BACKGROUND_NICENESS)
 
     Cleaner(
         CleanerConfig(
             replay_folder=REPLAY_FOLDER,
             min_free_space_ratio=MIN_FREE_SPACE_RATIO,
+            target_free_space_ratio=TARGET_FREE_SPACE_RATIO,
             min_replay_retention_bytes=MIN_REPLAY_RETENTION_MiB * MiB,
             min_expected_disk_size_bytes=MIN_EXPECTED_DISK_GiB * GiB,
             clean_interval_seconds=CLEAN_INTERVAL_SECONDS,
-        )
+            min_clean_interval_seconds=MIN_CLEAN_INTERVAL_SECONDS,
+        ),
+        db,
+        wake_up=clean_up_requested,
+        policy=make_retention_policy(),
+        recompressor=Recompressor(
+            db,
+            RECOMPRESS_TIERS,
+            scheduler,
+            max_seconds_per_pass=RECOMPRESS_MAX_SECONDS_PER_PASS,
+        ),
+        scheduler=scheduler,
     ).clean_up_forever()
 
 
 if __name__ == "__main__":
-    replay_queue = SimpleQueue()
-    db_ready = threading.Event()
+    replay_queue = EventQueue(maxsize=EVENT_QUEUE_SIZE)
+    db_ready: Future[ReplayDB] = Future()
+    # raw replays were published, and wait in the DB to become downloadable
+    compress_requested = threading.Event()
+    clean_up_requested = threading.Event()
+    scheduler = Scheduler(cpu_budget=CPU_BUDGET)
+    configure_pool(COMPRESS_THREADS, niceness=BACKGROUND_NICENESS)
+
+    if METRICS_PORT:
+        REGISTRY.gauge(
+            "replay_event_queue_depth",
+            "Replay events waiting for the worker.",
+            read=replay_queue.__len__,
+        )
+        REGISTRY.gauge(
+            "replay_compress_queue_depth",
+            "Published raw replays waiting for the compressor.",
+            read=lambda: (
+                db_ready.result().awaiting_compression_count
+                if db_ready.done()
+                else None
+            ),
+        )
+        serve(METRICS_HOST, METRICS_PORT)
 
-    threading.Thread(target=inotify_producer, args=(replay_queue, db_ready)).start()
-    threading.Thread(target=replay_worker, args=(replay_queue, db_ready)).start()
-    threading.Thread(target=cleaner, args=(db_ready,)).start()
+    threads = [
+        threading.Thread(target=inotify_producer, args=(replay_queue, db_ready)),
+        threading.Thread(
+            target=replay_worker,
+            args=(
+                replay_queue,
+                db_ready,
+                compress_requested,
+                clean_up_requested,
+                scheduler,
+            ),
+        ),
+        threading.Thread(
+            target=compressor,
+            args=(db_ready, compress_requested, clean_up_requested, scheduler),
+        ),
+        threading.Thread(
+            target=cleaner, args=(db_ready, clean_up_requested, scheduler)
+        ),
+    ]
+    for thread in threads:
+        thread.start()
+    # thread pools refuse new work once the main thread exits
+    for thread in threads:
+        thread.join()
@@ -0,0 +1,208 @@
+import bisect
+import logging
+import math
+import os
+import threading
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from http.server import ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# seconds, from a header parse to compressing a large replay under the CPU cap
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100)
+CGROUP_CPU_STAT = Path("/sys/fs/cgroup/cpu.stat")
+
+
+class _Metric:
+    type: str
+
+    def __init__(
+        self, name: str, help: str, read: Callable[[], float | None] | None = None
+    ):
+        self.name = name
+        self.help = help
+        # for values kept elsewhere, read on each scrape, None if unavailable
+        self._read = read
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def samples(self) -> Iterator[tuple[str, float]]:
+        value = self._read() if self._read else self._value
+        if value is not None:
+            yield self.name, value
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self._value += amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def __init__(
+        self, name: str, help: str, read: Callable[[], float | None] | None = None
+    ):
+        super().__init__(name, help, read)
+        self._value = None  # not rendered until set
+
+    def set(self, value: float):
+        self._value = value
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: tuple[float, ...]):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)  # the last one is +Inf
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        # buckets are upper bounds, inclusive
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[idx] += 1
+            self._sum += value
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def samples(self) -> Iterator[tuple[str, float]]:
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        cumulative = 0
+        for bound, count in zip((*self.buckets, math.inf), counts):
+            cumulative += count
+            yield f'{self.name}_bucket{{le="{_format(bound)}"}}', cumulative
+        yield f"{self.name}_sum", total
+        yield f"{self.name}_count", cumulative
+
+
+class Registry:
+    """Metrics of the service, rendered in Prometheus' text format on a scrape."""
+
+    def __init__(self):
+        self._metrics: dict[str, _Metric | Histogram] = {}
+
+    def counter(
+        self, name: str, help: str, read: Callable[[], float | None] | None = None
+    ) -> Counter:
+        return self._register(Counter(name, help, read))
+
+    def gauge(
+        self, name: str, help: str, read: Callable[[], float | None] | None = None
+    ) -> Gauge:
+        return self._register(Gauge(name, help, read))
+
+    def histogram(
+        self, name: str, help: str, buckets: tuple[float, ...] = DURATION_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, help, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(f"{name} {_format(value)}" for name, value in metric.samples())
+        return "\n".join(lines) + "\n"
+
+    def _register[M: _Metric | Histogram](self, metric: M) -> M:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name!r} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+
+def _format(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+def _resident_memory_bytes() -> int | None:
+    try:
+        resident_pages = Path("/proc/self/statm").read_text().split()[1]
+    except OSError:
+        return None
+    return int(resident_pages) * os.sysconf("SC_PAGE_SIZE")
+
+
+def _cgroup_throttled_seconds() -> float | None:
+    # cgroup v2, as seen from within the container
+    try:
+        lines = CGROUP_CPU_STAT.read_text().splitlines()
+    except OSError:
+        return None
+    cpu_stat = dict(line.split() for line in lines)
+    if "throttled_usec" not in cpu_stat:
+        return None
+    return int(cpu_stat["throttled_usec"]) / 10**6
+
+
+REGISTRY = Registry()
+REGISTRY.gauge(
+    "process_resident_memory_bytes",
+    "Resident memory size in bytes.",
+    read=_resident_memory_bytes,
+)
+REGISTRY.counter(
+    "process_cpu_seconds_total",
+    "User and system CPU time spent in seconds.",
+    read=time.process_time,
+)
+# the `cpus` limit of the container, waits here show up as latency elsewhere
+REGISTRY.counter(
+    "cgroup_cpu_throttled_seconds_total",
+    "Time the container was throttled by its CPU limit, in seconds.",
+    read=_cgroup_throttled_seconds,
+)
+
+
+def serve(
+    host: str, port: int, registry: Registry = REGISTRY
+) -> "ThreadingHTTPServer":
+    """Serves `/metrics` from a daemon thread, until `shutdown` of the server."""
+    # pulls in email and html, so it's imported only when metrics are enabled
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.partition("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args):
+            logger.debug(format, *args)  # every scrape would be an access log line
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info("Serving metrics on %s:%d/metrics", *server.server_address[:2])
+    return server
@@ -1,27 +1,39 @@
-import dataclasses
-from dataclasses import dataclass
+import json
+import sys
+from dataclasses import dataclass, field
 from datetime import datetime
-from typing import ClassVar, Self
+from typing import TYPE_CHECKING, ClassVar, Self
 
-from arrow import Arrow
-from construct import Container
+if TYPE_CHECKING:  # both come with the construct parser, which is loaded lazily
+    from arrow import Arrow
+    from construct import Container
 
 
-@dataclass(frozen=True)
+# Thousands of replays repeat the same few hosts, maps and players,
+# so their strings are interned and objects are slotted.
+
+
+@dataclass(frozen=True, slots=True)
 class Player:
     name: str
     score: int
     team: int
     steam_id: str  # it's a large integer, frontend JS would need a special treatment
 
+    def __post_init__(self):
+        object.__setattr__(self, "name", sys.intern(self.name))
+        object.__setattr__(self, "steam_id", sys.intern(self.steam_id))
+
     @classmethod
-    def from_construct(cls, cont: Container) -> Self:
+    def from_construct(cls, cont: "Container") -> Self:
         return cls(
             name=cont.name, score=cont.score, team=cont.team, steam_id=str(cont.steam_id)
         )
 
 
-@dataclass(frozen=True)
+# not frozen, as a frozen __init__ would make up a third of loading the store;
+# it's never changed once built, all the same
+@dataclass(slots=True)
 class ReplayMetadata:
     protocol_version: int
     host_name: str
@@ -31,11 +43,17 @@ class ReplayMetadata:
     players: list[Player]
     marker_count: int
     started_at: (
-        Arrow | datetime
+        "Arrow | datetime"
     )  #  construct parses as Arrow, but it's habitual to use datetime
 
+    def __post_init__(self):
+        self.host_name = sys.intern(self.host_name)
+        self.game_mode = sys.intern(self.game_mode)
+        self.map_steam_id = sys.intern(self.map_steam_id)
+        self.map_title = sys.intern(self.map_title)
+
     @classmethod
-    def from_construct(cls, cont: Container) -> Self:
+    def from_construct(cls, cont: "Container") -> Self:
         return cls(
             protocol_version=cont.protocol_version,
             host_name=cont.host_name,
@@ -47,40 +65,101 @@ class ReplayMetadata:
             started_at=cont.started_at,
         )
 
+    @classmethod
+    def from_jsonable(cls, meta: dict) -> Self:
+        return cls(
+            protocol_version=meta["protocol_version"],
+            host_name=meta["host_name"],
+            game_mode=meta["game_mode"],
+            # early DBs have steam ids as numbers
+            map_steam_id=str(meta["map_steam_id"]),
+            map_title=meta["map_title"],
+            players=[
+                Player(
+                    name=p["name"],
+                    score=p["score"],
+                    team=p["team"],
+                    steam_id=str(p["steam_id"]),
+                )
+                for p in meta["players"]
+            ],
+            marker_count=meta["marker_count"],
+            started_at=datetime.fromisoformat(meta["started_at"]),
+        )
 
-@dataclass(frozen=True)
+    def to_jsonable(self) -> dict:
+        return {
+            "protocol_version": self.protocol_version,
+            "host_name": self.host_name,
+            "game_mode": self.game_mode,
+            "map_steam_id": self.map_steam_id,
+            "map_title": self.map_title,
+            "players": [
+                {
+                    "name": p.name,
+                    "score": p.score,
+                    "team": p.team,
+                    "steam_id": p.steam_id,
+                }
+                for p in self.players
+            ],
+            "marker_count": self.marker_count,
+            "started_at": self.started_at.isoformat(),
+        }
+
+
+@dataclass(frozen=True, slots=True)
 class ParsedReplay:
     finished_at: datetime
     metadata: ReplayMetadata | None
 
 
-@dataclass
+def replay_id(filename: str) -> str:
+    """The raw `.rep` name, which stays the same once the replay is compressed."""
+    return filename.removesuffix(".zip")
+
+
+@dataclass(slots=True)
 class Replay:
-    filename: str  # never change!
+    filename: str  # `.rep` until compressed, then `.rep.zip`, never changes after
     finished_at: datetime  # never change!
     downloadable: bool = False
     metadata: ReplayMetadata | None = None
+    # serialized chunk entry, `set_downloadable` and `rename` invalidate it
+    _chunk_entry: bytes | None = field(
+        default=None, init=False, repr=False, compare=False
+    )
+    # hashed on every set and dict lookup, so not derived each time
+    id: str = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.id = replay_id(self.filename)
+
+    def set_downloadable(self, downloadable: bool):
+        self.downloadable = downloadable
+        self._chunk_entry = None
+
+    def rename(self, filename: str):
+        """Changes the file's name, the id stays the same."""
+        assert replay_id(filename) == self.id
+        self.filename = filename
+        self._chunk_entry = None
+
+    @property
+    def is_compressed(self) -> bool:
+        return self.filename.endswith(".zip")
 
     def __hash__(self):
-        return hash(self.filename)
+        return hash(self.id)
 
     def __eq__(self, other):
-        return isinstance(other, Replay) and self.filename == other.filename
+        return isinstance(other, Replay) and self.id == other.id
 
     @classmethod
     def from_jsonable(cls, replay_json: dict, replay_filename: str) -> Self:
         metadata = None
         if meta := replay_json["metadata"]:
-            metadata = ReplayMetadata(
-                protocol_version=meta["protocol_version"],
-                host_name=meta["host_name"],
-                game_mode=meta["game_mode"],
-                map_steam_id=meta["map_steam_id"],
-                map_title=meta["map_title"],
-                players=[Player(**p) for p in meta["players"]],
-                marker_count=meta["marker_count"],
-                started_at=datetime.fromisoformat(meta["started_at"]),
-            )
+            metadata = ReplayMetadata.from_jsonable(meta)
 
         return cls(
             filename=replay_filename,
@@ -90,15 +169,22 @@ class Replay:
         )
 
     def to_jsonable(self) -> dict:
-        dct = dataclasses.asdict(self)  # this is recursive, deep-copy
-        del dct["filename"]  # no need it
-        dct["finished_at"] = dct["finished_at"].isoformat()
-        if dct["metadata"]:
-            dct["metadata"]["started_at"] = dct["metadata"]["started_at"].isoformat()
-        return dct
+        return {
+            "finished_at": self.finished_at.isoformat(),
+            "downloadable": self.downloadable,
+            "metadata": self.metadata.to_jsonable() if self.metadata else None,
+        }
 
+    def to_chunk_entry(self) -> bytes:
+        """`"filename": {...}` of a chunk's JSON, cached until the replay changes."""
+        if self._chunk_entry is None:
+            self._chunk_entry = (
+                f"{json.dumps(self.filename)}: {json.dumps(self.to_jsonable())}"
+            ).encode()
+        return self._chunk_entry
 
-@dataclass(frozen=True)
+
+@dataclass(frozen=True, slots=True)
 class ChunkHeader:
     filename: str
     oldest_replay_ts: datetime
@@ -125,17 +211,22 @@ class ChunkHeader:
 
 @dataclass
 class Header:
-    SUPPORTED_VERSION: ClassVar[int] = 1
+    # v1: chunk index = replay_index // max_chunk_size
+    # v2: chunks are contiguous time ranges of up to max_chunk_size replays,
+    #     a chunk splits in two when a late replay overflows it
+    # both are read by loading `chunk_headers` in order, v1 is upgraded on save
+    SUPPORTED_VERSIONS: ClassVar[tuple[int, ...]] = (1, 2)
+    CURRENT_VERSION: ClassVar[int] = 2
 
     updated_at: datetime
     total_count: int
     chunk_headers: list[ChunkHeader]
     max_chunk_size: int
-    version: int = SUPPORTED_VERSION
+    version: int = CURRENT_VERSION
 
     @classmethod
     def from_dict(cls, d: dict, expected_max_chunk_size: int):
-        assert d["version"] == cls.SUPPORTED_VERSION
+        assert d["version"] in cls.SUPPORTED_VERSIONS
         header = cls(
             version=d["version"],
             updated_at=datetime.fromisoformat(d["updated_at"]),
@@ -155,3 +246,9 @@ class Header:
             "max_chunk_size": self.max_chunk_size,
             "chunk_headers": [c.to_dict() for c in self.chunk_headers],
         }
+
+    def to_json(self, chunk_headers_json: list[str]) -> str:
+        """`json.dumps(to_dict())` with already serialized chunk headers."""
+        dct = self.to_dict()
+        dct["chunk_headers"] = []
+        return json.dumps(dct)[: -len("[]}")] + f"[{', '.join(chunk_headers_json)}]}}"
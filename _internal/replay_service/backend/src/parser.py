@@ -1,44 +1,76 @@
+import functools
+import struct
 import zipfile
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
+from typing import TYPE_CHECKING, BinaryIO
+
+from src.model import Player, ReplayMetadata
+
+if TYPE_CHECKING:
+    from construct import Struct
 
 # Original parser by https://github.com/Donaldduck8/reflex-replay-tools
 
-from construct import (
-    BytesInteger,
-    Container,
-    Hex,
-    Int32sl,
-    Int32ul,
-    Int64ul,
-    PaddedString,
-    Struct,
-    Timestamp,
-    this,
-)
-
-PlayerStruct = Struct(
-    "name" / PaddedString(32, "utf-8"),
-    "score" / Int32sl,
-    "team" / Int32sl,
-    "steam_id" / Int64ul,
-)
-
-ReplayHeaderStruct = Struct(
-    "tag" / Hex(BytesInteger(4)),
-    "protocol_version" / Int32ul,
-    # "supportedVersion" / Computed(Check(this.protocolVersion == 89)),
-    # Check(this.protocol_version == 89),
-    "player_count" / Int32ul,
-    "marker_count" / Int32ul,
-    "unknown" / Int64ul,
-    "map_steam_id" / Int64ul,
-    "started_at" / Timestamp(Int64ul, 1.0, 1970),
-    "game_mode" / PaddedString(64, "utf-8"),
-    "map_title" / PaddedString(256, "utf-8"),
-    "host_name" / PaddedString(256, "utf-8"),
-    "players" / PlayerStruct[this.player_count],
-).compile()
+
+@functools.cache
+def replay_header_struct() -> "Struct":
+    """The construct parser, for headers the fast path can't decode.
+
+    construct (and arrow, for timestamps) take longer to import and compile
+    than the service takes to start otherwise, and most replays never need them.
+    """
+    from construct import (
+        BytesInteger,
+        Hex,
+        Int32sl,
+        Int32ul,
+        Int64ul,
+        PaddedString,
+        Struct,
+        Timestamp,
+        this,
+    )
+
+    player_struct = Struct(
+        "name" / PaddedString(32, "utf-8"),
+        "score" / Int32sl,
+        "team" / Int32sl,
+        "steam_id" / Int64ul,
+    )
+    return Struct(
+        "tag" / Hex(BytesInteger(4)),
+        "protocol_version" / Int32ul,
+        # "supportedVersion" / Computed(Check(this.protocolVersion == 89)),
+        # Check(this.protocol_version == 89),
+        "player_count" / Int32ul,
+        "marker_count" / Int32ul,
+        "unknown" / Int64ul,
+        "map_steam_id" / Int64ul,
+        "started_at" / Timestamp(Int64ul, 1.0, 1970),
+        "game_mode" / PaddedString(64, "utf-8"),
+        "map_title" / PaddedString(256, "utf-8"),
+        "host_name" / PaddedString(256, "utf-8"),
+        "players" / player_struct[this.player_count],
+    ).compile()
+
+
+class HeaderParseError(Exception):
+    """The header is truncated or isn't a replay's."""
+
+
+# the same layout as the construct parser, for the fast path
+FAST_PROTOCOL_VERSION = 89
+FixedHeaderLayout = struct.Struct("<4sIIIQQQ64s256s256s")
+PlayerLayout = struct.Struct("<32siiQ")
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# the header is all that's parsed from a multi-MB replay
+PLAYER_SIZE = PlayerLayout.size  # 48
+FIXED_HEADER_SIZE = FixedHeaderLayout.size  # 616, everything before players
+PLAYER_COUNT_OFFSET = 8
+# more is garbage, not read, so parsing fails on a short header
+MAX_PLAYER_COUNT = 64
 
 
 def parse_finished_at(filename: str) -> datetime:
@@ -54,14 +86,87 @@ def parse_finished_at_with_fallback(filename: str, fallback: datetime) -> dateti
         return fallback
 
 
-def parse_raw(replay: Path) -> Container:
+def read_header(stream: BinaryIO) -> bytes:
+    """Reads just the header, its length depends on the player count."""
+    header = stream.read(FIXED_HEADER_SIZE)
+    if len(header) < FIXED_HEADER_SIZE:
+        return header  # not a replay, fails to parse
+
+    player_count = int.from_bytes(
+        header[PLAYER_COUNT_OFFSET : PLAYER_COUNT_OFFSET + 4], "little"
+    )
+    if player_count > MAX_PLAYER_COUNT:
+        return header
+    return header + stream.read(player_count * PLAYER_SIZE)
+
+
+def parse_header(header: bytes) -> ReplayMetadata:
+    """Parses a known protocol with `struct`, anything else with construct."""
+    try:
+        if (metadata := _parse_header_fast(header)) is not None:
+            return metadata
+    except (ValueError, OverflowError):  # bad UTF-8, timestamp out of range
+        pass  # construct decides how it fails
+
+    header_struct = replay_header_struct()
+    from construct import ConstructError  # imported by now
+
+    try:
+        return ReplayMetadata.from_construct(header_struct.parse(header))
+    except ConstructError as exc:
+        raise HeaderParseError(str(exc)) from exc
+
+
+def _parse_header_fast(header: bytes) -> ReplayMetadata | None:
+    if len(header) < FIXED_HEADER_SIZE:
+        return None
+    (
+        _tag,
+        protocol_version,
+        player_count,
+        marker_count,
+        _unknown,
+        map_steam_id,
+        started_at,
+        game_mode,
+        map_title,
+        host_name,
+    ) = FixedHeaderLayout.unpack_from(header)
+    players_end = FIXED_HEADER_SIZE + player_count * PLAYER_SIZE
+    if protocol_version != FAST_PROTOCOL_VERSION or len(header) < players_end:
+        return None
+
+    return ReplayMetadata(
+        protocol_version=protocol_version,
+        host_name=_decode(host_name),
+        game_mode=_decode(game_mode),
+        map_steam_id=str(map_steam_id),
+        map_title=_decode(map_title),
+        players=[
+            Player(name=_decode(name), score=score, team=team, steam_id=str(steam_id))
+            for name, score, team, steam_id in PlayerLayout.iter_unpack(
+                memoryview(header)[FIXED_HEADER_SIZE:players_end]
+            )
+        ],
+        marker_count=marker_count,
+        started_at=EPOCH + timedelta(seconds=started_at),
+    )
+
+
+def _decode(padded: bytes) -> str:
+    # as construct's PaddedString
+    return padded.rstrip(b"\x00").decode("utf-8")
+
+
+def parse_raw(replay: Path) -> ReplayMetadata:
     with open(replay, "rb") as f:
-        return ReplayHeaderStruct.parse(f.read())
+        return parse_header(read_header(f))
 
 
-def parse_zip_compressed(replay: Path) -> Container:
+def parse_zip_compressed(replay: Path) -> ReplayMetadata:
     with zipfile.ZipFile(replay, "r") as zf:
         # assuming exactly one file inside
         replay_ = zf.namelist()[0]
+        # inflates only as much as the header needs
         with zf.open(replay_, "r") as replay_stream:
-            return ReplayHeaderStruct.parse_stream(replay_stream)
+            return parse_header(read_header(replay_stream))
@@ -0,0 +1,197 @@
+import heapq
+import logging
+import os
+import time
+from pathlib import Path
+
+from src.db import ReplayDB
+from src.model import Replay
+from src.store import DownloadStore
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_PREFIX = "/replays/"
+DOWNLOAD_SUFFIX = ".rep.zip"
+READ_SIZE = 1024 * 1024
+# counts decayed below this are dropped, so old downloads don't accumulate
+FORGET_BELOW_SCORE = 0.01
+
+
+class DownloadCounter:
+    """Counts recent replay downloads from the nginx access log.
+
+    Expects the `downloads` log format of nginx.conf: `$msec $status $uri`.
+    The log is tailed from the last saved offset; a new inode or a shorter
+    file means it was rotated or truncated, so it's read from the start.
+    Once read past `max_log_bytes`, the log is truncated, nginx appends to it
+    with O_APPEND, so it goes on from the start; a line written between the
+    last read and the truncation is lost, which popularity can live with.
+    Counts decay exponentially with `half_life_seconds`, so a download
+    a half-life ago weighs half as much as a fresh one.
+    """
+
+    def __init__(
+        self,
+        access_log: Path,
+        store: DownloadStore,
+        half_life_seconds: float,
+        max_log_bytes: int | None = None,
+    ):
+        self.access_log = access_log
+        self.half_life_seconds = half_life_seconds
+        self.max_log_bytes = max_log_bytes
+        self._store = store
+        self._downloads = store.load_downloads()
+        self._inode, self._offset = store.load_log_position() or (0, 0)
+
+    def recent_downloads(self, filename: str, now: float) -> float:
+        if (download := self._downloads.get(filename)) is None:
+            return 0.0
+        return self._decayed(*download, now)
+
+    def refresh(self):
+        """Reads log lines appended since the last refresh."""
+        try:
+            log = self.access_log.open("rb")
+        except FileNotFoundError:
+            logger.warning("Access log %s doesn't exist", self.access_log)
+            return
+
+        with log:
+            stat = os.fstat(log.fileno())
+            if stat.st_ino != self._inode or stat.st_size < self._offset:
+                logger.info("Access log is new or rotated, reading from the start")
+                self._offset = 0
+            log.seek(self._offset)
+
+            changed: set[str] = set()
+            tail = b""
+            while chunk := log.read(READ_SIZE):
+                lines = (tail + chunk).split(b"\n")
+                tail = lines.pop()  # incomplete, the rest is read next time
+                for line in lines:
+                    if filename := self._count(line):
+                        changed.add(filename)
+                self._offset += len(chunk)
+            self._offset -= len(tail)
+            self._inode = stat.st_ino
+            if self.max_log_bytes and self._offset >= self.max_log_bytes and not tail:
+                self._truncate()
+
+        now = time.time()
+        forgotten = [
+            filename
+            for filename, download in self._downloads.items()
+            if self._decayed(*download, now) < FORGET_BELOW_SCORE
+        ]
+        for filename in forgotten:
+            del self._downloads[filename]
+            changed.discard(filename)
+
+        self._store.save(
+            [(filename, *self._downloads[filename]) for filename in changed],
+            forgotten,
+            (self._inode, self._offset),
+        )
+        if changed:
+            logger.info("Counted downloads of %d replays", len(changed))
+
+    def _truncate(self):
+        try:
+            if os.stat(self.access_log).st_ino == self._inode:  # not rotated meanwhile
+                os.truncate(self.access_log, 0)
+                self._offset = 0
+        except OSError:
+            logger.warning("Can't truncate access log %s", self.access_log)
+
+    def _count(self, line: bytes) -> str | None:
+        if not line:
+            return None
+        try:
+            msec, status, uri = line.decode().split(" ", 2)
+            downloaded_at = float(msec)
+        except ValueError:
+            logger.warning("Unexpected access log line: %r", line)
+            return None
+
+        if status != "200":
+            return None
+        if not (uri.startswith(DOWNLOAD_PREFIX) and uri.endswith(DOWNLOAD_SUFFIX)):
+            return None
+
+        filename = uri.removeprefix(DOWNLOAD_PREFIX)
+        score, updated_at = self._downloads.get(filename, (0.0, downloaded_at))
+        # lines may be slightly out of order, never decay backwards
+        now = max(updated_at, downloaded_at)
+        self._downloads[filename] = (self._decayed(score, updated_at, now) + 1, now)
+        return filename
+
+    def _decayed(self, score: float, updated_at: float, now: float) -> float:
+        age = max(now - updated_at, 0)
+        return score * 0.5 ** (age / self.half_life_seconds)
+
+
+class RetentionPolicy:
+    """Decides in which order the cleaner deletes downloadable replays.
+
+    The cleaner asks for a few replays to delete at a time, until enough
+    space is freed, and holds `db.lock` only for each such batch, so the
+    candidates are picked anew from the DB's current state each time;
+    slow work, like reading a log, goes in `prepare`, which is called
+    before, without the lock.
+    """
+
+    name: str
+
+    def prepare(self):
+        pass
+
+    def eviction_candidates(self, db: ReplayDB, max_count: int) -> list[Replay]:
+        """The next replays to delete, first one first."""
+        raise NotImplementedError
+
+
+class OldestFirst(RetentionPolicy):
+    name = "oldest"
+
+    def eviction_candidates(self, db: ReplayDB, max_count: int) -> list[Replay]:
+        return db.downloadable_replays(max_count=max_count)
+
+
+class PopularityAware(RetentionPolicy):
+    """Weighs age against recent downloads and markers.
+
+    A replay's eviction priority is its age divided by its value,
+    `1 + recent downloads * download_weight + markers * marker_weight`,
+    so a replay downloaded once recently lives about twice as long.
+    """
+
+    name = "popularity"
+
+    def __init__(
+        self,
+        downloads: DownloadCounter,
+        download_weight: float = 1.0,
+        marker_weight: float = 0.5,
+    ):
+        self.downloads = downloads
+        self.download_weight = download_weight
+        self.marker_weight = marker_weight
+
+    def prepare(self):
+        self.downloads.refresh()
+
+    def eviction_candidates(self, db: ReplayDB, max_count: int) -> list[Replay]:
+        now = time.time()
+        return heapq.nlargest(
+            max_count,
+            db.downloadable_replays(),
+            key=lambda replay: self.eviction_priority(replay, now),
+        )
+
+    def eviction_priority(self, replay: Replay, now: float) -> float:
+        age = max(now - replay.finished_at.timestamp(), 0)
+        markers = replay.metadata.marker_count if replay.metadata else 0
+        downloads = self.downloads.recent_downloads(replay.filename, now)
+        value = 1 + downloads * self.download_weight + markers * self.marker_weight
+        return age / value
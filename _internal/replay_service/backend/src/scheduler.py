@@ -0,0 +1,162 @@
+import logging
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from collections.abc import Iterator
+from contextlib import contextmanager
+from enum import IntEnum
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+CGROUP_CPU_MAX = Path("/sys/fs/cgroup/cpu.max")
+
+
+class Priority(IntEnum):
+    PUBLISH = 0  # new replay metadata, latency matters
+    COMPRESS = 1  # compression, reconciliation and recompression
+    CLEANUP = 2  # deletion, index and stats rebuilds
+
+
+class Scheduler:
+    """Orders background work by priority, within a CPU budget.
+
+    Work is split into short slices, each run inside `slot(priority)`.
+    A slice starts only when no slice of another priority is running, and no
+    higher priority one is waiting; so between slices, higher priority work
+    always goes first. Slices of the same priority may run in parallel.
+
+    CPU time of slices (`time.thread_time`) is charged to a token bucket, refilled
+    at `cpu_budget` CPU seconds per second, up to `cpu_budget * interval_seconds`.
+    Once overdrawn, slices wait until it's paid back, except for PUBLISH ones,
+    which are small and shouldn't wait behind a backlog.
+
+    Never wait for a slot or the budget while holding `ReplayDB.lock`, the slot
+    goes first; work under the lock is only `charged`.
+    """
+
+    def __init__(self, cpu_budget: float, interval_seconds: float = 1.0):
+        assert cpu_budget > 0
+        self.cpu_budget = cpu_budget
+        self.interval_seconds = interval_seconds
+        self.cpu_seconds_by_priority: dict[Priority, float] = defaultdict(float)
+
+        self._cond = threading.Condition()
+        self._running: Counter[Priority] = Counter()
+        self._waiting: Counter[Priority] = Counter()
+        self._debt = 0.0  # CPU seconds over budget, negative when there's a reserve
+        self._refilled_at = time.monotonic()
+
+    @contextmanager
+    def slot(self, priority: Priority) -> Iterator[None]:
+        with self._cond:
+            self._waiting[priority] += 1
+            try:
+                while True:
+                    if not self._may_start(priority):
+                        self._cond.wait()
+                    elif (delay := self._budget_delay(priority)) > 0:
+                        self._cond.wait(delay)
+                    else:
+                        break
+            finally:
+                self._waiting[priority] -= 1
+            self._running[priority] += 1
+
+        started = time.thread_time()
+        try:
+            yield
+        finally:
+            used = time.thread_time() - started
+            with self._cond:
+                self._running[priority] -= 1
+                self._charge(priority, used)
+
+    @contextmanager
+    def budgeted(self, priority: Priority) -> Iterator[None]:
+        """Like `slot`, but only keeps within the budget, not ordered by priority.
+
+        For long work that slots must not wait for, like compressing a replay
+        while new ones get published; it takes `ReplayDB.lock` only briefly.
+        """
+        with self._cond:
+            while (delay := self._budget_delay(priority)) > 0:
+                self._cond.wait(delay)
+
+        with self.charged(priority):
+            yield
+
+    @contextmanager
+    def charged(self, priority: Priority) -> Iterator[None]:
+        """Charges the work's CPU time to the budget, without waiting for it.
+
+        For work under `ReplayDB.lock`, or on behalf of its holder, which mustn't
+        keep the lock longer; the work after it pays the budget back.
+        """
+        started = time.thread_time()
+        try:
+            yield
+        finally:
+            used = time.thread_time() - started
+            with self._cond:
+                self._charge(priority, used)
+
+    def charge(self, priority: Priority, cpu_seconds: float):
+        """Charges CPU time a slice spent in other threads, like a pool's."""
+        with self._cond:
+            self._charge(priority, cpu_seconds)
+
+    def _charge(self, priority: Priority, used: float):
+        self._refill()
+        self._debt += used
+        self.cpu_seconds_by_priority[priority] += used
+        self._cond.notify_all()
+
+    def _may_start(self, priority: Priority) -> bool:
+        return not any(
+            count and (other != priority)
+            for other, count in self._running.items()
+        ) and not any(
+            count and other < priority for other, count in self._waiting.items()
+        )
+
+    def _budget_delay(self, priority: Priority) -> float:
+        if priority == Priority.PUBLISH:
+            return 0
+        self._refill()
+        return self._debt / self.cpu_budget if self._debt > 0 else 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._debt = max(
+            self._debt - (now - self._refilled_at) * self.cpu_budget,
+            -self.cpu_budget * self.interval_seconds,
+        )
+        self._refilled_at = now
+
+
+def lower_thread_priority(niceness: int):
+    """Makes the calling thread nicer to the game servers, for heavy work.
+
+    Linux applies niceness per thread; it can't be raised back without privileges.
+    """
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), niceness)
+    except OSError:
+        logger.warning("Can't lower priority of thread %s", threading.current_thread().name)
+
+
+def available_cpus() -> float:
+    """CPUs the process may use: the container's cgroup v2 quota, if any, or the count.
+
+    A `cpus: 0.1` container sees all of the host's CPUs, but gets a tenth of one.
+    """
+    cpus = os.process_cpu_count() or 1
+    try:
+        quota, period = CGROUP_CPU_MAX.read_text().split()
+    except (OSError, ValueError):
+        return cpus
+    if quota == "max":
+        return cpus
+    return min(cpus, int(quota) / int(period))
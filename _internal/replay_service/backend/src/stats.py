@@ -0,0 +1,226 @@
+import json
+from collections import defaultdict
+from collections.abc import Iterable
+from itertools import combinations
+
+from sortedcontainers import SortedList
+
+from src.model import Replay, ReplayMetadata
+
+LEADERBOARD_SIZE = 100
+
+WIN, LOSS, DRAW = "wins", "losses", "draws"
+RANKED = ("matches", WIN)
+
+
+def sides_of(metadata: ReplayMetadata) -> tuple[dict[str, int | str], dict]:
+    """Returns each player's side and scores of the sides.
+
+    A side is the player's team, or the player themselves if nobody is teamed up.
+    """
+    has_teams = len({player.team for player in metadata.players}) > 1
+    side_by_player = {
+        player.steam_id: player.team if has_teams else player.steam_id
+        for player in metadata.players
+    }
+    side_scores = defaultdict(int)
+    for player in metadata.players:
+        side_scores[side_by_player[player.steam_id]] += player.score
+    return side_by_player, side_scores
+
+
+def _shard_of(steam_id: str) -> str:
+    return steam_id[-2:].rjust(2, "0")
+
+
+def _result(score: int, opponent_score: int) -> str:
+    if score > opponent_score:
+        return WIN
+    if score < opponent_score:
+        return LOSS
+    return DRAW
+
+
+def _new_player() -> dict:
+    return {
+        "name": "",
+        "last_played_at": "",
+        "matches": 0,
+        WIN: 0,
+        LOSS: 0,
+        DRAW: 0,
+        "maps": {},
+        "head_to_head": {},
+        "activity": {},
+    }
+
+
+def _new_map() -> dict:
+    return {
+        "title": "",
+        "last_played_at": "",
+        "matches": 0,
+        "game_modes": {},
+        "activity": {},
+    }
+
+
+def _increment(counter: dict, key: str, value: int = 1):
+    counter[key] = counter.get(key, 0) + value
+
+
+class Stats:
+    """Per-player and per-map aggregates, maintained as replays are added.
+
+    Counters are commutative, and the latest name and map title are picked
+    by time, so replays may arrive in any order. Persisted in the store as JSON
+    rows, published as `stats/players/<last 2 chars of steam id>.json`,
+    `stats/maps.json` and `stats/leaderboard.json`.
+    A player's result in a match is decided by the score of their side
+    (team or themselves), a player wins if their side outscored every other.
+    Players are kept ranked by each leaderboard counter, and by shard,
+    so a save costs the players that changed, not all of them.
+    """
+
+    def __init__(self):
+        self.players: dict[str, dict] = {}
+        self.maps: dict[str, dict] = {}
+        self._dirty_players: set[str] = set()
+        self._dirty_maps: set[str] = set()
+        self._players_by_shard: dict[str, set[str]] = defaultdict(set)
+        # (-count, steam id), so the top of the leaderboard comes first
+        self._rankings = {counter: SortedList() for counter in RANKED}
+
+    @property
+    def is_dirty(self) -> bool:
+        return bool(self._dirty_players or self._dirty_maps)
+
+    def load(self, rows: Iterable[tuple[str, str, str]]):
+        for kind, key, data in rows:
+            getattr(self, kind)[key] = json.loads(data)
+        for steam_id in self.players:
+            self._track_player(steam_id, None)
+
+    def rebuild(self, replays: Iterable[Replay]):
+        self.players.clear()
+        self.maps.clear()
+        self._players_by_shard.clear()
+        for ranking in self._rankings.values():
+            ranking.clear()
+        for replay in replays:
+            self.add(replay)
+        self.mark_all_dirty()
+
+    def add(self, replay: Replay):
+        if not (meta := replay.metadata):
+            return
+
+        played_at = replay.finished_at.isoformat()
+        month = played_at[:7]
+        side_by_player, side_scores = sides_of(meta)
+
+        for player in meta.players:
+            if (stats := self.players.get(player.steam_id)) is None:
+                stats = self.players[player.steam_id] = _new_player()
+                ranked_counts = None
+            else:
+                ranked_counts = {counter: stats[counter] for counter in RANKED}
+            stats["matches"] += 1
+            _increment(stats["maps"], meta.map_steam_id)
+            _increment(stats["activity"], month)
+            if played_at >= stats["last_played_at"]:
+                stats["name"] = player.name
+                stats["last_played_at"] = played_at
+
+            side = side_by_player[player.steam_id]
+            other_scores = [score for s, score in side_scores.items() if s != side]
+            if other_scores:  # nobody to win against in a solo replay
+                stats[_result(side_scores[side], max(other_scores))] += 1
+            self._track_player(player.steam_id, ranked_counts)
+            self._dirty_players.add(player.steam_id)
+
+        for player, opponent in combinations(meta.players, 2):
+            side = side_by_player[player.steam_id]
+            opponent_side = side_by_player[opponent.steam_id]
+            if side == opponent_side:
+                continue
+            self._record_head_to_head(
+                player.steam_id,
+                opponent.steam_id,
+                _result(side_scores[side], side_scores[opponent_side]),
+            )
+            self._record_head_to_head(
+                opponent.steam_id,
+                player.steam_id,
+                _result(side_scores[opponent_side], side_scores[side]),
+            )
+
+        map_stats = self.maps.setdefault(meta.map_steam_id, _new_map())
+        if played_at >= map_stats["last_played_at"]:
+            map_stats["title"] = meta.map_title
+            map_stats["last_played_at"] = played_at
+        map_stats["matches"] += 1
+        _increment(map_stats["game_modes"], meta.game_mode)
+        _increment(map_stats["activity"], month)
+        self._dirty_maps.add(meta.map_steam_id)
+
+    def mark_all_dirty(self):
+        self._dirty_players.update(self.players)
+        self._dirty_maps.update(self.maps)
+
+    def dirty_rows(self) -> list[tuple[str, str, str]]:
+        """Returns `(kind, key, JSON)` of changed aggregates, to be persisted."""
+        return [
+            ("players", steam_id, json.dumps(self.players[steam_id]))
+            for steam_id in self._dirty_players
+        ] + [
+            ("maps", map_steam_id, json.dumps(self.maps[map_steam_id]))
+            for map_steam_id in self._dirty_maps
+        ]
+
+    def pop_dirty_shards(self) -> dict[str, bytes]:
+        """Returns serialized changed files by their path relative to the DB folder."""
+        files = {}
+        for shard in {_shard_of(steam_id) for steam_id in self._dirty_players}:
+            shard_json = {
+                steam_id: self.players[steam_id]
+                for steam_id in sorted(self._players_by_shard[shard])
+            }
+            files[f"stats/players/{shard}.json"] = json.dumps(shard_json).encode()
+
+        if self._dirty_players:
+            files["stats/leaderboard.json"] = json.dumps(self._leaderboard()).encode()
+        if self._dirty_maps:
+            files["stats/maps.json"] = json.dumps(self.maps).encode()
+
+        self._dirty_players.clear()
+        self._dirty_maps.clear()
+        return files
+
+    def _record_head_to_head(self, steam_id: str, opponent_id: str, result: str):
+        record = self.players[steam_id]["head_to_head"].setdefault(
+            opponent_id, {WIN: 0, LOSS: 0, DRAW: 0}
+        )
+        record[result] += 1
+
+    def _track_player(self, steam_id: str, old_counts: dict[str, int] | None):
+        """Files a new or changed player under its shard and ranks."""
+        stats = self.players[steam_id]
+        self._players_by_shard[_shard_of(steam_id)].add(steam_id)
+        for counter, ranking in self._rankings.items():
+            if old_counts is not None:
+                ranking.remove((-old_counts[counter], steam_id))
+            ranking.add((-stats[counter], steam_id))
+
+    def _leaderboard(self) -> dict[str, list[dict]]:
+        return {
+            counter: [
+                {
+                    "steam_id": steam_id,
+                    "name": self.players[steam_id]["name"],
+                    counter: -count,
+                }
+                for count, steam_id in ranking.islice(0, LEADERBOARD_SIZE)
+            ]
+            for counter, ranking in self._rankings.items()
+        }
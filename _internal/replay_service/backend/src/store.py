@@ -0,0 +1,337 @@
+import logging
+import os
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, NamedTuple, Self
+
+from src.model import Player, Replay, ReplayMetadata
+
+logger = logging.getLogger(__name__)
+
+STORE_FILENAME = "replays.sqlite3"
+
+# metadata is a single text of ASCII unit (US) separated fields, in records
+# separated by RS: the replay's, then one per player; splitting it costs far less
+# than a column per field or decoding JSON. Names can't hold the separators.
+FIELD_SEP = "\x1f"
+RECORD_SEP = "\x1e"
+_NO_SEPARATORS = str.maketrans({FIELD_SEP: "\ufffd", RECORD_SEP: "\ufffd"})
+
+
+class FileEntry(NamedTuple):
+    size: int
+    mtime_ns: int
+    inode: int
+
+    @classmethod
+    def from_stat(cls, stat: os.stat_result) -> Self:
+        return cls(stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+
+class FolderState(NamedTuple):
+    inode: int
+    mtime_ns: int | None  # unset when it changed too recently to rely on
+    full_reconciled_at: float  # unix time
+
+
+class ReplayStore:
+    """Primary storage of replays, the published JSON chunks are derived from it.
+
+    Metadata is stored as separated text, so loading is a split per replay,
+    not a JSON document. Changes are accumulated in a transaction until `commit`.
+
+    Replays changed since the last publication are logged in `pending`,
+    so a crash between a commit and a publication loses nothing.
+    In WAL mode a commit is a single small append to the `-wal` file.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        # used from the cleaner's thread too, under ReplayDB.lock
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("PRAGMA synchronous = FULL")  # fsync the WAL on commit
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS replays (
+                filename TEXT NOT NULL UNIQUE,
+                finished_at TEXT NOT NULL,  -- ISO, always UTC, so sortable as text
+                downloadable INTEGER NOT NULL,
+                -- started_at US marker_count US protocol_version US host_name
+                -- US game_mode US map_steam_id US map_title, then per player:
+                -- RS name US score US team US steam_id
+                metadata TEXT
+            );
+            CREATE INDEX IF NOT EXISTS replays_by_time ON replays (finished_at);
+            CREATE TABLE IF NOT EXISTS stats (
+                kind TEXT NOT NULL,
+                key TEXT NOT NULL,
+                data TEXT NOT NULL,  -- JSON
+                PRIMARY KEY (kind, key)
+            );
+            CREATE TABLE IF NOT EXISTS pending (
+                filename TEXT PRIMARY KEY,  -- replay id
+                added INTEGER NOT NULL  -- otherwise downloadable was flipped
+            );
+            CREATE TABLE IF NOT EXISTS tiers (
+                filename TEXT PRIMARY KEY,
+                tier TEXT NOT NULL  -- compression of recompressed replays
+            );
+            CREATE TABLE IF NOT EXISTS manifest (
+                name TEXT PRIMARY KEY,  -- replay files as of the last reconciliation
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS folder (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                inode INTEGER NOT NULL,
+                mtime_ns INTEGER,
+                full_reconciled_at REAL NOT NULL
+            );
+            """
+        )
+
+    def load(self) -> list[Replay]:
+        """Returns all replays sorted by time, in order of addition for equal times."""
+        rows = self._conn.execute(
+            "SELECT filename, finished_at, downloadable, metadata "
+            "FROM replays ORDER BY finished_at, rowid"
+        )
+        parsed_players = _Parsed(_player_from_text)
+        parsed_common = _Parsed(_common_from_text)
+        fromisoformat = datetime.fromisoformat
+        # the hot path of the start
+        return [
+            Replay(
+                filename,
+                fromisoformat(finished_at),
+                bool(downloadable),
+                metadata
+                and _metadata_from_text(metadata, parsed_players, parsed_common),
+            )
+            for filename, finished_at, downloadable, metadata in rows
+        ]
+
+    def count(self) -> int:
+        return self._conn.execute("SELECT count(*) FROM replays").fetchone()[0]
+
+    def add(self, replays: list[Replay]):
+        self._conn.executemany(
+            "INSERT INTO replays VALUES (?, ?, ?, ?)",
+            (self._replay_to_row(replay) for replay in replays),
+        )
+
+    def rename(self, filename: str, new_filename: str):
+        self._conn.execute(
+            "UPDATE replays SET filename = ? WHERE filename = ?",
+            (new_filename, filename),
+        )
+
+    def update_downloadable(self, replays: list[Replay]):
+        self._conn.executemany(
+            "UPDATE replays SET downloadable = ? WHERE filename = ?",
+            ((replay.downloadable, replay.filename) for replay in replays),
+        )
+
+    def load_stats(self) -> list[tuple[str, str, str]]:
+        return self._conn.execute("SELECT kind, key, data FROM stats").fetchall()
+
+    def save_stats(self, rows: list[tuple[str, str, str]]):
+        self._conn.executemany("INSERT OR REPLACE INTO stats VALUES (?, ?, ?)", rows)
+
+    def load_tiers(self) -> dict[str, str]:
+        return dict(self._conn.execute("SELECT filename, tier FROM tiers"))
+
+    def set_tier(self, filename: str, tier: str):
+        self._conn.execute("INSERT OR REPLACE INTO tiers VALUES (?, ?)", (filename, tier))
+
+    def load_manifest(self) -> dict[str, FileEntry]:
+        return {
+            name: FileEntry(*entry)
+            for name, *entry in self._conn.execute(
+                "SELECT name, size, mtime_ns, inode FROM manifest"
+            )
+        }
+
+    def update_manifest(self, changed: dict[str, FileEntry], removed: list[str]):
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO manifest VALUES (?, ?, ?, ?)",
+            ((name, *entry) for name, entry in changed.items()),
+        )
+        self._conn.executemany(
+            "DELETE FROM manifest WHERE name = ?", ((name,) for name in removed)
+        )
+
+    def replace_manifest(self, files: dict[str, FileEntry]):
+        self._conn.execute("DELETE FROM manifest")
+        self.update_manifest(files, [])
+
+    def load_folder_state(self) -> FolderState | None:
+        row = self._conn.execute(
+            "SELECT inode, mtime_ns, full_reconciled_at FROM folder"
+        ).fetchone()
+        return FolderState(*row) if row else None
+
+    def save_folder_state(self, state: FolderState):
+        self._conn.execute("INSERT OR REPLACE INTO folder VALUES (0, ?, ?, ?)", state)
+
+    def log_pending(self, replays: list[Replay], added: bool):
+        # an added replay stays added, even if flipped before publishing
+        self._conn.executemany(
+            "INSERT INTO pending VALUES (?, ?) "
+            "ON CONFLICT (filename) DO UPDATE SET added = max(added, excluded.added)",
+            ((replay.id, added) for replay in replays),
+        )
+
+    def load_pending(self) -> dict[str, bool]:
+        """Returns ids of unpublished replays, mapped to whether they were added."""
+        return {
+            filename: bool(added)
+            for filename, added in self._conn.execute("SELECT filename, added FROM pending")
+        }
+
+    def clear_pending(self):
+        self._conn.execute("DELETE FROM pending")
+
+    def commit(self):
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+    @staticmethod
+    def _replay_to_row(replay: Replay) -> tuple:
+        return (
+            replay.filename,
+            replay.finished_at.isoformat(),
+            replay.downloadable,
+            replay.metadata and _metadata_to_text(replay.metadata),
+        )
+
+
+def _metadata_to_text(meta: ReplayMetadata) -> str:
+    # fields that repeat across replays go last, they're parsed once on load
+    fields = (
+        meta.started_at.isoformat(),
+        meta.marker_count,
+        meta.protocol_version,
+        meta.host_name.translate(_NO_SEPARATORS),
+        meta.game_mode.translate(_NO_SEPARATORS),
+        meta.map_steam_id,
+        meta.map_title.translate(_NO_SEPARATORS),
+    )
+    return RECORD_SEP.join(
+        [FIELD_SEP.join(map(str, fields))]
+        + [
+            f"{player.name.translate(_NO_SEPARATORS)}{FIELD_SEP}{player.score}"
+            f"{FIELD_SEP}{player.team}{FIELD_SEP}{player.steam_id}"
+            for player in meta.players
+        ]
+    )
+
+
+def _metadata_from_text(
+    text: str, parsed_players: "_Parsed[Player]", parsed_common: "_Parsed[tuple]"
+) -> ReplayMetadata:
+    replay, *players = text.split(RECORD_SEP)
+    started_at, marker_count, common = replay.split(FIELD_SEP, 2)
+    protocol_version, host_name, game_mode, map_steam_id, map_title = parsed_common[
+        common
+    ]
+    return ReplayMetadata(
+        protocol_version,
+        host_name,
+        game_mode,
+        map_steam_id,
+        map_title,
+        [parsed_players[player] for player in players],
+        int(marker_count),
+        datetime.fromisoformat(started_at),
+    )
+
+
+def _player_from_text(text: str) -> Player:
+    name, score, team, steam_id = text.split(FIELD_SEP)
+    return Player(name, int(score), int(team), steam_id)
+
+
+def _common_from_text(text: str) -> tuple[int, str, str, str, str]:
+    protocol_version, *strings = text.split(FIELD_SEP)
+    return int(protocol_version), *strings
+
+
+class _Parsed[T](dict[str, T]):
+    """Parses each distinct text once, replays share the result.
+
+    Players are frozen, so a regular with the same score is built once.
+    """
+
+    def __init__(self, parse: Callable[[str], T]):
+        super().__init__()
+        self._parse = parse
+
+    def __missing__(self, text: str) -> T:
+        value = self[text] = self._parse(text)
+        return value
+
+
+class DownloadStore:
+    """Decayed download counts of replays and the position in the access log.
+
+    Shares the SQLite file with ReplayStore, but has its own connection,
+    as it's used by the cleaner's thread only.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=30)  # WAL, a writer may hold it
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS downloads (
+                filename TEXT PRIMARY KEY,
+                score REAL NOT NULL,  -- decayed count as of updated_at
+                updated_at REAL NOT NULL  -- unix time
+            );
+            CREATE TABLE IF NOT EXISTS access_log (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                inode INTEGER NOT NULL,
+                offset INTEGER NOT NULL
+            );
+            """
+        )
+
+    def load_downloads(self) -> dict[str, tuple[float, float]]:
+        return {
+            filename: (score, updated_at)
+            for filename, score, updated_at in self._conn.execute(
+                "SELECT filename, score, updated_at FROM downloads"
+            )
+        }
+
+    def load_log_position(self) -> tuple[int, int] | None:
+        return self._conn.execute("SELECT inode, offset FROM access_log").fetchone()
+
+    def save(
+        self,
+        downloads: list[tuple[str, float, float]],
+        forgotten: list[str],
+        log_position: tuple[int, int],
+    ):
+        """Saves changed counts with the log position, so nothing is counted twice."""
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO downloads VALUES (?, ?, ?)", downloads
+            )
+            self._conn.executemany(
+                "DELETE FROM downloads WHERE filename = ?",
+                ((filename,) for filename in forgotten),
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO access_log VALUES (0, ?, ?)", log_position
+            )
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,187 @@
+import logging
+import shutil
+import time
+import zipfile
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+from src.db import ReplayDB
+from src.model import Replay
+from src.scheduler import Priority, Scheduler
+
+logger = logging.getLogger(__name__)
+
+MiB = 1024 * 1024
+TMP_SUFFIX = ".recompress.tmp"
+# a pass looks at replays which aged into a tier since the last one,
+# all replays are looked at this often, for ones ingested late
+RESCAN_INTERVAL_SECONDS = 24 * 3600
+
+# zip-compatible compression, by tier name: (method, level)
+METHODS: dict[str, tuple[int, int | None]] = {
+    "deflate": (zipfile.ZIP_DEFLATED, 9),
+    "bzip2": (zipfile.ZIP_BZIP2, 9),
+    "lzma": (zipfile.ZIP_LZMA, None),  # zipfile has no levels for LZMA
+}
+
+
+@dataclass(frozen=True)
+class Tier:
+    name: str
+    min_age_days: float
+
+    def __post_init__(self):
+        assert self.name in METHODS, f"Unknown compression tier {self.name!r}"
+        assert self.min_age_days >= 0
+
+    @classmethod
+    def parse_all(cls, spec: str) -> list["Tier"]:
+        """Parses tiers like `7:deflate,30:lzma`, in order of age."""
+        tiers = []
+        for tier_spec in filter(None, spec.split(",")):
+            min_age_days, name = tier_spec.strip().split(":")
+            tiers.append(cls(name=name, min_age_days=float(min_age_days)))
+        return sorted(tiers, key=lambda tier: tier.min_age_days)
+
+
+class Recompressor:
+    """Recompresses aging replays with stronger methods, to keep them longer.
+
+    Replays are compressed with the default deflate level on ingestion;
+    once older than a tier's age, a replay is rewritten with the tier's
+    method, skipping lower tiers.
+    The new zip replaces the old one atomically, and only if it's smaller.
+    A pass only walks replays that aged into a tier since the last complete
+    one, so passes with nothing due are cheap.
+    Each replay is recompressed within the COMPRESS budget, but takes no slot,
+    so publishing never waits for it; `db.lock` is only held to swap the file.
+    A pass stops after `max_seconds_per_pass`.
+    """
+
+    def __init__(
+        self,
+        db: ReplayDB,
+        tiers: list[Tier],
+        scheduler: Scheduler,
+        max_seconds_per_pass: float,
+    ):
+        self.db = db
+        self.tiers = tiers
+        self.scheduler = scheduler
+        self.max_seconds_per_pass = max_seconds_per_pass
+        self.saved_bytes_by_tier: dict[str, int] = defaultdict(int)
+        self._ranks = {tier.name: idx for idx, tier in enumerate(tiers)}
+        # replays finished before are at their tier already, by tier name
+        self._done_before: dict[str, datetime] = {}
+        self._rescan_at = 0.0
+
+        for tmp in db.replay_folder.glob("*" + TMP_SUFFIX):
+            tmp.unlink()  # left by a crash mid-recompression
+
+    def recompress_once(self):
+        if not self.tiers:
+            return
+
+        if time.monotonic() >= self._rescan_at:
+            self._done_before.clear()
+            self._rescan_at = time.monotonic() + RESCAN_INTERVAL_SECONDS
+
+        deadline = time.monotonic() + self.max_seconds_per_pass
+        recompressed = 0
+        candidates, boundaries = self._candidates()
+        for replay, tier in candidates:
+            if time.monotonic() > deadline:
+                logger.info("Recompression pass is out of time, will continue later")
+                break
+
+            with self.scheduler.budgeted(Priority.COMPRESS):
+                self._recompress(replay, tier)
+            recompressed += 1
+        else:  # every replay up to the boundaries is at its tier now
+            self._done_before = boundaries
+
+        if recompressed:
+            logger.info(
+                "Recompressed %d replays, saved so far: %s",
+                recompressed,
+                ", ".join(
+                    f"{name} {saved // MiB} MiB"
+                    for name, saved in self.saved_bytes_by_tier.items()
+                ),
+            )
+
+    def _candidates(
+        self,
+    ) -> tuple[list[tuple[Replay, Tier]], dict[str, datetime]]:
+        """Returns downloadable replays below their tier, oldest first,
+        and the age boundary of each tier they were looked up to.
+
+        A tier's replays are those between its boundary and the next tier's,
+        only the ones not looked at by the last complete pass are walked.
+        """
+        now = datetime.now(timezone.utc)
+        boundaries = {
+            tier.name: now - timedelta(days=tier.min_age_days) for tier in self.tiers
+        }
+        candidates = []
+        older_boundary = None  # of the next tier, replays beyond are its own
+        with self.db.lock:
+            for rank, tier in reversed(list(enumerate(self.tiers))):
+                since = max(
+                    filter(None, (older_boundary, self._done_before.get(tier.name))),
+                    default=None,
+                )
+                for replay in self.db.downloadable_replays(
+                    finished_before=boundaries[tier.name], finished_since=since
+                ):
+                    if self._ranks.get(self.db.tier_of(replay), -1) < rank:
+                        candidates.append((replay, tier))
+                older_boundary = boundaries[tier.name]
+        return candidates, boundaries
+
+    def _recompress(self, replay: Replay, tier: Tier):
+        path = self.db.replay_folder / replay.filename
+        tmp = path.with_name(path.name + TMP_SUFFIX)
+        method, level = METHODS[tier.name]
+
+        try:
+            old_size = path.stat().st_size
+            with (
+                zipfile.ZipFile(path) as old_zip,
+                zipfile.ZipFile(
+                    tmp, "w", compression=method, compresslevel=level
+                ) as new_zip,
+            ):
+                for old_info in old_zip.infolist():
+                    new_info = zipfile.ZipInfo(old_info.filename, old_info.date_time)
+                    new_info.external_attr = old_info.external_attr
+                    new_info.file_size = old_info.file_size  # for ZIP64 decision
+                    new_info.compress_type = method
+                    new_info.compress_level = level
+                    with (
+                        old_zip.open(old_info) as old_file,
+                        new_zip.open(new_info, "w") as new_file,
+                    ):
+                        shutil.copyfileobj(old_file, new_file, MiB)
+        except FileNotFoundError:
+            tmp.unlink(missing_ok=True)
+            return  # deleted meanwhile
+        except zipfile.BadZipFile:
+            logger.warning("Can't recompress broken replay %s", replay.filename)
+            tmp.unlink(missing_ok=True)
+            self.db.set_tier(replay, tier.name, old_size)  # don't retry
+            return
+
+        new_size = tmp.stat().st_size
+        with self.db.lock:
+            if not replay.downloadable:
+                tmp.unlink()
+                return
+            if new_size < old_size:
+                tmp.replace(path)
+                self.saved_bytes_by_tier[tier.name] += old_size - new_size
+            else:
+                tmp.unlink()
+                new_size = old_size
+            self.db.set_tier(replay, tier.name, new_size)
@@ -0,0 +1,115 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from inotify_simple import INotify, flags
+
+logger = logging.getLogger(__name__)
+
+WATCH_FLAGS = flags.CLOSE_WRITE | flags.MOVED_TO | flags.MOVED_FROM | flags.DELETE
+
+
+@dataclass(frozen=True)
+class ReplayEvent:
+    filename: str
+    # the first of coalesced events is kept, so its time is the oldest
+    queued_at: float = field(default_factory=time.monotonic, compare=False)
+
+
+@dataclass(frozen=True)
+class ReconcileEvent:
+    """Events were lost, the whole folder has to be compared with the DB."""
+
+
+Event = ReplayEvent | ReconcileEvent
+
+
+class EventQueue:
+    """Bounded FIFO of work items, coalesced while waiting.
+
+    Handling a replay event only looks at the file's current state, so any
+    number of events for a filename (e.g. CLOSE_WRITE, then MOVED_FROM) are
+    one work item. When full, `put` blocks, and the kernel buffers inotify
+    events meanwhile; if it overflows too, the watcher asks for a reconcile.
+    """
+
+    def __init__(self, maxsize: int):
+        assert maxsize > 0
+        self.maxsize = maxsize
+        self.coalesced = 0
+        self.max_depth = 0
+        self._pending: dict[Event, None] = {}  # ordered set
+        self._cond = threading.Condition()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def put(self, event: Event):
+        with self._cond:
+            if event in self._pending:
+                self.coalesced += 1
+                return
+            self._cond.wait_for(lambda: len(self._pending) < self.maxsize)
+            self._pending[event] = None
+            self.max_depth = max(self.max_depth, len(self._pending))
+            self._cond.notify_all()
+
+    def get_batch(self, max_size: int, max_delay_seconds: float) -> list[Event]:
+        """Blocks for the first event, then waits up to the delay for more."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._pending)
+            deadline = time.monotonic() + max_delay_seconds
+            while len(self._pending) < max_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0 or not self._cond.wait(timeout):
+                    break
+
+            batch = []
+            for event in self._pending:
+                if len(batch) == max_size:
+                    break
+                batch.append(event)
+            for event in batch:
+                del self._pending[event]
+            self._cond.notify_all()
+            return batch
+
+
+class ReplayWatcher:
+    """Turns inotify events of the replay folder into work items."""
+
+    def __init__(self, folder: Path, queue: EventQueue, read_delay_ms: int):
+        self.folder = folder
+        self.queue = queue
+        self.read_delay_ms = read_delay_ms
+        self._inotify = INotify()
+        # watch before the DB reconciles, so nothing falls in between
+        self._inotify.add_watch(folder.resolve(), WATCH_FLAGS)
+
+    def watch_forever(self):
+        while True:
+            # a short delay lets a burst of events come in a single read
+            for event in self._inotify.read(read_delay=self.read_delay_ms):
+                self.handle(event.name, flags.from_mask(event.mask))
+
+    def handle(self, name: str, mask: list[flags]):
+        if flags.Q_OVERFLOW in mask:
+            logger.warning("inotify queue overflowed, events are lost, reconciling")
+            self.queue.put(ReconcileEvent())
+            return
+
+        if flags.IGNORED in mask:
+            raise RuntimeError("inotify watcher is deleted!")
+
+        if not name or flags.ISDIR in mask:
+            return
+
+        if flags.CLOSE_WRITE in mask or flags.MOVED_TO in mask:
+            if name.endswith(".rep") or name.endswith(".rep.zip"):
+                self.queue.put(ReplayEvent(name))
+
+        elif flags.DELETE in mask or flags.MOVED_FROM in mask:
+            if name.endswith(".rep.zip"):
+                self.queue.put(ReplayEvent(name))
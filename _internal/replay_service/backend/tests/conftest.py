@@ -4,6 +4,7 @@ from pathlib import Path
 
 import pytest
 from arrow import Arrow
+from src.db import ReplayDB
 from src.model import Player, ReplayMetadata, ParsedReplay
 
 ASSETS_DIR = Path(__file__).parent / "assets"
@@ -86,3 +87,35 @@ def copy_replay(replay_dir):
         return Path(shutil.copy(src, replay_dir))
 
     return _copy
+
+
+@pytest.fixture
+def replay_filenames() -> list[str]:
+    """Replays of the `db` fixture, oldest first, a module may override it."""
+    return [
+        "Aerowalk_Ivan_O__promeus_22Nov2025_172953_0markers.rep",
+        "Aerowalk_Ivan_O__Vigur_24Nov2025_183934_0markers.rep",
+        "Simplicity_Ivan_O__Vigur_26Nov2025_163013_0markers.rep",
+    ]
+
+
+@pytest.fixture
+def db(empty_db, replay_dir, copy_replay, compress_awaiting, replay_filenames):
+    """A DB of compressed, downloadable replays."""
+    for filename in replay_filenames:
+        copy_replay(filename)
+    db = ReplayDB(empty_db, replay_dir)
+    compress_awaiting(db)
+    return db
+
+
+@pytest.fixture
+def compress_awaiting():
+    """Runs the compression stage, which the service does in its own thread."""
+
+    def _compress(db: ReplayDB):
+        for replay in db.pop_awaiting_compression():
+            db.compress(replay.filename)
+        db.save_to_fs()
+
+    return _compress
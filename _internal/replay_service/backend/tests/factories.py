@@ -0,0 +1,39 @@
+from collections.abc import Sequence
+from datetime import datetime, timedelta
+
+from src.model import Player, Replay, ReplayMetadata
+
+IVAN = Player(name="Ivan O.", score=12, team=0, steam_id="76561198044136441")
+VIGUR = Player(name="Vigur", score=20, team=0, steam_id="76561198330103432")
+
+
+def make_replay(
+    finished_at: datetime,
+    players: Sequence[Player] = (IVAN, VIGUR),
+    map_steam_id: str = "609506884",
+    map_title: str = "Aerowalk",
+    filename: str | None = None,
+) -> Replay:
+    """Builds a downloadable replay in memory, for tests and benchmarks.
+
+    Named after its map and time, like the game names replays, unless given.
+    """
+    if filename is None:
+        filename = (
+            f"{map_title.replace(' ', '_')}_{finished_at:%d%b%Y_%H%M%S}_0markers.rep.zip"
+        )
+    return Replay(
+        filename=filename,
+        finished_at=finished_at,
+        downloadable=True,
+        metadata=ReplayMetadata(
+            protocol_version=89,
+            host_name="#1 Bobr Rated http://bobr.furioness.net/ - demos",
+            game_mode="1v1" if len(players) == 2 else "tdm",
+            map_steam_id=map_steam_id,
+            map_title=map_title,
+            players=list(players),
+            marker_count=0,
+            started_at=finished_at - timedelta(minutes=10),
+        ),
+    )
@@ -0,0 +1,192 @@
+import dataclasses
+import logging
+import threading
+import time
+from collections import namedtuple
+
+import pytest
+
+from src.cleaner import Cleaner, CleanerConfig, GiB
+from src.db import ReplayDB
+from src.retention import OldestFirst, RetentionPolicy
+
+DiskUsage = namedtuple("DiskUsage", "total used free")
+
+REPLAY_FILENAMES = [
+    "Aerowalk_Ivan_O__promeus_22Nov2025_172953_0markers.rep",
+    "Aerowalk_Ivan_O__Vigur_24Nov2025_183934_0markers.rep",
+    "Simplicity_Ivan_O__Vigur_26Nov2025_163013_0markers.rep",
+    "Aerowalk_Celz_Ch4mp_04Dec2025_131803_0markers.rep",
+]
+
+
+@pytest.fixture
+def replay_filenames():
+    return REPLAY_FILENAMES
+
+
+def make_cleaner(
+    db,
+    monkeypatch,
+    free_bytes: int,
+    min_retention_bytes: int = 0,
+    target_ratio: float = 0.5,
+    policy: RetentionPolicy | None = None,
+):
+    total = 10 * GiB
+    monkeypatch.setattr(
+        "src.cleaner.shutil.disk_usage",
+        lambda _: DiskUsage(total, total - free_bytes, free_bytes),
+    )
+    config = CleanerConfig(
+        replay_folder=db.replay_folder,
+        min_free_space_ratio=0.5,
+        target_free_space_ratio=target_ratio,
+        min_replay_retention_bytes=min_retention_bytes,
+        min_expected_disk_size_bytes=GiB,
+        clean_interval_seconds=1,
+        min_clean_interval_seconds=0,
+    )
+    return Cleaner(config, db, policy=policy)
+
+
+def test_db_tracks_downloadable_sizes(db, replay_dir):
+    assert db.downloadable_bytes == sum(
+        path.stat().st_size for path in replay_dir.iterdir()
+    )
+    assert db.oldest_downloadable().filename == REPLAY_FILENAMES[0] + ".zip"
+
+
+def test_cleanup_deletes_oldest_first(db, replay_dir, monkeypatch):
+    oldest_size = (replay_dir / (REPLAY_FILENAMES[0] + ".zip")).stat().st_size
+    total_bytes = db.downloadable_bytes
+    # need to free a single byte below the threshold
+    cleaner = make_cleaner(db, monkeypatch, free_bytes=5 * GiB - 1)
+
+    cleaner.clean_up_once()
+
+    assert not (replay_dir / (REPLAY_FILENAMES[0] + ".zip")).exists()
+    assert len(list(replay_dir.iterdir())) == 3
+    oldest = db.by_id[REPLAY_FILENAMES[0]]
+    assert not oldest.downloadable
+    assert db.oldest_downloadable().filename == REPLAY_FILENAMES[1] + ".zip"
+
+    # flipped without waiting for the inotify event, and already published
+    reloaded = ReplayDB(db._db_path, replay_dir, reconcile_on_init=False)
+    assert not reloaded.by_id[oldest.id].downloadable
+    assert db.downloadable_bytes == total_bytes - oldest_size
+
+
+def test_cleanup_keeps_minimum_retention(db, replay_dir, monkeypatch):
+    retention = db.downloadable_bytes - 1
+    cleaner = make_cleaner(
+        db, monkeypatch, free_bytes=GiB, min_retention_bytes=retention
+    )
+
+    cleaner.clean_up_once()
+
+    # stops as soon as the retained replays fall below the minimum
+    assert len(list(replay_dir.iterdir())) == 3
+    assert db.downloadable_bytes < retention
+
+
+def test_cleanup_skipped_with_enough_free_space(db, replay_dir, monkeypatch):
+    cleaner = make_cleaner(db, monkeypatch, free_bytes=6 * GiB)
+
+    cleaner.clean_up_once()
+
+    assert len(list(replay_dir.iterdir())) == 4
+
+
+def test_disk_free_is_logged_on_first_pass(db, monkeypatch, caplog):
+    cleaner = make_cleaner(db, monkeypatch, free_bytes=6 * GiB)
+
+    with caplog.at_level(logging.INFO, logger="src.cleaner"):
+        cleaner.clean_up_once()
+        cleaner.clean_up_once()
+
+    disk_free = [
+        record.getMessage()
+        for record in caplog.records
+        if record.getMessage().startswith("Disk free")
+    ]
+    assert disk_free == ["Disk free: 60.0% (6144 MiB)"]
+
+
+def test_cleanup_frees_down_to_low_watermark(db, replay_dir, monkeypatch):
+    oldest_size = (replay_dir / (REPLAY_FILENAMES[0] + ".zip")).stat().st_size
+    # just below the high watermark, but the low one asks for more than a replay
+    cleaner = make_cleaner(
+        db,
+        monkeypatch,
+        free_bytes=5 * GiB - 1,
+        target_ratio=0.5 + (oldest_size + 1) / (10 * GiB),
+    )
+
+    cleaner.clean_up_once()
+
+    assert len(list(replay_dir.iterdir())) == 2
+    assert cleaner.lowest_free_ratio == pytest.approx(0.5)
+
+
+def test_cleanup_is_woken_up_by_request(db, replay_dir, monkeypatch):
+    free = [6 * GiB]
+    cleaner = make_cleaner(db, monkeypatch, free_bytes=0)
+    monkeypatch.setattr(
+        "src.cleaner.shutil.disk_usage",
+        lambda _: DiskUsage(10 * GiB, 10 * GiB - free[0], free[0]),
+    )
+    cleaner.config = dataclasses.replace(cleaner.config, clean_interval_seconds=3600)
+    threading.Thread(target=cleaner.clean_up_forever, daemon=True).start()
+
+    deadline = time.monotonic() + 5
+    while cleaner.lowest_free_ratio is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    free[0] = 4 * GiB
+    cleaner.wake_up.set()
+    while cleaner.lowest_free_ratio != 0.4 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert cleaner.lowest_free_ratio == 0.4
+
+
+def test_policy_is_prepared_without_db_lock(db, monkeypatch):
+    def lock_is_free() -> bool:
+        free = []
+
+        def probe():
+            if acquired := db.lock.acquire(blocking=False):
+                db.lock.release()
+            free.append(acquired)
+
+        thread = threading.Thread(target=probe)
+        thread.start()
+        thread.join()
+        return free[0]
+
+    class SlowPolicy(OldestFirst):
+        prepared_without_lock = None
+
+        def prepare(self):
+            self.prepared_without_lock = lock_is_free()
+
+    policy = SlowPolicy()
+    make_cleaner(db, monkeypatch, free_bytes=4 * GiB, policy=policy).clean_up_once()
+
+    assert policy.prepared_without_lock
+
+
+def test_cleanup_picks_candidates_anew_for_each_batch(db, replay_dir, monkeypatch):
+    monkeypatch.setattr("src.cleaner.EVICTION_BATCH_SIZE", 1)
+    asked = []
+
+    class CountingPolicy(OldestFirst):
+        def eviction_candidates(self, db, max_count):
+            asked.append(max_count)
+            return super().eviction_candidates(db, max_count)
+
+    cleaner = make_cleaner(db, monkeypatch, free_bytes=GiB, policy=CountingPolicy())
+    cleaner.clean_up_once()
+
+    assert not list(replay_dir.iterdir())
+    assert asked == [1] * 5  # the last batch finds nothing left
@@ -0,0 +1,99 @@
+import os
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from src import compression
+from src.compression import (
+    BLOCK_SIZE,
+    compress_replay,
+    configure_pool,
+    deflate_cpu_seconds,
+)
+
+
+def compressible(size: int) -> bytes:
+    # frames repeat with small changes, as in a real replay
+    return (b"frame" + os.urandom(3)) * (size // 8) + os.urandom(size % 8)
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"",
+        b"short replay",
+        compressible(3 * BLOCK_SIZE + 17),
+        os.urandom(BLOCK_SIZE) + compressible(2 * BLOCK_SIZE) + os.urandom(100),
+    ],
+    ids=["empty", "single-block", "multi-block", "mixed"],
+)
+def test_round_trips_through_zipfile(tmp_path, data):
+    source = tmp_path / "replay.rep"
+    source.write_bytes(data)
+    target = tmp_path / "replay.rep.zip"
+
+    with ThreadPoolExecutor(4) as executor:
+        compress_replay(source, target, source.name, executor)
+
+    with zipfile.ZipFile(target) as zf:
+        assert zf.testzip() is None
+        assert zf.namelist() == ["replay.rep"]
+        info = zf.getinfo("replay.rep")
+        assert info.compress_type == zipfile.ZIP_DEFLATED
+        assert zf.read(info) == data
+
+
+def test_blocks_form_a_single_deflate_stream(tmp_path):
+    data = compressible(5 * BLOCK_SIZE)
+    source = tmp_path / "replay.rep"
+    source.write_bytes(data)
+    target = tmp_path / "replay.rep.zip"
+    compress_replay(source, target, source.name)
+
+    with zipfile.ZipFile(target) as zf:
+        info = zf.getinfo("replay.rep")
+    with target.open("rb") as f:
+        f.seek(info.header_offset + 30 + len(info.filename))
+        stream = f.read(info.compress_size)
+
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    assert decompressor.decompress(stream) == data
+    assert decompressor.eof and not decompressor.unused_data
+    # priming with the previous block keeps the ratio close to zlib's,
+    # a sync flush costs a few bytes per block
+    assert info.compress_size < len(zlib.compress(data)) + 5 * 32
+
+
+def test_non_ascii_name(tmp_path):
+    source = tmp_path / "replay.rep"
+    source.write_bytes(b"replay")
+    target = tmp_path / "replay.rep.zip"
+    compress_replay(source, target, "Поле_боя.rep")
+
+    with zipfile.ZipFile(target) as zf:
+        assert zf.namelist() == ["Поле_боя.rep"]
+        assert zf.read("Поле_боя.rep") == b"replay"
+
+
+def test_configured_pool_deflates_and_counts_its_cpu(tmp_path, monkeypatch):
+    monkeypatch.setattr(compression, "_pool", None)
+    monkeypatch.setattr(compression, "_pool_threads", compression._pool_threads)
+    monkeypatch.setattr(compression, "_pool_niceness", compression._pool_niceness)
+    configure_pool(2, niceness=None)
+    source = tmp_path / "replay.rep"
+    source.write_bytes(compressible(8 * BLOCK_SIZE))
+    target = tmp_path / "replay.rep.zip"
+
+    deflated_before = deflate_cpu_seconds()
+    compress_replay(source, target, source.name)
+    pool = compression._pool
+    pool.shutdown()
+
+    assert pool._max_workers == 2
+    assert deflate_cpu_seconds() > deflated_before
+    with zipfile.ZipFile(target) as zf:
+        assert zf.read("replay.rep") == source.read_bytes()
+    with pytest.raises(AssertionError):
+        configure_pool(1)
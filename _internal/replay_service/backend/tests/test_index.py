@@ -0,0 +1,112 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+from src.db import ReplayDB
+from src.index import NgramIndex, ShardedIndex, player_names, player_steam_ids
+from src.model import Player
+from tests.factories import make_replay
+
+IVAN_STEAM_ID = "76561198044136441"
+
+
+def players_of(*steam_ids: str) -> list[Player]:
+    return [
+        Player(name=steam_id, score=0, team=0, steam_id=steam_id)
+        for steam_id in steam_ids
+    ]
+
+
+def test_sharded_index_keeps_replays_ordered_and_tracks_dirty_pages(monkeypatch):
+    monkeypatch.setattr(ShardedIndex, "PAGE_SIZE", 2)
+    index = ShardedIndex("players", player_steam_ids)
+    now = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+    def played(days: float, *steam_ids: str, filename: str):
+        finished_at = now + timedelta(days)
+        return make_replay(finished_at, players_of(*steam_ids), filename=filename)
+
+    index.update([played(idx, "111", filename=f"{idx}.rep") for idx in range(4)])
+    index.update([played(0, "222", filename="other.rep")])
+    assert not index.is_dirty
+
+    index.add(played(5, "111", filename="5.rep"))
+    shards = index.pop_dirty_shards()
+    assert shards.keys() == {"players/11.json", "players/111/2.json"}
+    assert json.loads(shards["players/11.json"]) == {"111": 5}
+    assert json.loads(shards["players/111/2.json"]) == ["5.rep"]
+
+    index.add(played(1.5, "111", "311", filename="late.rep"))
+    shards = index.pop_dirty_shards()
+    assert shards.keys() == {
+        "players/11.json",
+        "players/111/1.json",
+        "players/111/2.json",
+        "players/311/0.json",
+    }
+    assert json.loads(shards["players/11.json"]) == {"111": 6, "311": 1}
+    assert [json.loads(shards[f"players/111/{page}.json"]) for page in (1, 2)] == [
+        ["late.rep", "2.rep"],
+        ["3.rep", "5.rep"],
+    ]
+    assert not index.is_dirty
+
+
+def test_indexes_are_published_incrementally(
+    aerowalk_db, replay_dir, copy_replay, compress_awaiting
+):
+    db = ReplayDB(aerowalk_db, replay_dir, reconcile_on_init=False, _chunk_at_count=3)
+    db.save_to_fs()  # the fixture predates indexes
+
+    players_shard = aerowalk_db / "index" / "players" / "41.json"
+    assert IVAN_STEAM_ID in json.loads(players_shard.read_text())
+    assert players_shard.with_name("41.json.gz").exists()
+    untouched_shard = aerowalk_db / "index" / "maps" / "32.json"  # Aerowalk
+    untouched_mtime = untouched_shard.stat().st_mtime_ns
+
+    replay_filename = "Pocket_Infinity_Vigur_Ivan_O__05Jan2026_161301_0markers.rep"
+    copy_replay(replay_filename)
+    db.ingest_replay(replay_filename)
+    db.save_to_fs()
+    ivan_page = aerowalk_db / "index" / "players" / IVAN_STEAM_ID / "0.json"
+    # published before compression
+    assert json.loads(ivan_page.read_text())[-1] == replay_filename
+
+    (replay,) = db.pop_awaiting_compression()
+    db.compress(replay.filename)
+    assert not any(
+        index.is_dirty for index in db._indexes if isinstance(index, NgramIndex)
+    )
+    db.save_to_fs()
+    assert json.loads(ivan_page.read_text())[-1] == replay_filename + ".zip"
+    ivan_count = json.loads(players_shard.read_text())[IVAN_STEAM_ID]
+    assert ivan_count == 1 + sum(
+        IVAN_STEAM_ID in player_steam_ids(replay) for replay in db.by_time[:-1]
+    )
+    assert json.loads((aerowalk_db / "index" / "maps" / "84.json").read_text()) == {
+        "609506884": 1
+    }
+    assert untouched_shard.stat().st_mtime_ns == untouched_mtime
+
+
+def test_ngram_index_finds_renamed_players_by_substring():
+    index = NgramIndex("player_names", player_names)
+    now = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    replay = make_replay(now, players_of("111"), filename="a.rep.zip")
+    index.update([replay])
+
+    renamed = make_replay(now, players_of("111"), filename="b.rep.zip")
+    object.__setattr__(renamed.metadata.players[0], "name", "Vigur")
+    index.add(renamed)
+    shards = index.pop_dirty_shards()
+    assert shards.keys() == {
+        f"player_names/{ord(ch):x}.json" for ch in "vig"
+    }
+    assert json.loads(shards["player_names/69.json"])["igu"] == {"Vigur": ["111"]}
+    assert json.loads(shards["player_names/76.json"])["vi"] == {"Vigur": ["111"]}
+
+    index.add(renamed)  # nothing new
+    assert not index.is_dirty
+
+    index.mark_all_dirty()
+    shards = index.pop_dirty_shards()
+    assert json.loads(shards["player_names/31.json"])["111"] == {"111": ["111"]}
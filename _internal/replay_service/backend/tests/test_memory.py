@@ -0,0 +1,39 @@
+import gc
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+from src.store import ReplayStore
+from tests.factories import make_replay
+
+REPLAY_COUNT = 2000
+# was ~1200 bytes per replay with plain dataclasses and duplicated strings
+BYTES_PER_REPLAY_BUDGET = 800
+
+START = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+
+def test_loaded_replay_memory_footprint(tmp_path):
+    store = ReplayStore(tmp_path / "replays.sqlite3")
+    store.add(
+        [
+            make_replay(START + timedelta(minutes=idx))
+            for idx in range(REPLAY_COUNT)
+        ]
+    )
+    store.commit()
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        allocated_before = tracemalloc.get_traced_memory()[0]
+        replays = store.load()
+        allocated_after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+    bytes_per_replay = (allocated_after - allocated_before) / len(replays)
+    assert bytes_per_replay < BYTES_PER_REPLAY_BUDGET, f"{bytes_per_replay:.0f} bytes"
+
+    first, last = replays[0].metadata, replays[-1].metadata
+    assert first.host_name is last.host_name
+    assert first.players[0].steam_id is last.players[0].steam_id
@@ -0,0 +1,81 @@
+import urllib.error
+import urllib.request
+
+import pytest
+
+from src.metrics import REGISTRY, Registry, serve
+
+
+def test_renders_counters_and_gauges():
+    registry = Registry()
+    counter = registry.counter("freed_bytes_total", "Bytes freed.")
+    gauge = registry.gauge("free_ratio", "Free ratio.")
+    registry.gauge("unavailable", "Not on this system.", read=lambda: None)
+    registry.gauge("queue_depth", "Queued items.", read=lambda: 3)
+
+    counter.inc(100)
+    counter.inc(20)
+    gauge.set(0.25)
+
+    assert registry.render() == (
+        "# HELP freed_bytes_total Bytes freed.\n"
+        "# TYPE freed_bytes_total counter\n"
+        "freed_bytes_total 120.0\n"
+        "# HELP free_ratio Free ratio.\n"
+        "# TYPE free_ratio gauge\n"
+        "free_ratio 0.25\n"
+        "# HELP unavailable Not on this system.\n"
+        "# TYPE unavailable gauge\n"
+        "# HELP queue_depth Queued items.\n"
+        "# TYPE queue_depth gauge\n"
+        "queue_depth 3.0\n"
+    )
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    histogram = registry.histogram("save_seconds", "Save time.", buckets=(0.1, 1))
+
+    for value in (0.05, 0.1, 0.5, 2):
+        histogram.observe(value)
+
+    assert registry.render().splitlines()[2:] == [
+        'save_seconds_bucket{le="0.1"} 2.0',  # bounds are inclusive
+        'save_seconds_bucket{le="1.0"} 3.0',
+        'save_seconds_bucket{le="+Inf"} 4.0',
+        "save_seconds_sum 2.65",
+        "save_seconds_count 4.0",
+    ]
+
+
+def test_duplicate_metric_is_rejected():
+    registry = Registry()
+    registry.counter("events_total", "Events.")
+
+    with pytest.raises(ValueError):
+        registry.gauge("events_total", "Events.")
+
+
+def test_process_metrics():
+    rendered = REGISTRY.render()
+
+    assert "\nprocess_resident_memory_bytes " in rendered
+    assert "\nprocess_cpu_seconds_total " in rendered
+
+
+def test_serves_metrics_over_http():
+    registry = Registry()
+    registry.counter("events_total", "Events.").inc()
+    server = serve("127.0.0.1", 0, registry)
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        with urllib.request.urlopen(url + "/metrics") as response:
+            assert response.headers["Content-Type"].startswith("text/plain")
+            assert response.read().decode() == registry.render()
+
+        with pytest.raises(urllib.error.HTTPError) as exc_info:
+            urllib.request.urlopen(url + "/")
+        assert exc_info.value.code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
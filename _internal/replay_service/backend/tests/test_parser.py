@@ -1,10 +1,13 @@
+import random
 import zipfile
 from datetime import datetime, timezone
 
 import pytest
 
+from src import parser
 from src.db import ReplayDB
-from src.model import ParsedReplay
+from src.model import ParsedReplay, ReplayMetadata
+from tests.conftest import ASSETS_DIR
 
 
 def test_parsing_raw(single_replay):
@@ -59,3 +62,108 @@ def test_failing_parse_with_bad_name(tmp_path):
 
     with pytest.raises(ValueError):
         ReplayDB._parse(garbage)
+
+
+def test_parsing_reads_header_only(single_replay, monkeypatch):
+    replay_path, expected_replay = single_replay
+    with replay_path.open("ab") as replay:
+        replay.write(b"\xff" * 1024 * 1024)  # frames
+    zip_path = replay_path.with_suffix(".rep.zip")
+    with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_DEFLATED) as replay_zip:
+        replay_zip.write(replay_path, arcname=replay_path.name)
+
+    read_sizes = []
+    original_read_header = parser.read_header
+
+    def read_header(stream):
+        header = original_read_header(stream)
+        read_sizes.append(len(header))
+        return header
+
+    monkeypatch.setattr(parser, "read_header", read_header)
+
+    assert ReplayDB._parse(replay_path) == expected_replay
+    assert ReplayDB._parse(zip_path) == expected_replay
+    assert read_sizes == [616 + 2 * 48] * 2
+
+
+def test_parsing_absurd_player_count(tmp_path, single_replay):
+    replay_path, expected_replay = single_replay
+    header = bytearray(replay_path.read_bytes())
+    header[8:12] = (10**6).to_bytes(4, "little")
+    replay_path.write_bytes(header)
+
+    assert ReplayDB._parse(replay_path) == ParsedReplay(
+        finished_at=expected_replay.finished_at, metadata=None
+    )
+
+
+def parse_with_construct(header: bytes):
+    try:
+        parsed = parser.replay_header_struct().parse(header)
+        return ReplayMetadata.from_construct(parsed)
+    except Exception as exc:
+        return type(exc)
+
+
+def test_fast_path_matches_construct_on_assets():
+    for replay_path in (ASSETS_DIR / "replays").glob("*.rep"):
+        header = replay_path.read_bytes()
+        fast = parser._parse_header_fast(header)
+
+        assert fast is not None
+        assert fast == parse_with_construct(header)
+        assert parser.parse_header(header) == fast
+
+
+def fuzz_header(rng: random.Random, template: bytes) -> bytes:
+    header = bytearray(template[: parser.FIXED_HEADER_SIZE])
+    player_count = rng.choice([0, 1, 2, 4, 8])
+    header[8:12] = player_count.to_bytes(4, "little")
+    header[12:16] = rng.getrandbits(32).to_bytes(4, "little")  # markers
+    header[24:32] = rng.getrandbits(64).to_bytes(8, "little")  # map
+    # mostly plausible, sometimes out of datetime's range
+    started_at = rng.getrandbits(64 if rng.random() < 0.1 else 31)
+    header[32:40] = started_at.to_bytes(8, "little")
+
+    def fuzz_string(offset: int, size: int):
+        if rng.random() < 0.02:  # likely invalid UTF-8
+            value = rng.randbytes(size)
+        else:
+            length = rng.randrange(size // 2)
+            text = "".join(rng.choice("aZ09 _-ßж\x00") for _ in range(length))
+            value = text.encode()[:size]
+        header[offset : offset + size] = value.ljust(size, b"\x00")
+
+    for offset, size in ((40, 64), (104, 256), (360, 256)):
+        fuzz_string(offset, size)
+    for idx in range(player_count):
+        player = bytearray(rng.randbytes(parser.PLAYER_SIZE))
+        header += player
+        fuzz_string(parser.FIXED_HEADER_SIZE + idx * parser.PLAYER_SIZE, 32)
+
+    if rng.random() < 0.1:
+        del header[rng.randrange(len(header)) :]  # truncated
+    return bytes(header)
+
+
+def test_fast_path_matches_construct_on_fuzzed_headers():
+    rng = random.Random(89)
+    template = (ASSETS_DIR / "replays").glob("*.rep").__next__().read_bytes()
+
+    fast_parsed = 0
+    for _ in range(2000):
+        header = fuzz_header(rng, template)
+        try:
+            fast = parser._parse_header_fast(header)
+        except (ValueError, OverflowError):
+            fast = None  # parse_header falls back to construct
+        expected = parse_with_construct(header)
+
+        if fast is not None:
+            fast_parsed += 1
+            assert fast == expected, header
+        if isinstance(expected, ReplayMetadata):
+            assert parser.parse_header(header) == expected
+
+    assert fast_parsed > 1000  # most go through the fast path
@@ -3,14 +3,16 @@ import zipfile
 from src.db import ReplayDB
 
 
-def test_rep_is_actually_compressed(aerowalk_db, replay_dir, copy_replay):
+def test_rep_is_actually_compressed(
+    aerowalk_db, replay_dir, copy_replay, compress_awaiting
+):
     # arrange
     replay_filename = "Aerowalk_Ivan_O__Vigur_24Nov2025_183934_0markers.rep"
     rep_path = copy_replay(replay_filename)
     original_size = rep_path.stat().st_size
 
-    # act: DB init triggers compression
-    ReplayDB(aerowalk_db, replay_dir, _chunk_at_count=3)
+    # act: DB init finds the replay, the compression stage compresses it
+    compress_awaiting(ReplayDB(aerowalk_db, replay_dir, _chunk_at_count=3))
 
     zip_path = rep_path.with_suffix(".rep.zip")
     assert zip_path.exists()
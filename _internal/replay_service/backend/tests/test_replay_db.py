@@ -1,7 +1,14 @@
+import gzip
 import json
+import os
+import time
+from pathlib import Path
+
+import pytest
 
 from src.db import ReplayDB
 from src.model import Header
+from src.scheduler import Priority, Scheduler
 
 
 def test_init_empty_db(empty_db, replay_dir):
@@ -9,7 +16,10 @@ def test_init_empty_db(empty_db, replay_dir):
 
     header = json.loads((empty_db / "replays_header.json").read_text())
     assert header["total_count"] == 0
-    assert len(tuple(empty_db.iterdir())) == 1, "Expected only a header file"
+    assert {path.name for path in empty_db.glob("*.json")} == {
+        "replays_header.json"
+    }, "Expected only a header file"
+    assert (empty_db / "replays.sqlite3").exists()
 
 
 def test_load_empty_db(empty_db, replay_dir):
@@ -26,25 +36,26 @@ def test_load_empty_db(empty_db, replay_dir):
 
 
 def test_load_non_empty_db_and_reconcile_downloadability(
-    aerowalk_db, replay_dir, copy_replay
+    aerowalk_db, replay_dir, copy_replay, compress_awaiting
 ):
     replay_filename = "Aerowalk_Ivan_O__Vigur_24Nov2025_183934_0markers.rep"
     copied_replay_path = copy_replay(replay_filename)
 
     db = ReplayDB(aerowalk_db, replay_dir, _chunk_at_count=3)
     assert len(db.by_time) == 7
-    for replay in db.by_time:
-        if (
-            replay.filename == replay_filename + ".zip"
-        ):  # compresses and adds in one pass, even if non .zip
-            assert replay.downloadable
-        else:
-            assert not replay.downloadable
+    replay = db.by_id[replay_filename]
+    # the raw file is there, but isn't downloadable until compressed
+    assert not any(db_replay.downloadable for db_replay in db.by_time)
+
+    compress_awaiting(db)
+    assert replay.filename == replay_filename + ".zip"
+    for db_replay in db.by_time:
+        assert db_replay.downloadable == (db_replay is replay)
 
     copied_replay_path.with_suffix(".rep.zip").unlink()
     db = ReplayDB(aerowalk_db, replay_dir, _chunk_at_count=3)
     assert len(db.by_time) == 7
-    assert not db.by_filename[replay_filename + ".zip"].downloadable
+    assert not db.by_id[replay_filename].downloadable
 
 
 def test_add_new_at_the_end(aerowalk_db, replay_dir, copy_replay):
@@ -88,6 +99,53 @@ def test_add_new_replay_played_at_mid_date(aerowalk_db, replay_dir, copy_replay)
     assert header.total_count == 8
 
 
+def test_late_replay_rewrites_only_its_chunk(aerowalk_db, replay_dir, copy_replay):
+    db = ReplayDB(aerowalk_db, replay_dir, _chunk_at_count=3)
+    initial_chunks = [
+        chunk["filename"]
+        for chunk in json.loads((aerowalk_db / "replays_header.json").read_text())[
+            "chunk_headers"
+        ]
+    ]
+
+    # lands into the middle chunk, which is full and splits in two
+    replay_copy_path = copy_replay(
+        "Simplicity_Ivan_O__Vigur_03Dec2025_194603_0markers.rep"
+    )
+    db.ingest_replay(replay_copy_path.name)
+    db.save_to_fs()
+
+    header = Header.from_dict(
+        json.loads((aerowalk_db / "replays_header.json").read_text()),
+        expected_max_chunk_size=3,
+    )
+    assert header.version == 2
+    assert [chunk.count for chunk in header.chunk_headers] == [3, 2, 2, 1]
+    assert header.chunk_headers[0].filename == initial_chunks[0]
+    assert header.chunk_headers[-1].filename == initial_chunks[-1]
+    assert not (aerowalk_db / initial_chunks[1]).exists()
+
+    # appending fills up the last chunk
+    replay_copy_path = copy_replay(
+        "Pocket_Infinity_Vigur_Ivan_O__05Jan2026_161301_0markers.rep"
+    )
+    db.ingest_replay(replay_copy_path.name)
+    db.save_to_fs()
+
+    header = Header.from_dict(
+        json.loads((aerowalk_db / "replays_header.json").read_text()),
+        expected_max_chunk_size=3,
+    )
+    assert [chunk.count for chunk in header.chunk_headers] == [3, 2, 2, 2]
+    assert header.chunk_headers[0].filename == initial_chunks[0]
+
+    db = ReplayDB(aerowalk_db, replay_dir, _chunk_at_count=3)
+    assert [replay.id for replay in db.by_time] == sorted(
+        db.by_id, key=lambda replay_id: db.by_id[replay_id].finished_at
+    )
+    assert len(tuple(aerowalk_db.glob("chunk_*.json"))) == 4
+
+
 def test_reconcile_with_new_replay_played_at_mid_date(
     aerowalk_db, replay_dir, copy_replay
 ):
@@ -103,7 +161,7 @@ def test_reconcile_with_new_replay_played_at_mid_date(
 
 
 def test_unmark_downloadable_on_reconciliation_if_missing(
-    aerowalk_db, replay_dir, copy_replay
+    aerowalk_db, replay_dir, copy_replay, compress_awaiting
 ):
     db = ReplayDB(aerowalk_db, replay_dir, _chunk_at_count=3)
     assert len(db.by_time) == 7
@@ -112,11 +170,287 @@ def test_unmark_downloadable_on_reconciliation_if_missing(
     replay_copy_path = copy_replay(replay_filename)
 
     db.ingest_replay(replay_copy_path)
-    db.save_to_fs()
+    compress_awaiting(db)
     assert len(db.by_time) == 8
-    assert db.by_filename[replay_filename + ".zip"].downloadable
+    assert db.by_id[replay_filename].downloadable
 
     replay_copy_path.with_suffix(".rep.zip").unlink()
     db = ReplayDB(aerowalk_db, replay_dir, _chunk_at_count=3)
     assert len(db.by_time) == 8
-    assert not db.by_filename[replay_filename + ".zip"].downloadable
+    assert not db.by_id[replay_filename].downloadable
+
+
+def test_reconcile_backlog_in_parallel(
+    empty_db, replay_dir, copy_replay, compress_awaiting
+):
+    replay_filenames = [
+        "Aerowalk_Celz_Ch4mp_04Dec2025_131803_0markers.rep",
+        "Aerowalk_Ivan_O__Vigur_24Nov2025_183934_0markers.rep",
+        "Simplicity_Jaguar_Luft_08Dec2025_201914_0markers.rep",
+        "Pocket_Infinity_Vigur_Ivan_O__05Jan2026_161301_0markers.rep.zip",
+    ]
+    for replay_filename in replay_filenames:
+        copy_replay(replay_filename)
+    # leftover of a crash between compression and removal of the raw replay
+    copy_replay("Pocket_Infinity_Vigur_Ivan_O__05Jan2026_161301_0markers.rep")
+
+    db = ReplayDB(empty_db, replay_dir, reconcile_jobs=4)
+    assert len(db.by_time) == 4
+    compress_awaiting(db)
+    assert all(replay.downloadable for replay in db.by_time)
+    assert sorted(path.name for path in replay_dir.iterdir()) == sorted(
+        filename.removesuffix(".zip") + ".zip" for filename in replay_filenames
+    )
+
+    db = ReplayDB(empty_db, replay_dir, reconcile_jobs=1)
+    assert len(db.by_time) == 4
+
+
+def test_only_reconcile_after_start_is_charged_to_budget(
+    empty_db, replay_dir, copy_replay
+):
+    copy_replay("Aerowalk_Ivan_O__Vigur_24Nov2025_183934_0markers.rep")
+    scheduler = Scheduler(cpu_budget=1)
+    db = ReplayDB(empty_db, replay_dir, scheduler=scheduler)
+    assert len(db.by_time) == 1
+    assert Priority.COMPRESS not in scheduler.cpu_seconds_by_priority
+
+    copy_replay("Simplicity_Jaguar_Luft_08Dec2025_201914_0markers.rep")
+    db.reconcile()
+    assert len(db.by_time) == 2
+    assert Priority.COMPRESS in scheduler.cpu_seconds_by_priority
+
+
+def test_reconcile_commits_once_for_all_changes(aerowalk_db, replay_dir, monkeypatch):
+    db = ReplayDB(
+        aerowalk_db, replay_dir, reconcile_on_init=False, _chunk_at_count=3
+    )
+    commits = []
+    monkeypatch.setattr(db._store, "commit", lambda: commits.append(1))
+
+    db.reconcile()  # the replays are gone, each is flipped to not downloadable
+
+    assert not any(replay.downloadable for replay in db.by_time)
+    # the flips, the manifest and the save
+    assert len(commits) == 3
+
+
+def test_republish_from_store_when_json_is_lost(aerowalk_db, replay_dir):
+    ReplayDB(aerowalk_db, replay_dir, _chunk_at_count=3)
+    for json_path in aerowalk_db.glob("*.json"):
+        json_path.unlink()
+
+    db = ReplayDB(aerowalk_db, replay_dir, _chunk_at_count=3)
+    assert len(db.by_time) == 7
+
+    header = Header.from_dict(
+        json.loads((aerowalk_db / "replays_header.json").read_text()),
+        expected_max_chunk_size=3,
+    )
+    assert [chunk.count for chunk in header.chunk_headers] == [3, 3, 1]
+    assert all((aerowalk_db / chunk.filename).exists() for chunk in header.chunk_headers)
+
+
+def test_unpublished_changes_survive_a_crash(aerowalk_db, replay_dir, copy_replay):
+    db = ReplayDB(aerowalk_db, replay_dir, _chunk_at_count=3)
+
+    replay_copy_path = copy_replay(
+        "Pocket_Infinity_Vigur_Ivan_O__05Jan2026_161301_0markers.rep"
+    )
+    db.ingest_replay(replay_copy_path.name)
+    db._mark_fs_present(db.by_time[0], 0)
+    published_chunks = {path.name for path in aerowalk_db.glob("chunk_*.json")}
+    del db  # "crash" before saving
+
+    db = ReplayDB(aerowalk_db, replay_dir, reconcile_on_init=False, _chunk_at_count=3)
+    assert len(db.by_time) == 8
+    assert db.by_time[0].downloadable
+
+    db.save_to_fs()
+    header = Header.from_dict(
+        json.loads((aerowalk_db / "replays_header.json").read_text()),
+        expected_max_chunk_size=3,
+    )
+    assert [chunk.count for chunk in header.chunk_headers] == [3, 3, 2]
+    assert header.chunk_headers[1].filename in published_chunks
+    assert header.chunk_headers[0].filename not in published_chunks
+    assert header.chunk_headers[2].filename not in published_chunks
+
+    db = ReplayDB(aerowalk_db, replay_dir, reconcile_on_init=False, _chunk_at_count=3)
+    assert not db._unsaved_added and not db._unsaved_mutated
+
+
+def load_published(db_path) -> dict:
+    replays = {}
+    header = json.loads((db_path / "replays_header.json").read_text())
+    for chunk_header in header["chunk_headers"]:
+        replays.update(json.loads((db_path / chunk_header["filename"]).read_text()))
+    return replays
+
+
+def test_raw_replay_is_published_before_compression(
+    aerowalk_db, replay_dir, copy_replay
+):
+    db = ReplayDB(aerowalk_db, replay_dir, _chunk_at_count=3)
+    replay_filename = "Pocket_Infinity_Vigur_Ivan_O__05Jan2026_161301_0markers.rep"
+    replay_copy_path = copy_replay(replay_filename)
+
+    replay = db.ingest_replay(replay_filename)
+    db.save_to_fs()
+    assert not replay_copy_path.with_suffix(".rep.zip").exists()
+    published = load_published(aerowalk_db)
+    assert not published[replay_filename]["downloadable"]
+    assert published[replay_filename]["metadata"]["map_title"] == "Pocket Infinity"
+
+    assert db.pop_awaiting_compression() == [replay]
+    assert db.pop_awaiting_compression() == []
+    assert db.compress(replay.filename) is replay
+    assert replay.filename == replay_filename + ".zip"
+    assert replay.downloadable
+    assert not replay_copy_path.exists()
+    compressed_path = replay_copy_path.with_suffix(".rep.zip")
+    assert db.downloadable_bytes == compressed_path.stat().st_size
+    del db  # "crash" before publishing the rename
+
+    db = ReplayDB(aerowalk_db, replay_dir, reconcile_on_init=False, _chunk_at_count=3)
+    db.save_to_fs()
+    published = load_published(aerowalk_db)
+    assert replay_filename not in published
+    assert published[replay_filename + ".zip"]["downloadable"]
+    maps_page = aerowalk_db / "index" / "maps" / "609506884" / "0.json"
+    assert json.loads(maps_page.read_text()) == [replay_filename + ".zip"]
+
+
+def test_compressor_takes_raw_replays_in_batches_oldest_first(
+    empty_db, replay_dir, copy_replay
+):
+    db = ReplayDB(empty_db, replay_dir, reconcile_on_init=False)
+    names = [
+        "Simplicity_Jaguar_Luft_08Dec2025_201914_0markers.rep",
+        "Simplicity_Ivan_O__Vigur_26Nov2025_163013_0markers.rep",
+        "Simplicity_Ivan_O__Vigur_03Dec2025_194603_0markers.rep",
+    ]
+    for name in names:
+        copy_replay(name)
+        db.ingest_replay(name)
+        db.ingest_replay(name)  # a replay awaits once, however often it's seen
+
+    assert db.awaiting_compression_count == 3
+    assert [replay.filename for replay in db.pop_awaiting_compression(2)] == [
+        names[1],
+        names[2],
+    ]
+    assert db.awaiting_compression_count == 1
+    (replay,) = db.pop_awaiting_compression(2)
+    assert replay.filename == names[0]
+    assert db.pop_awaiting_compression(2) == []
+
+
+def test_cached_chunk_entry_follows_downloadable(aerowalk_db, replay_dir):
+    db = ReplayDB(aerowalk_db, replay_dir, reconcile_on_init=False, _chunk_at_count=3)
+    replay = db.by_time[0]
+
+    def plain_entry():
+        return json.dumps({replay.filename: replay.to_jsonable()})[1:-1].encode()
+
+    assert replay.to_chunk_entry() == plain_entry()
+
+    replay.set_downloadable(not replay.downloadable)
+    assert replay.to_chunk_entry() == plain_entry()
+    assert f'"downloadable": {json.dumps(replay.downloadable)}' in (
+        replay.to_chunk_entry().decode()
+    )
+
+
+def test_published_json_has_gzip_sidecars(aerowalk_db, replay_dir, copy_replay):
+    def assert_sidecars():
+        published = sorted(aerowalk_db.glob("*.json"))
+        assert sorted(aerowalk_db.glob("*.json.gz")) == [
+            path.with_name(path.name + ".gz") for path in published
+        ]
+        for path in published:
+            sidecar = path.with_name(path.name + ".gz")
+            assert gzip.decompress(sidecar.read_bytes()) == path.read_bytes()
+
+    # the fixture predates sidecars
+    db = ReplayDB(aerowalk_db, replay_dir, reconcile_on_init=False, _chunk_at_count=3)
+    assert_sidecars()
+
+    copy_replay("Simplicity_Ivan_O__Vigur_03Dec2025_194603_0markers.rep")
+    db.reconcile()
+    assert_sidecars()
+
+
+def age_folder(replay_dir):
+    # a recently changed folder isn't trusted to be unchanged
+    os.utime(replay_dir, ns=(time.time_ns() - 60 * 10**9,) * 2)
+
+
+def test_reconcile_diffs_folder_with_manifest(
+    aerowalk_db, replay_dir, copy_replay, compress_awaiting, monkeypatch
+):
+    kept = "Aerowalk_Ivan_O__Vigur_24Nov2025_183934_0markers.rep"
+    removed = "Simplicity_Ivan_O__Vigur_03Dec2025_194603_0markers.rep"
+    for filename in (kept, removed):
+        copy_replay(filename)
+    compress_awaiting(ReplayDB(aerowalk_db, replay_dir, _chunk_at_count=3))
+    age_folder(replay_dir)
+    ReplayDB(aerowalk_db, replay_dir, _chunk_at_count=3)  # records the folder state
+
+    # changed while the service was down
+    (replay_dir / (removed + ".zip")).unlink()
+    added = copy_replay("Pocket_Infinity_Vigur_Ivan_O__05Jan2026_161301_0markers.rep")
+    stat_calls = []
+    original_stat = Path.stat
+
+    def stat(path, **kwargs):
+        stat_calls.append(path)
+        return original_stat(path, **kwargs)
+
+    monkeypatch.setattr(Path, "stat", stat)
+
+    db = ReplayDB(aerowalk_db, replay_dir, _chunk_at_count=3)
+    # the unchanged replay isn't stat'ed, but its size is known
+    assert replay_dir / (kept + ".zip") not in stat_calls
+    assert added in stat_calls
+    assert db.by_id[kept].downloadable
+    assert db.downloadable_bytes == (replay_dir / (kept + ".zip")).stat().st_size
+    assert not db.by_id[removed].downloadable
+    assert db.pop_awaiting_compression() == [db.by_id[added.name]]
+
+
+def test_reconcile_skips_listing_of_unchanged_folder(
+    aerowalk_db, replay_dir, copy_replay, compress_awaiting, monkeypatch
+):
+    replay_filename = "Aerowalk_Ivan_O__Vigur_24Nov2025_183934_0markers.rep"
+    copy_replay(replay_filename)
+    compress_awaiting(ReplayDB(aerowalk_db, replay_dir, _chunk_at_count=3))
+    age_folder(replay_dir)
+    ReplayDB(aerowalk_db, replay_dir, _chunk_at_count=3)
+
+    def fail_scandir(path):
+        raise AssertionError("listed an unchanged folder")
+
+    with monkeypatch.context() as patch:
+        patch.setattr("src.db.os.scandir", fail_scandir)
+        db = ReplayDB(aerowalk_db, replay_dir, _chunk_at_count=3)
+        assert db.by_id[replay_filename].downloadable
+        assert db.downloadable_bytes > 0
+
+        # a full reconciliation lists and stats everything
+        with pytest.raises(AssertionError, match="unchanged folder"):
+            db.reconcile(full=True)
+
+    # and is due once the interval passes
+    scandir_calls = []
+    original_scandir = os.scandir
+
+    def scandir(path):
+        scandir_calls.append(path)
+        return original_scandir(path)
+
+    monkeypatch.setattr("src.db.os.scandir", scandir)
+    ReplayDB(
+        aerowalk_db, replay_dir, full_reconcile_interval_seconds=0, _chunk_at_count=3
+    )
+    assert scandir_calls == [replay_dir]
@@ -0,0 +1,117 @@
+import os
+import time
+
+import pytest
+
+from src.retention import DownloadCounter, OldestFirst, PopularityAware
+from src.store import DownloadStore
+
+DAY = 24 * 3600
+# downloads decayed to nothing by now are forgotten on refresh
+NOW = round(time.time())
+
+OLDEST = "Aerowalk_Ivan_O__promeus_22Nov2025_172953_0markers.rep"
+OLD = "Aerowalk_Ivan_O__Vigur_24Nov2025_183934_0markers.rep"
+NEWER = "Simplicity_Ivan_O__Vigur_26Nov2025_163013_0markers.rep"
+
+
+@pytest.fixture
+def access_log(tmp_path):
+    return tmp_path / "downloads.log"
+
+
+@pytest.fixture
+def make_counter(tmp_path, access_log):
+    def _make(**kwargs) -> DownloadCounter:
+        store = DownloadStore(tmp_path / "replays.sqlite3")
+        return DownloadCounter(access_log, store, half_life_seconds=DAY, **kwargs)
+
+    return _make
+
+
+def log_downloads(access_log, *lines: str):
+    with access_log.open("a") as log:
+        log.writelines(line + "\n" for line in lines)
+
+
+def test_counts_downloads_from_access_log(access_log, make_counter):
+    log_downloads(
+        access_log,
+        f"{NOW}.000 200 /replays/{OLD}.zip",
+        f"{NOW}.500 200 /replays/{OLD}.zip",
+        f"{NOW + 1}.000 404 /replays/{NEWER}.zip",
+        f"{NOW + 1}.000 200 /db/replays_header.json",
+    )
+    counter = make_counter()
+    counter.refresh()
+
+    downloaded_at = NOW + 0.5
+    assert counter.recent_downloads(OLD + ".zip", downloaded_at) == pytest.approx(2, abs=1e-4)
+    assert counter.recent_downloads(
+        OLD + ".zip", downloaded_at + DAY
+    ) == pytest.approx(1, abs=1e-4)
+    assert counter.recent_downloads(NEWER + ".zip", NOW + 1) == 0
+
+
+def test_tails_access_log_without_recounting(access_log, make_counter):
+    log_downloads(access_log, f"{NOW}.000 200 /replays/{OLD}.zip")
+    counter = make_counter()
+    counter.refresh()
+    # a line being written isn't counted until it's complete
+    with access_log.open("a") as log:
+        log.write(f"{NOW}.000 200 /replays/{OLD}")
+    counter.refresh()
+    assert counter.recent_downloads(OLD + ".zip", NOW) == pytest.approx(1)
+
+    with access_log.open("a") as log:
+        log.write(".zip\n")
+    counter.refresh()
+    counter.refresh()
+    assert counter.recent_downloads(OLD + ".zip", NOW) == pytest.approx(2)
+
+    # the position is persisted with the counts
+    counter = make_counter()
+    counter.refresh()
+    assert counter.recent_downloads(OLD + ".zip", NOW) == pytest.approx(2)
+
+
+def test_reads_rotated_access_log_from_start(access_log, make_counter):
+    log_downloads(access_log, f"{NOW}.000 200 /replays/{OLD}.zip")
+    counter = make_counter()
+    counter.refresh()
+
+    os.rename(access_log, access_log.with_suffix(".log.1"))
+    log_downloads(access_log, f"{NOW}.000 200 /replays/{NEWER}.zip")
+    counter.refresh()
+
+    assert counter.recent_downloads(OLD + ".zip", NOW) == pytest.approx(1)
+    assert counter.recent_downloads(NEWER + ".zip", NOW) == pytest.approx(1)
+
+
+def test_truncates_access_log_once_read(access_log, make_counter):
+    log_downloads(access_log, f"{NOW}.000 200 /replays/{OLD}.zip")
+    counter = make_counter(max_log_bytes=1)
+    counter.refresh()
+    assert access_log.stat().st_size == 0
+
+    log_downloads(access_log, f"{NOW}.000 200 /replays/{OLD}.zip")
+    counter.refresh()
+    assert counter.recent_downloads(OLD + ".zip", NOW) == pytest.approx(2)
+
+
+def test_oldest_first_policy(db):
+    (candidate,) = OldestFirst().eviction_candidates(db, 1)
+    assert candidate.filename == OLDEST + ".zip"
+    db.delete_replay(candidate)
+    (candidate,) = OldestFirst().eviction_candidates(db, 1)
+    assert candidate.filename == OLD + ".zip"
+
+
+def test_popularity_policy_keeps_downloaded_replays(db, access_log, make_counter):
+    log_downloads(access_log, *[f"{NOW}.000 200 /replays/{OLDEST}.zip"] * 10)
+    policy = PopularityAware(make_counter())
+
+    policy.prepare()
+    order = [replay.filename for replay in policy.eviction_candidates(db, 3)]
+
+    assert order == [OLD + ".zip", NEWER + ".zip", OLDEST + ".zip"]
@@ -0,0 +1,97 @@
+import threading
+import time
+
+import pytest
+
+from src.scheduler import Priority, Scheduler, available_cpus
+
+
+def burn_cpu(seconds: float):
+    started = time.thread_time()
+    while time.thread_time() - started < seconds:
+        pass
+
+
+def start_waiting(scheduler, priority, order) -> threading.Thread:
+    def run():
+        with scheduler.slot(priority):
+            order.append(priority)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    # until it waits for its slot
+    while not scheduler._waiting[priority]:
+        time.sleep(0.001)
+    return thread
+
+
+def test_higher_priority_goes_first():
+    scheduler = Scheduler(cpu_budget=1)
+    order = []
+
+    with scheduler.slot(Priority.COMPRESS):
+        threads = [
+            start_waiting(scheduler, Priority.CLEANUP, order),
+            start_waiting(scheduler, Priority.PUBLISH, order),
+        ]
+    for thread in threads:
+        thread.join()
+
+    assert order == [Priority.PUBLISH, Priority.CLEANUP]
+
+
+def test_same_priority_runs_in_parallel():
+    scheduler = Scheduler(cpu_budget=1)
+    entered = threading.Barrier(2, timeout=5)
+
+    def run():
+        with scheduler.slot(Priority.COMPRESS):
+            entered.wait()
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    run()  # would time out on the barrier if slots were exclusive
+    thread.join()
+
+
+def test_overdrawn_budget_delays_all_but_publishing():
+    scheduler = Scheduler(cpu_budget=0.1, interval_seconds=0.1)
+    with scheduler.slot(Priority.COMPRESS):
+        burn_cpu(0.05)  # 0.04 over the reserve, paid back in 0.4s
+
+    started = time.monotonic()
+    with scheduler.slot(Priority.PUBLISH):
+        pass
+    assert time.monotonic() - started < 0.1
+
+    with scheduler.slot(Priority.CLEANUP):
+        pass
+    assert time.monotonic() - started > 0.3
+    assert scheduler.cpu_seconds_by_priority[Priority.COMPRESS] >= 0.05
+
+
+def test_charged_work_never_waits_for_budget():
+    scheduler = Scheduler(cpu_budget=0.1, interval_seconds=0.1)
+    with scheduler.budgeted(Priority.COMPRESS):
+        burn_cpu(0.05)
+
+    started = time.monotonic()
+    with scheduler.charged(Priority.COMPRESS):
+        burn_cpu(0.05)
+    assert time.monotonic() - started < 0.3
+    assert scheduler.cpu_seconds_by_priority[Priority.COMPRESS] >= 0.1
+
+
+@pytest.mark.parametrize(
+    "cpu_max, expected", [("10000 100000", 0.1), ("max 100000", 4), (None, 4)]
+)
+def test_available_cpus_follows_cgroup_quota(
+    tmp_path, monkeypatch, cpu_max, expected
+):
+    cpu_max_path = tmp_path / "cpu.max"
+    if cpu_max:
+        cpu_max_path.write_text(cpu_max + "\n")
+    monkeypatch.setattr("src.scheduler.CGROUP_CPU_MAX", cpu_max_path)
+    monkeypatch.setattr("src.scheduler.os.process_cpu_count", lambda: 4)
+
+    assert available_cpus() == pytest.approx(expected)
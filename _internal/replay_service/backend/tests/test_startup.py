@@ -0,0 +1,53 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).parent.parent
+# was ~110 ms with construct and arrow imported eagerly, ~70 ms without;
+# generous, as it's wall time of a cold interpreter on a shared machine
+IMPORT_BUDGET_US = 250_000
+# only needed by the construct fallback parser
+LAZY_MODULES = ("construct", "arrow")
+
+
+def import_times(module: str, tmp_path: Path) -> dict[str, int]:
+    """Cumulative microseconds per imported module, from `-X importtime`."""
+    env = os.environ | {
+        "REPLAY_FOLDER": str(tmp_path / "replays"),
+        "DB_PATH": str(tmp_path / "db"),
+        "MIN_FREE_SPACE_RATIO": "0.1",
+        "MIN_REPLAY_RETENTION_MiB": "100",
+        "MIN_EXPECTED_DISK_GiB": "1",
+    }
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    # import time: self [us] | cumulative | imported package
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_main_import_skips_fallback_parser_deps(tmp_path):
+    times = import_times("src.main", tmp_path)
+
+    assert "src.main" in times
+    for module in LAZY_MODULES:
+        assert module not in times
+
+
+def test_main_import_time_budget(tmp_path):
+    # best of a few, a single cold start is noisy
+    best = min(import_times("src.main", tmp_path)["src.main"] for _ in range(3))
+
+    assert best < IMPORT_BUDGET_US
@@ -0,0 +1,122 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+from src.db import ReplayDB
+from src.model import Player
+from src.stats import Stats
+from tests.factories import make_replay
+
+START = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+REPLAYS = [
+    make_replay(START, [Player("a", 10, 0, "1"), Player("b", 5, 0, "2")], "1"),
+    make_replay(
+        START + timedelta(days=20),
+        [Player("a2", 5, 0, "1"), Player("b", 5, 0, "2")],
+        "2",
+    ),
+    make_replay(
+        START + timedelta(days=40),
+        [
+            Player("a3", 1, 1, "1"),
+            Player("c", 9, 1, "3"),
+            Player("b", 5, 2, "2"),
+            Player("d", 4, 2, "4"),
+        ],
+        "1",
+    ),
+    make_replay(START + timedelta(days=60), [Player("solo", 5, 0, "5")], "1"),
+]
+
+
+def test_stats_results_and_head_to_head():
+    stats = Stats()
+    for replay in REPLAYS:
+        stats.add(replay)
+
+    player = stats.players["1"]
+    assert player["name"] == "a3"
+    assert player["matches"] == 3
+    assert (player["wins"], player["losses"], player["draws"]) == (2, 0, 1)
+    assert player["maps"] == {"1": 2, "2": 1}
+    assert player["head_to_head"]["2"] == {"wins": 2, "losses": 0, "draws": 1}
+    assert "3" not in player["head_to_head"]  # teammates
+    assert stats.players["4"]["head_to_head"]["1"]["losses"] == 1
+
+    solo = stats.players["5"]
+    assert (solo["matches"], solo["wins"], solo["losses"], solo["draws"]) == (1, 0, 0, 0)
+
+    assert stats.maps["1"]["matches"] == 3
+    assert stats.maps["1"]["game_modes"] == {"1v1": 1, "tdm": 2}
+
+
+def test_stats_do_not_depend_on_order():
+    in_order, out_of_order = Stats(), Stats()
+    for replay in REPLAYS:
+        in_order.add(replay)
+    for replay in reversed(REPLAYS):
+        out_of_order.add(replay)
+
+    assert in_order.players == out_of_order.players
+    assert json.dumps(in_order.maps, sort_keys=True) == json.dumps(
+        out_of_order.maps, sort_keys=True
+    )
+
+
+def test_map_title_is_the_latest_one():
+    stats = Stats()
+    stats.add(make_replay(START + timedelta(days=1), map_steam_id="1", map_title="New"))
+    stats.add(make_replay(START, map_steam_id="1", map_title="Old"))  # out of order
+
+    assert stats.maps["1"]["title"] == "New"
+
+
+def test_leaderboard_follows_added_replays():
+    stats = Stats()
+    for replay in REPLAYS:
+        stats.add(replay)
+    stats.pop_dirty_shards()
+    stats.add(make_replay(START, [Player("solo", 5, 0, "5"), Player("e", 1, 0, "6")]))
+
+    files = stats.pop_dirty_shards()
+    assert files.keys() == {
+        "stats/players/05.json",
+        "stats/players/06.json",
+        "stats/leaderboard.json",
+        "stats/maps.json",
+    }
+    leaderboard = json.loads(files["stats/leaderboard.json"])
+    for counter in ("matches", "wins"):
+        ranked = sorted(
+            stats.players,
+            key=lambda steam_id: (-stats.players[steam_id][counter], steam_id),
+        )
+        assert [entry["steam_id"] for entry in leaderboard[counter]] == ranked
+    assert leaderboard["wins"][:2] == [
+        {"steam_id": "1", "name": "a3", "wins": 2},
+        {"steam_id": "3", "name": "c", "wins": 1},
+    ]
+
+
+def test_stats_are_persisted_and_published(aerowalk_db, replay_dir, copy_replay):
+    db = ReplayDB(aerowalk_db, replay_dir, _chunk_at_count=3)
+    ivan = "76561198044136441"
+    ivan_matches = db._stats.players[ivan]["matches"]
+    published = json.loads((aerowalk_db / "stats" / "players" / "41.json").read_text())
+    assert published[ivan]["matches"] == ivan_matches
+
+    replay_filename = "Pocket_Infinity_Vigur_Ivan_O__05Jan2026_161301_0markers.rep"
+    copy_replay(replay_filename)
+    db.ingest_replay(replay_filename)
+    del db  # "crash" before saving, the pending replay is counted on load
+
+    db = ReplayDB(aerowalk_db, replay_dir, _chunk_at_count=3)
+    assert db._stats.players[ivan]["matches"] == ivan_matches + 1
+
+    db = ReplayDB(aerowalk_db, replay_dir, _chunk_at_count=3)
+    assert db._stats.players[ivan]["matches"] == ivan_matches + 1
+    published = json.loads((aerowalk_db / "stats" / "players" / "41.json").read_text())
+    assert published[ivan]["matches"] == ivan_matches + 1
+    leaderboard = json.loads((aerowalk_db / "stats" / "leaderboard.json").read_text())
+    assert leaderboard["matches"][0]["steam_id"] == ivan
+    assert "609506884" in json.loads((aerowalk_db / "stats" / "maps.json").read_text())
@@ -0,0 +1,40 @@
+from datetime import datetime, timezone
+
+from src.model import Player, Replay
+from src.store import ReplayStore
+from tests.factories import IVAN, VIGUR, make_replay
+
+FINISHED_AT = datetime(2026, 1, 5, 16, 13, 1, tzinfo=timezone.utc)
+
+
+def test_replays_round_trip(tmp_path):
+    store = ReplayStore(tmp_path / "replays.sqlite3")
+    replays = [
+        make_replay(FINISHED_AT, players=(IVAN, VIGUR), map_title="Pocket Infinity"),
+        make_replay(FINISHED_AT, players=(), filename="empty.rep.zip"),
+        Replay(filename="unparsable.rep", finished_at=FINISHED_AT),
+    ]
+    store.add(replays)
+    store.commit()
+
+    loaded = store.load()
+
+    assert loaded == replays
+    assert [replay.metadata for replay in loaded] == [
+        replay.metadata for replay in replays
+    ]
+    assert [replay.downloadable for replay in loaded] == [True, True, False]
+
+
+def test_separators_in_names_are_replaced(tmp_path):
+    store = ReplayStore(tmp_path / "replays.sqlite3")
+    odd = Player(name="Ivan\x1eO.\x1f", score=3, team=1, steam_id="1")
+    store.add([make_replay(FINISHED_AT, players=(odd, VIGUR))])
+    store.commit()
+
+    (loaded,) = store.load()
+
+    assert loaded.metadata.players == [
+        Player(name="Ivan�O.�", score=3, team=1, steam_id="1"),
+        VIGUR,
+    ]
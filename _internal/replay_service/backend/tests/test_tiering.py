@@ -0,0 +1,119 @@
+import threading
+import zipfile
+
+import pytest
+
+from src.db import ReplayDB
+from src.scheduler import Priority, Scheduler
+from src.tiering import Recompressor, Tier
+
+def read_replays(replay_dir) -> dict[str, tuple[int, bytes]]:
+    replays = {}
+    for path in replay_dir.iterdir():
+        with zipfile.ZipFile(path) as replay_zip:
+            (info,) = replay_zip.infolist()
+            replays[path.name] = (info.compress_type, replay_zip.read(info))
+    return replays
+
+
+def test_parse_tiers():
+    assert Tier.parse_all("30:lzma, 7:deflate") == [
+        Tier(name="deflate", min_age_days=7),
+        Tier(name="lzma", min_age_days=30),
+    ]
+    assert Tier.parse_all("") == []
+    with pytest.raises(AssertionError):
+        Tier.parse_all("7:zstd")
+
+
+def test_recompresses_aged_replays_once(db, replay_dir):
+    before = read_replays(replay_dir)
+    recompressor = Recompressor(
+        db,
+        # replays in assets are older than a day, but not that old
+        [Tier("deflate", min_age_days=1), Tier("lzma", min_age_days=100_000)],
+        Scheduler(cpu_budget=1),
+        max_seconds_per_pass=60,
+    )
+
+    recompressor.recompress_once()
+
+    after = read_replays(replay_dir)
+    assert {name: data for name, (_, data) in after.items()} == {
+        name: data for name, (_, data) in before.items()
+    }
+    assert all(db.tier_of(replay) == "deflate" for replay in db.by_time)
+    assert db.downloadable_bytes == sum(
+        path.stat().st_size for path in replay_dir.iterdir()
+    )
+    assert recompressor._candidates()[0] == []
+    assert not list(replay_dir.glob("*.tmp"))
+
+    db = ReplayDB(db._db_path, replay_dir)
+    assert all(db.tier_of(replay) == "deflate" for replay in db.by_time)
+
+
+def test_pass_walks_only_replays_aged_since_the_last_one(db, monkeypatch):
+    recompressor = Recompressor(
+        db,
+        [Tier("deflate", min_age_days=1), Tier("lzma", min_age_days=100_000)],
+        Scheduler(cpu_budget=1),
+        max_seconds_per_pass=60,
+    )
+    recompressor.recompress_once()
+    walked = []
+    tier_of = db.tier_of
+
+    def walk(replay):
+        walked.append(replay)
+        return tier_of(replay)
+
+    monkeypatch.setattr(db, "tier_of", walk)
+
+    recompressor.recompress_once()
+    assert walked == []
+
+    recompressor._rescan_at = 0  # as a day later, for replays ingested late
+    recompressor.recompress_once()
+    assert len(walked) == len(db.by_time)
+
+
+def test_keeps_replay_if_recompression_does_not_save_space(db, replay_dir):
+    before = {path.name: path.read_bytes() for path in replay_dir.iterdir()}
+    # LZMA headers outweigh the gains on these tiny header-only replays
+    recompressor = Recompressor(
+        db,
+        [Tier("lzma", min_age_days=0)],
+        Scheduler(cpu_budget=1),
+        max_seconds_per_pass=60,
+    )
+
+    recompressor.recompress_once()
+
+    assert {path.name: path.read_bytes() for path in replay_dir.iterdir()} == before
+    assert all(db.tier_of(replay) == "lzma" for replay in db.by_time)
+    assert recompressor.saved_bytes_by_tier["lzma"] == 0
+
+
+def test_publishing_does_not_wait_for_recompression(db, monkeypatch):
+    scheduler = Scheduler(cpu_budget=1)
+    recompressor = Recompressor(
+        db, [Tier("deflate", min_age_days=1)], scheduler, max_seconds_per_pass=60
+    )
+    recompress = recompressor._recompress
+
+    def publish():
+        with scheduler.slot(Priority.PUBLISH):
+            pass
+
+    def recompress_while_publishing(replay, tier):
+        publisher = threading.Thread(target=publish)
+        publisher.start()
+        publisher.join(timeout=5)
+        assert not publisher.is_alive()
+        recompress(replay, tier)
+
+    monkeypatch.setattr(recompressor, "_recompress", recompress_while_publishing)
+
+    recompressor.recompress_once()
+    assert all(db.tier_of(replay) == "deflate" for replay in db.by_time)
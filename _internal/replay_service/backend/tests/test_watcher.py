@@ -0,0 +1,87 @@
+import threading
+import time
+
+from inotify_simple import flags
+
+from src.watcher import EventQueue, ReconcileEvent, ReplayEvent, ReplayWatcher
+
+
+def test_events_are_coalesced_per_filename():
+    queue = EventQueue(maxsize=10)
+    queue.put(ReplayEvent("a.rep"))
+    queue.put(ReplayEvent("b.rep"))
+    queue.put(ReplayEvent("a.rep"))
+
+    assert queue.get_batch(max_size=10, max_delay_seconds=0) == [
+        ReplayEvent("a.rep"),
+        ReplayEvent("b.rep"),
+    ]
+    assert queue.coalesced == 1
+
+    # once taken, the same filename is a new work item
+    queue.put(ReplayEvent("a.rep"))
+    assert queue.get_batch(max_size=10, max_delay_seconds=0) == [ReplayEvent("a.rep")]
+
+
+def test_coalesced_event_keeps_the_first_queued_time():
+    queue = EventQueue(maxsize=10)
+    first = ReplayEvent("a.rep", queued_at=1.0)
+    queue.put(first)
+    queue.put(ReplayEvent("a.rep", queued_at=2.0))
+
+    (event,) = queue.get_batch(max_size=10, max_delay_seconds=0)
+    assert event.queued_at == first.queued_at
+
+
+def test_full_queue_blocks_producer():
+    queue = EventQueue(maxsize=2)
+    queue.put(ReplayEvent("a.rep"))
+    queue.put(ReplayEvent("b.rep"))
+    queue.put(ReplayEvent("a.rep"))  # coalesced, doesn't need room
+
+    producer = threading.Thread(target=queue.put, args=(ReplayEvent("c.rep"),))
+    producer.start()
+    producer.join(timeout=0.1)
+    assert producer.is_alive()
+
+    assert queue.get_batch(max_size=1, max_delay_seconds=0) == [ReplayEvent("a.rep")]
+    producer.join(timeout=5)
+    assert not producer.is_alive()
+    assert queue.get_batch(max_size=10, max_delay_seconds=0) == [
+        ReplayEvent("b.rep"),
+        ReplayEvent("c.rep"),
+    ]
+    assert queue.max_depth == 2
+
+
+def test_batch_waits_for_more_events():
+    queue = EventQueue(maxsize=10)
+    queue.put(ReplayEvent("a.rep"))
+    threading.Timer(0.05, queue.put, args=(ReplayEvent("b.rep"),)).start()
+
+    assert len(queue.get_batch(max_size=10, max_delay_seconds=1)) == 2
+
+
+def test_watcher_delivers_events_quickly(replay_dir):
+    queue = EventQueue(maxsize=10)
+    watcher = ReplayWatcher(replay_dir, queue, read_delay_ms=50)
+    threading.Thread(target=watcher.watch_forever, daemon=True).start()
+
+    started = time.monotonic()
+    (replay_dir / "a.rep").write_bytes(b"replay")
+    (replay_dir / "a.rep").rename(replay_dir / "b.rep")
+    (replay_dir / "notes.txt").write_text("ignored")
+
+    batch = queue.get_batch(max_size=10, max_delay_seconds=0.2)
+    assert time.monotonic() - started < 1
+    assert batch == [ReplayEvent("a.rep"), ReplayEvent("b.rep")]
+
+
+def test_overflow_schedules_reconcile(replay_dir):
+    queue = EventQueue(maxsize=10)
+    watcher = ReplayWatcher(replay_dir, queue, read_delay_ms=50)
+
+    watcher.handle("", [flags.Q_OVERFLOW])
+    watcher.handle("", [flags.Q_OVERFLOW])
+
+    assert queue.get_batch(max_size=10, max_delay_seconds=0) == [ReconcileEvent()]